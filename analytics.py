@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from models import BallStats, Config
+from storage import AnalyticsStore
+
+logger = logging.getLogger(__name__)
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+# Ширина интервала для счетчиков за все время: один интервал, который не удаляется
+LIFETIME = 0
+
+Key = Tuple[str, str]
+
+
+class BucketRing:
+    """Счетчики по интервалам фиксированной длины в кольцевом буфере из slots ячеек.
+
+    Ячейка хранит счетчики своего интервала до сброса на диск. Если интервал не удалось
+    сбросить за полный оборот кольца, его счетчики теряются и учитываются в dropped.
+    """
+
+    def __init__(self, width: int, slots: int):
+        self.width = width
+        self._starts: List[Optional[int]] = [None] * slots
+        self._counts: List[Counter] = [Counter() for _ in range(slots)]
+        self.dropped = 0
+
+    def _index(self, start: int) -> int:
+        return start // self.width % len(self._starts)
+
+    def add(self, now: float, keys: Iterable[Key]):
+        start = int(now) // self.width * self.width
+        index = self._index(start)
+        if self._starts[index] != start:
+            self.dropped += sum(self._counts[index].values())
+            self._starts[index] = start
+            self._counts[index] = Counter()
+        counts = self._counts[index]
+        for key in keys:
+            counts[key] += 1
+
+    def drain(self) -> List[Tuple[int, Counter]]:
+        """Забирает накопленные счетчики всех интервалов, оставляя ячейки пустыми"""
+        drained = []
+        for index, start in enumerate(self._starts):
+            if start is not None and self._counts[index]:
+                drained.append((start, self._counts[index]))
+                self._counts[index] = Counter()
+        return drained
+
+    def restore(self, drained: List[Tuple[int, Counter]]):
+        """Возвращает несохраненные счетчики в кольцо, если их ячейки еще не заняты"""
+        for start, counts in drained:
+            index = self._index(start)
+            if self._starts[index] == start:
+                self._counts[index].update(counts)
+            else:
+                self.dropped += sum(counts.values())
+
+
+class UsageAnalytics:
+    """Статистика подбора мячей, не добавляющая работы в обработку запросов.
+
+    record() только увеличивает счетчики в памяти. Фоновая задача раз в интервал
+    записывает их на диск одной транзакцией и пересчитывает сводку по всем рабочим
+    процессам; команда /stats отдает уже готовый текст.
+    """
+
+    def __init__(self, store: AnalyticsStore, worker: str = "main",
+                 clock: Callable[[], float] = time.time):
+        self.store = store
+        self.worker = worker
+        self._clock = clock
+        self.minutes = BucketRing(MINUTE, Config.ANALYTICS_MINUTE_SLOTS)
+        self.hours = BucketRing(HOUR, Config.ANALYTICS_HOUR_SLOTS)
+        self.report = BallStats().get_stats_message()
+        self.flushes = 0
+        # Почасовые интервалы хранятся ограниченное время, поэтому итог за все время - отдельный счетчик
+        self.store.seed_lifetime(LIFETIME, HOUR)
+
+    def record(self, level: str, surface: str, ball_ids: Iterable[str]):
+        keys = [('total', ''), ('level', level), ('surface', surface)]
+        keys.extend(('ball', ball_id) for ball_id in ball_ids)
+        now = self._clock()
+        self.minutes.add(now, keys)
+        self.hours.add(now, keys)
+
+    async def flush(self):
+        """Записывает накопленные приращения счетчиков в хранилище"""
+        drained = [(ring, ring.drain()) for ring in (self.minutes, self.hours)]
+        items = [
+            (ring.width, start, dimension, value, count)
+            for ring, buckets in drained
+            for start, counts in buckets
+            for (dimension, value), count in counts.items()
+        ]
+        # Каждый запрос попадает ровно в один почасовой интервал, из них и считается итог
+        lifetime = Counter()
+        for _, counts in drained[1][1]:
+            lifetime.update(counts)
+        items.extend((LIFETIME, 0, dimension, value, count) for (dimension, value), count in lifetime.items())
+        if not items:
+            return
+
+        try:
+            await asyncio.to_thread(self.store.write_batch, self.worker, items)
+        except Exception as e:
+            logger.error("Error writing analytics: %s", e)
+            for ring, buckets in drained:
+                ring.restore(buckets)
+            return
+        self.flushes += 1
+
+    async def refresh(self):
+        """Пересчитывает сводку для /stats по данным всех рабочих процессов"""
+        try:
+            self.report = await asyncio.to_thread(self._build_report)
+        except Exception as e:
+            logger.error("Error aggregating analytics: %s", e)
+
+    def _build_report(self) -> str:
+        self.store.delete_older_than(MINUTE, Config.ANALYTICS_MINUTE_RETENTION)
+        self.store.delete_older_than(HOUR, Config.ANALYTICS_HOUR_RETENTION)
+
+        now = self._clock()
+        last_hour = BallStats.from_counts(self.store.rollup(MINUTE, now - HOUR))
+        last_day = BallStats.from_counts(self.store.rollup(HOUR, now - DAY))
+        all_time = BallStats.from_counts(self.store.rollup(LIFETIME))
+
+        if all_time.total_requests == 0:
+            return all_time.get_stats_message()
+        return (
+            f"🕐 За последний час: {last_hour.total_requests}\n"
+            f"📅 За сутки: {last_day.total_requests}\n\n" +
+            all_time.get_stats_message("📊 Статистика запросов за все время:")
+        )
+
+    async def run(self, interval: float = Config.ANALYTICS_FLUSH_INTERVAL):
+        """Периодически сбрасывает счетчики и обновляет сводку, пока задача не будет отменена"""
+        try:
+            await self.refresh()
+            while True:
+                await asyncio.sleep(interval)
+                await self.flush()
+                await self.refresh()
+        finally:
+            await asyncio.shield(self.flush())
+
+    def get_stats(self) -> dict:
+        return {
+            'flushes': self.flushes,
+            'dropped': self.minutes.dropped + self.hours.dropped,
+        }
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from typing import AsyncIterator, Dict
+
+from bench.httpserver import Request, Response
+
+WORDS = (
+    "Для", "вашего", "уровня", "подойдет", "мяч", "с", "хорошим", "сцеплением", "и", "прочным",
+    "покрытием,", "который", "легко", "контролировать", "в", "зале", "и", "на", "улице.",
+)
+
+
+class FakeOpenAI:
+    """Локальная замена Chat Completions API с потоковыми и обычными ответами.
+
+    Ответ начинается через latency секунд, затем идут tokens слов с паузой token_delay
+    (для обычного ответа паузы суммируются). С вероятностью error_rate запрос
+    завершается ошибкой 500, которую клиент бота повторяет.
+    """
+
+    def __init__(self, latency: float = 0.2, token_delay: float = 0.01, tokens: int = 60,
+                 error_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self.calls: Counter = Counter()
+        self.completion_tokens = 0
+
+    def _words(self):
+        return [WORDS[index % len(WORDS)] for index in range(self.tokens)]
+
+    @staticmethod
+    def _usage(request: dict, completion_tokens: int) -> Dict[str, int]:
+        prompt_tokens = sum(len(str(message.get('content', '')).split()) for message in request.get('messages', []))
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        }
+
+    async def handle(self, request: Request) -> Response:
+        if not request.path.split('?', 1)[0].endswith('/chat/completions'):
+            return Response.json({'error': {'message': "Not Found", 'type': 'invalid_request_error'}}, status=404)
+
+        body = request.json()
+        stream = bool(body.get('stream'))
+        self.calls['stream' if stream else 'completion'] += 1
+        await asyncio.sleep(self.latency)
+        if self._random.random() < self.error_rate:
+            self.calls['error'] += 1
+            return Response.json({'error': {'message': "Injected failure", 'type': 'server_error'}}, status=500)
+
+        created = int(time.time())
+        model = body.get('model', 'fake')
+        words = self._words()
+        self.completion_tokens += len(words)
+        if not stream:
+            await asyncio.sleep(self.token_delay * len(words))
+            return Response.json({
+                'id': f"chatcmpl-{self.calls['completion']}",
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': " ".join(words)},
+                    'finish_reason': 'stop',
+                }],
+                'usage': self._usage(body, len(words)),
+            })
+
+        include_usage = bool((body.get('stream_options') or {}).get('include_usage'))
+        return Response(content_type="text/event-stream",
+                        chunks=self._stream(body, words, created, model, include_usage))
+
+    async def _stream(self, body: dict, words, created: int, model: str,
+                      include_usage: bool) -> AsyncIterator[bytes]:
+        chunk_id = f"chatcmpl-stream-{self.calls['stream']}"
+
+        def event(choices, **extra) -> bytes:
+            payload = {
+                'id': chunk_id, 'object': 'chat.completion.chunk', 'created': created,
+                'model': model, 'choices': choices, **extra,
+            }
+            return b"data: " + json.dumps(payload, ensure_ascii=False).encode('utf-8') + b"\n\n"
+
+        yield event([{'index': 0, 'delta': {'role': 'assistant', 'content': ""}, 'finish_reason': None}])
+        for index, word in enumerate(words):
+            await asyncio.sleep(self.token_delay)
+            content = word if index == 0 else " " + word
+            yield event([{'index': 0, 'delta': {'content': content}, 'finish_reason': None}])
+        yield event([{'index': 0, 'delta': {}, 'finish_reason': 'stop'}])
+        if include_usage:
+            yield event([], usage=self._usage(body, len(words)))
+        yield b"data: [DONE]\n\n"
+
+    def get_stats(self) -> Dict[str, int]:
+        return {**self.calls, 'completion_tokens': self.completion_tokens}
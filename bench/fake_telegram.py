@@ -0,0 +1,152 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List
+
+from bench.httpserver import Request, Response
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+
+# Методы, в которых не бывает внедренных ошибок: без них бот не запустится или не получит обновления
+SERVICE_METHODS = frozenset(('getMe', 'getUpdates', 'deleteWebhook', 'setWebhook', 'close', 'logOut'))
+
+
+class FakeBotApi:
+    """Локальная замена Bot API: отдает обновления через getUpdates и принимает ответы бота.
+
+    Каждый запрос бота задерживается на latency плюс случайная добавка до jitter секунд;
+    с вероятностью error_rate отправка завершается ошибкой 500, с вероятностью
+    flood_rate - ответом 429 с retry_after. Сообщения бота складываются в очередь
+    чата, откуда их читает генератор нагрузки.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 flood_rate: float = 0.0, retry_after: int = 1, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self._updates: Deque[dict] = deque()
+        self._update_id = 0
+        self._arrived = asyncio.Event()
+        # Устанавливается при первом getUpdates: бот запущен и принимает обновления
+        self.polling = asyncio.Event()
+        self._message_id = 0
+        # Очереди сообщений бота по чатам: (метод Bot API, поля запроса)
+        self._inboxes: Dict[int, asyncio.Queue] = {}
+
+    def inbox(self, chat_id: int) -> asyncio.Queue:
+        queue = self._inboxes.get(chat_id)
+        if queue is None:
+            queue = self._inboxes[chat_id] = asyncio.Queue()
+        return queue
+
+    def close_inbox(self, chat_id: int):
+        self._inboxes.pop(chat_id, None)
+
+    def push_message(self, chat_id: int, text: str) -> int:
+        """Ставит в очередь getUpdates сообщение пользователя; команды размечаются как в Telegram"""
+        self._update_id += 1
+        self._message_id += 1
+        message: Dict[str, Any] = {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': 'User'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'User'},
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        self._updates.append({'update_id': self._update_id, 'message': message})
+        self._arrived.set()
+        return self._update_id
+
+    def _message(self, chat_id: int, **fields) -> dict:
+        self._message_id += 1
+        return {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private', 'first_name': 'User'},
+            'from': BOT_USER,
+            **fields,
+        }
+
+    def _photo(self) -> List[dict]:
+        self._message_id += 1
+        file_id = f"photo-{self._message_id}"
+        return [{'file_id': file_id, 'file_unique_id': file_id, 'width': 1280, 'height': 1280}]
+
+    async def handle(self, request: Request) -> Response:
+        method = request.path.rsplit('/', 1)[-1]
+        self.calls[method] += 1
+        form = request.form()
+
+        if method == 'getUpdates':
+            self.polling.set()
+            return Response.json({'ok': True, 'result': await self._get_updates(form)})
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self._random.random() * self.jitter)
+        if method not in SERVICE_METHODS:
+            roll = self._random.random()
+            if roll < self.error_rate:
+                self.errors[method] += 1
+                return Response.json(
+                    {'ok': False, 'error_code': 500, 'description': "Internal Server Error"}, status=500
+                )
+            if roll < self.error_rate + self.flood_rate:
+                self.errors[method] += 1
+                return Response.json({
+                    'ok': False, 'error_code': 429,
+                    'description': f"Too Many Requests: retry after {self.retry_after}",
+                    'parameters': {'retry_after': self.retry_after},
+                }, status=429)
+
+        return Response.json({'ok': True, 'result': self._result(method, form)})
+
+    async def _get_updates(self, form: Dict[str, str]) -> List[dict]:
+        offset = int(form.get('offset') or 0)
+        limit = int(form.get('limit') or 100)
+        timeout = float(form.get('timeout') or 0)
+        while self._updates and self._updates[0]['update_id'] < offset:
+            self._updates.popleft()
+        if not self._updates and timeout > 0:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return [update for _, update in zip(range(limit), self._updates)]
+
+    def _deliver(self, chat_id: int, method: str, form: Dict[str, str]):
+        queue = self._inboxes.get(chat_id)
+        if queue is not None:
+            queue.put_nowait((method, form))
+
+    def _result(self, method: str, form: Dict[str, str]) -> Any:
+        if method == 'getMe':
+            return BOT_USER
+        chat_id = int(form['chat_id']) if form.get('chat_id') else 0
+
+        if method == 'sendMessage':
+            self._deliver(chat_id, method, form)
+            return self._message(chat_id, text=form.get('text', ''))
+        if method == 'editMessageText':
+            return self._message(chat_id, text=form.get('text', ''))
+        if method == 'sendPhoto':
+            self._deliver(chat_id, method, form)
+            return self._message(chat_id, photo=self._photo())
+        if method == 'sendMediaGroup':
+            self._deliver(chat_id, method, form)
+            media = json.loads(form.get('media', '[]'))
+            return [self._message(chat_id, photo=self._photo()) for _ in media]
+        return True
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        return {'calls': dict(self.calls), 'errors': dict(self.errors)}
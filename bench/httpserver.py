@@ -0,0 +1,152 @@
+import asyncio
+import json
+import logging
+from email.parser import BytesParser
+from email.policy import HTTP
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger(__name__)
+
+STATUS_TEXT = {200: "OK", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error"}
+
+
+class Request:
+    """Запрос к фиктивному API: метод, путь, заголовки в нижнем регистре и тело"""
+
+    __slots__ = ('method', 'path', 'headers', 'body')
+
+    def __init__(self, method: str, path: str, headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+    def json(self) -> dict:
+        return json.loads(self.body or b'{}')
+
+    def form(self) -> Dict[str, str]:
+        """Поля формы: application/x-www-form-urlencoded или multipart/form-data (без файлов)"""
+        content_type = self.headers.get('content-type', '')
+        if content_type.startswith('multipart/form-data'):
+            message = BytesParser(policy=HTTP).parsebytes(
+                b"Content-Type: " + content_type.encode('latin-1') + b"\r\n\r\n" + self.body
+            )
+            fields = {}
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                if name and part.get_filename() is None:
+                    fields[name] = part.get_payload(decode=True).decode('utf-8')
+            return fields
+        if content_type.startswith('application/json'):
+            return {key: value if isinstance(value, str) else json.dumps(value)
+                    for key, value in self.json().items()}
+        return dict(parse_qsl(self.body.decode('utf-8'), keep_blank_values=True))
+
+
+class Response:
+    """Ответ целиком (body) или по частям (chunks) с Transfer-Encoding: chunked"""
+
+    __slots__ = ('status', 'body', 'content_type', 'chunks')
+
+    def __init__(self, status: int = 200, body: bytes = b"", content_type: str = "application/json",
+                 chunks: Optional[AsyncIterator[bytes]] = None):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.chunks = chunks
+
+    @classmethod
+    def json(cls, payload, status: int = 200) -> "Response":
+        return cls(status, json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+
+    async def write(self, writer: asyncio.StreamWriter):
+        head = f"HTTP/1.1 {self.status} {STATUS_TEXT.get(self.status, 'Unknown')}\r\nContent-Type: {self.content_type}\r\n"
+        if self.chunks is None:
+            writer.write(f"{head}Content-Length: {len(self.body)}\r\n\r\n".encode('latin-1') + self.body)
+            await writer.drain()
+            return
+
+        writer.write(f"{head}Transfer-Encoding: chunked\r\n\r\n".encode('latin-1'))
+        async for chunk in self.chunks:
+            writer.write(f"{len(chunk):x}\r\n".encode('latin-1') + chunk + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+class HttpServer:
+    """Минимальный HTTP/1.1-сервер с keep-alive для фиктивных Telegram и OpenAI.
+
+    Порт 0 - выбрать свободный; фактический порт доступен в port после start().
+    """
+
+    def __init__(self, handler: Handler, host: str = "127.0.0.1", port: int = 0):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    @staticmethod
+    async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+        body = bytearray()
+        while True:
+            size = int((await reader.readline()).split(b';', 1)[0], 16)
+            if size == 0:
+                await reader.readline()
+                return bytes(body)
+            body += await reader.readexactly(size)
+            await reader.readline()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                if headers.get('transfer-encoding', '').lower() == 'chunked':
+                    body = await self._read_chunked(reader)
+                else:
+                    body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                try:
+                    response = await self.handler(Request(method, path, headers, body))
+                except Exception as e:
+                    logger.error("Fake API handler failed: %s", e, exc_info=True)
+                    response = Response.json({'error': str(e)}, status=500)
+                await response.write(writer)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # Сервер останавливается, пока клиент ждет ответа (например, долгий getUpdates)
+            pass
+        finally:
+            writer.close()
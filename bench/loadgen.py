@@ -0,0 +1,138 @@
+import asyncio
+import json
+import random
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from models import Choices, Messages
+from bench.fake_telegram import FakeBotApi
+
+# Шаг сценария: имя обработчика бота и текст, который отправляет пользователь;
+# None - случайная кнопка клавиатуры, которую бот прислал на предыдущем шаге
+Step = Tuple[str, Optional[str]]
+
+# Сообщения, после которых бот завершает разговор, и исход сценария для каждого
+END_MESSAGES = {
+    Messages.CANCELLED: 'completed',
+    Messages.NOTHING_FOUND: 'nothing_found',
+    Messages.SESSION_EXPIRED: 'expired',
+    Messages.ERROR_API: 'error',
+}
+
+
+def percentile(samples: Sequence[float], percent: float) -> float:
+    """Перцентиль по ближайшему рангу; samples должны быть отсортированы"""
+    if not samples:
+        return 0.0
+    rank = max(0, min(len(samples) - 1, int(round(percent / 100 * len(samples) + 0.5)) - 1))
+    return samples[rank]
+
+
+def user_script(rng: random.Random) -> List[Step]:
+    """Путь пользователя по клавиатурам бота: /start -> уровень -> поверхность -> размер ->
+    цена -> детали -> фото -> завершение"""
+    return [
+        ('start', '/start'),
+        ('level_chosen', rng.choice(Choices.LEVELS)),
+        ('surface_chosen', rng.choice(Choices.SURFACES)),
+        ('size_chosen', None),
+        ('price_chosen', None),
+        ('show_details', "Показать детали"),
+        ('show_photos', "Показать фото"),
+        ('finish', "Завершить"),
+    ]
+
+
+class LoadGenerator:
+    """Проводит users пользователей через сценарий подбора, не больше concurrency одновременно.
+
+    Задержка шага - от постановки сообщения в getUpdates до ответа бота с клавиатурой
+    следующего шага (или до сообщения о завершении разговора).
+    """
+
+    def __init__(self, api: FakeBotApi, users: int, concurrency: int, step_timeout: float = 30.0,
+                 seed: int = 0, first_chat_id: int = 100000):
+        self.api = api
+        self.users = users
+        self.concurrency = concurrency
+        self.step_timeout = step_timeout
+        self.seed = seed
+        self.first_chat_id = first_chat_id
+        self.latencies: Dict[str, List[float]] = {}
+        self.outcomes: Dict[str, int] = {}
+        self.steps = 0
+        self.duration = 0.0
+
+    async def _wait_reply(self, inbox: asyncio.Queue) -> Tuple[Optional[str], List[str]]:
+        """Ждет конца ответа бота: (None, кнопки клавиатуры) или (исход завершенного разговора, [])"""
+        while True:
+            method, form = await inbox.get()
+            if method != 'sendMessage':
+                continue
+            markup = form.get('reply_markup', '')
+            if 'keyboard' in markup:
+                rows = json.loads(markup).get('keyboard', [])
+                return None, [button['text'] if isinstance(button, dict) else button
+                              for row in rows for button in row]
+            outcome = END_MESSAGES.get(form.get('text'))
+            if outcome is not None:
+                return outcome, []
+
+    async def _run_user(self, index: int):
+        chat_id = self.first_chat_id + index
+        inbox = self.api.inbox(chat_id)
+        outcome = 'incomplete'
+        try:
+            rng = random.Random(self.seed * 1000003 + index)
+            buttons: List[str] = []
+            for handler, text in user_script(rng):
+                if text is None:
+                    text = rng.choice(buttons)
+                started = time.perf_counter()
+                self.api.push_message(chat_id, text)
+                try:
+                    result, buttons = await asyncio.wait_for(self._wait_reply(inbox), self.step_timeout)
+                except asyncio.TimeoutError:
+                    outcome = 'timeout'
+                    break
+                self.latencies.setdefault(handler, []).append(time.perf_counter() - started)
+                self.steps += 1
+                if result is not None:
+                    outcome = result
+                    break
+        finally:
+            self.api.close_inbox(chat_id)
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    async def run(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def limited(index: int):
+            async with semaphore:
+                await self._run_user(index)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(limited(index) for index in range(self.users)))
+        self.duration = time.perf_counter() - started
+
+    def report(self) -> dict:
+        handlers = {}
+        for handler, samples in self.latencies.items():
+            samples = sorted(samples)
+            handlers[handler] = {
+                'count': len(samples),
+                'p50_ms': round(percentile(samples, 50) * 1000, 2),
+                'p95_ms': round(percentile(samples, 95) * 1000, 2),
+                'p99_ms': round(percentile(samples, 99) * 1000, 2),
+                'max_ms': round(samples[-1] * 1000, 2),
+            }
+        return {
+            'users': self.users,
+            'concurrency': self.concurrency,
+            'outcomes': dict(sorted(self.outcomes.items())),
+            'duration_s': round(self.duration, 3),
+            'steps': self.steps,
+            'steps_per_s': round(self.steps / self.duration, 1) if self.duration else 0.0,
+            'users_per_s': round(self.users / self.duration, 1) if self.duration else 0.0,
+            'handlers': handlers,
+        }
@@ -0,0 +1,290 @@
+"""Нагрузочный бенчмарк бота с локальными заменами Telegram Bot API и OpenAI.
+
+Запуск из корня репозитория:
+    python -m bench.run --users 1000 --concurrency 100
+    python -m bench.run --baseline bench/baselines/default.json
+    python -m bench.run --save-baseline bench/baselines/default.json
+
+При сравнении с базовой линией код выхода 1 означает регрессию. По умолчанию
+сравниваются только величины, не зависящие от машины: исходы сценариев, число
+обращений к Telegram и OpenAI на пользователя и рост памяти. Пропускная
+способность и p95 шагов сравниваются с --timings, и базовую линию для этого
+нужно записать на той же машине.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from models import Config
+from metrics import metrics
+from bot import TelegramBot, create_bot
+from bench.httpserver import HttpServer
+from bench.fake_telegram import FakeBotApi
+from bench.fake_openai import FakeOpenAI
+from bench.loadgen import LoadGenerator
+
+logger = logging.getLogger(__name__)
+
+TOKEN = "123456:bench"
+# Без лимитов Telegram бенчмарк измерял бы ограничитель скорости, а не бота
+UNLIMITED_RATE = 1e9
+# Абсолютные допуски сравнения, чтобы шум на быстрых шагах не считался регрессией
+LATENCY_SLACK_MS = 5.0
+MEMORY_SLACK_MB = 16.0
+UPSTREAMS_STOP_TIMEOUT = 10
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def rss_mb() -> float:
+    """Текущий размер резидентной памяти процесса (на Linux) или пиковый, если текущий недоступен"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def scenario(args: argparse.Namespace) -> dict:
+    """Параметры, от которых зависят результаты; сравнивать можно только одинаковые сценарии"""
+    return {
+        'users': args.users,
+        'concurrency': args.concurrency,
+        'seed': args.seed,
+        'telegram_latency': args.telegram_latency,
+        'telegram_jitter': args.telegram_jitter,
+        'telegram_error_rate': args.telegram_error_rate,
+        'telegram_flood_rate': args.telegram_flood_rate,
+        'telegram_limits': args.telegram_limits,
+        'openai_latency': args.openai_latency,
+        'openai_token_delay': args.openai_token_delay,
+        'openai_tokens': args.openai_tokens,
+        'openai_error_rate': args.openai_error_rate,
+        'prewarm': args.prewarm,
+        'stream': Config.STREAM_RECOMMENDATIONS,
+    }
+
+
+async def _serve_upstreams(args: argparse.Namespace, conn: Connection):
+    telegram = FakeBotApi(args.telegram_latency, args.telegram_jitter, args.telegram_error_rate,
+                          args.telegram_flood_rate, seed=args.seed)
+    openai = FakeOpenAI(args.openai_latency, args.openai_token_delay, args.openai_tokens,
+                        args.openai_error_rate, seed=args.seed)
+    servers = [HttpServer(telegram.handle), HttpServer(openai.handle)]
+    for server in servers:
+        await server.start()
+    conn.send((servers[0].url, servers[1].url))
+    try:
+        await telegram.polling.wait()
+        generator = LoadGenerator(telegram, args.users, args.concurrency, args.step_timeout, args.seed)
+        await generator.run()
+        conn.send(generator.report())
+        # Счетчики обращений отдаются после остановки бота, с учетом фоновых правок сообщений
+        await asyncio.to_thread(conn.recv)
+        conn.send({'telegram': telegram.get_stats(), 'openai': openai.get_stats()})
+    finally:
+        for server in servers:
+            await server.stop()
+
+
+def serve_upstreams(args: argparse.Namespace, conn: Connection):
+    """Процесс с фиктивными Telegram и OpenAI и генератором нагрузки, чтобы они
+    не делили процессор и память с измеряемым ботом"""
+    logging.basicConfig(level=logging.WARNING, format=LOG_FORMAT)
+    asyncio.run(_serve_upstreams(args, conn))
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    storage = tempfile.TemporaryDirectory(prefix='bot-bench-')
+    Config.STORAGE_DIR = storage.name
+    Config.METRICS_ENABLED = False
+    Config.PREWARM_ON_STARTUP = args.prewarm
+
+    context = multiprocessing.get_context('spawn')
+    conn, child_conn = context.Pipe()
+    upstreams = context.Process(target=serve_upstreams, args=(args, child_conn), name="bench-upstreams")
+    upstreams.start()
+    try:
+        telegram_url, openai_url = await asyncio.to_thread(conn.recv)
+        os.environ['TELEGRAM_API_URL'] = f"{telegram_url}/bot"
+        os.environ['OPENAI_BASE_URL'] = f"{openai_url}/v1"
+
+        bot = create_bot(TOKEN, "bench-key", worker_id="bench")
+        if not args.telegram_limits:
+            limiter = bot.application.bot.rate_limiter
+            limiter.overall_rate = limiter.chat_rate = limiter.chat_burst = limiter.group_rate = UNLIMITED_RATE
+        bot.setup_handlers()
+
+        application = bot.application
+        rss_start = rss_mb()
+        async with application:
+            await bot.post_init(application)
+            # Нагрузка начинается с первого getUpdates, поэтому openai импортируется заранее
+            await bot.advisor.connect()
+            await application.updater.start_polling(allowed_updates=TelegramBot.ALLOWED_UPDATES)
+            await application.start()
+            try:
+                report = await asyncio.to_thread(conn.recv)
+            finally:
+                await application.updater.stop()
+                await application.stop()
+                await bot.post_shutdown(application)
+        rss_end = rss_mb()
+        conn.send('stop')
+        report.update(await asyncio.to_thread(conn.recv))
+    finally:
+        upstreams.join(UPSTREAMS_STOP_TIMEOUT)
+        if upstreams.is_alive():
+            upstreams.terminate()
+        storage.cleanup()
+
+    for handler, stats in report['handlers'].items():
+        histogram = metrics.get_histogram('bot_handler_seconds', handler=handler)
+        if histogram is not None and histogram.count:
+            stats['handler_mean_ms'] = round(histogram.sum / histogram.count * 1000, 2)
+    report.update({
+        'scenario': scenario(args),
+        'memory': {
+            'rss_start_mb': round(rss_start, 1),
+            'rss_end_mb': round(rss_end, 1),
+            'growth_mb': round(rss_end - rss_start, 1),
+            'sessions_resident': len(bot.sessions),
+        },
+    })
+    return report
+
+
+def compare_timings(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Регрессии пропускной способности и p95 шагов; имеют смысл только для базовой
+    линии, записанной на той же машине"""
+    problems = []
+    if report['steps_per_s'] < baseline['steps_per_s'] * (1 - tolerance):
+        problems.append(f"throughput {report['steps_per_s']} steps/s < baseline {baseline['steps_per_s']}")
+
+    for handler, expected in baseline['handlers'].items():
+        current = report['handlers'].get(handler)
+        if current is None:
+            problems.append(f"{handler}: no samples")
+            continue
+        limit = expected['p95_ms'] * (1 + tolerance) + LATENCY_SLACK_MS
+        if current['p95_ms'] > limit:
+            problems.append(f"{handler}: p95 {current['p95_ms']} ms > {limit:.2f} ms")
+    return problems
+
+
+def compare(report: dict, baseline: dict, tolerance: float, timings: bool = False) -> List[str]:
+    """Регрессии относительно базовой линии: исходы, число обращений к Telegram и OpenAI
+    на пользователя и рост памяти, с timings - еще пропускная способность и p95 шагов"""
+    if report['scenario'] != baseline['scenario']:
+        return [f"scenario differs from baseline: {baseline['scenario']}"]
+
+    problems = compare_timings(report, baseline, tolerance) if timings else []
+    for outcome, count in report['outcomes'].items():
+        if outcome != 'completed' and count > baseline['outcomes'].get(outcome, 0):
+            problems.append(f"{count} users ended with {outcome}, baseline {baseline['outcomes'].get(outcome, 0)}")
+
+    users = report['users']
+    upstream = (
+        ('telegram', report['telegram']['calls'], baseline['telegram']['calls']),
+        ('openai', report['openai'], baseline['openai']),
+    )
+    for service, calls, expected_calls in upstream:
+        for method, count in calls.items():
+            expected = expected_calls.get(method, 0)
+            if count / users > expected / users * (1 + tolerance) + 0.01:
+                problems.append(f"{service} {method}: {count} calls, baseline {expected}")
+
+    growth_limit = baseline['memory']['growth_mb'] * (1 + tolerance) + MEMORY_SLACK_MB
+    if report['memory']['growth_mb'] > growth_limit:
+        problems.append(f"memory growth {report['memory']['growth_mb']} MB > {growth_limit:.1f} MB")
+    return problems
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"Users: {report['users']}, concurrency: {report['concurrency']}, duration: {report['duration_s']}s",
+        f"Throughput: {report['steps_per_s']} steps/s, {report['users_per_s']} users/s",
+        f"Outcomes: {report['outcomes']}",
+        "",
+        f"{'handler':<16}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'mean in handler':>17}",
+    ]
+    for handler, stats in report['handlers'].items():
+        lines.append(
+            f"{handler:<16}{stats['count']:>8}{stats['p50_ms']:>10}{stats['p95_ms']:>10}"
+            f"{stats['p99_ms']:>10}{stats['max_ms']:>10}{stats.get('handler_mean_ms', '-'):>17}"
+        )
+    memory = report['memory']
+    lines += [
+        "",
+        f"Memory: {memory['rss_start_mb']} -> {memory['rss_end_mb']} MB (+{memory['growth_mb']} MB), "
+        f"sessions resident: {memory['sessions_resident']}",
+        f"Telegram calls: {report['telegram']['calls']}, errors: {report['telegram']['errors']}",
+        f"OpenAI calls: {report['openai']}",
+    ]
+    return "\n".join(lines)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load benchmark with local fake Telegram and OpenAI servers")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--step-timeout', type=float, default=30.0)
+    parser.add_argument('--telegram-latency', type=float, default=0.005)
+    parser.add_argument('--telegram-jitter', type=float, default=0.005)
+    parser.add_argument('--telegram-error-rate', type=float, default=0.0)
+    parser.add_argument('--telegram-flood-rate', type=float, default=0.0)
+    parser.add_argument('--telegram-limits', action='store_true',
+                        help="keep the production Telegram rate limits")
+    parser.add_argument('--openai-latency', type=float, default=0.2)
+    parser.add_argument('--openai-token-delay', type=float, default=0.005)
+    parser.add_argument('--openai-tokens', type=int, default=60)
+    parser.add_argument('--openai-error-rate', type=float, default=0.0)
+    parser.add_argument('--prewarm', action='store_true', help="prewarm recommendations on startup")
+    parser.add_argument('--json', type=Path, help="write the report as JSON")
+    parser.add_argument('--baseline', type=Path, help="compare with a stored baseline report")
+    parser.add_argument('--save-baseline', type=Path, help="store the report as a new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed relative regression against the baseline")
+    parser.add_argument('--timings', action='store_true',
+                        help="also compare throughput and p95 (baseline recorded on this machine)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format=LOG_FORMAT)
+
+    report = asyncio.run(run_benchmark(args))
+    print(format_report(report))
+
+    for path in (args.json, args.save_baseline):
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding='utf-8')
+
+    if args.baseline is not None:
+        problems = compare(report, json.loads(args.baseline.read_text(encoding='utf-8')), args.tolerance,
+                           args.timings)
+        if problems:
+            print("\nRegressions against baseline:\n  " + "\n  ".join(problems))
+            return 1
+        print("\nNo regressions against baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
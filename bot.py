@@ -1,33 +1,75 @@
 import os
 import sys
+import time
 from pathlib import Path
+from typing import Dict, FrozenSet, List, Optional
+
+# Отсчет времени запуска - до импорта остальных модулей
+STARTED = time.perf_counter()
 
 # Получаем абсолютный путь к текущей директории
 BASE_DIR = Path(__file__).resolve().parent
 sys.path.insert(0, str(BASE_DIR))
 
+import asyncio
+import contextlib
+import json
 import logging
+import multiprocessing
+import queue
+import re
+import secrets
+import signal
 from dotenv import load_dotenv
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
+from telegram import Update, Message
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
+    InlineQueryHandler,
     MessageHandler,
     filters,
     ContextTypes,
     ConversationHandler,
 )
 
-from models import States, Messages, MenuBuilder, BallStats
-from data import HandballBallAdvisor
-
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
+from models import States, Messages, MenuBuilder, Config, WebhookSettings, Choices
+from data import HandballBallAdvisor, HandballBallDatabase
+from storage import (
+    RecommendationStore,
+    FileIdStore,
+    ConversationStore,
+    SessionRecordStore,
+    AnalyticsStore,
 )
+from media import ImageDelivery
+from imaging import build_variants, load_variants
+from updates import BackpressureQueue, ChatOrderedUpdateProcessor
+from ratelimit import PriorityRateLimiter, Priority
+from sessions import Session, SessionStore
+from persistence import ConversationPersistence, IdleConversationHandler
+from analytics import UsageAnalytics
+from logconfig import setup_logging, log_stats
+from metrics import metrics, instrument_handler, monitor_event_loop, dump_periodically, MetricsServer
+from catalog import BallList, BallCatalog, CatalogWatcher, load_balls
+from supervisor import Supervisor
+
 logger = logging.getLogger(__name__)
 
+# Длительность этапов запуска в секундах, по имени этапа
+startup_timings: Dict[str, float] = {'imports': time.perf_counter() - STARTED}
+
+
+@contextlib.contextmanager
+def startup_phase(name: str):
+    """Учитывает и записывает в журнал длительность этапа запуска"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = time.perf_counter() - started
+        logger.info("Startup phase %s took %.3fs", name, startup_timings[name])
+
 
 def setup_project_structure():
     """Создание необходимой структуры проекта"""
@@ -36,23 +78,30 @@ def setup_project_structure():
             'images/novice',
             'images/intermediate',
             'images/professional',
-            'logs'
+            Config.LOG_DIR,
+            Config.STORAGE_DIR
         ]
         for dir_path in directories:
             Path(dir_path).mkdir(parents=True, exist_ok=True)
-            logger.info(f"Created/verified directory: {dir_path}")
+        logger.info("Created/verified directories: %s", ", ".join(directories))
 
         env_path = Path('.env')
         if not env_path.exists():
             env_content = (
                 "TELEGRAM_TOKEN=your-telegram-token-here\n"
                 "OPENAI_API_KEY=your-openai-api-key-here\n"
+                "# BOT_MODE=webhook\n"
+                "# WEBHOOK_URL=https://example.com\n"
+                "# WEBHOOK_SECRET=your-webhook-secret-here\n"
+                "# ADMIN_IDS=123456789,987654321\n"
+                "# WORKERS=4\n"
+                "# TELEGRAM_API_URL=http://127.0.0.1:8081/bot\n"
             )
             env_path.write_text(env_content)
             logger.info("Created .env file")
 
     except Exception as e:
-        logger.error(f"Error in setup_project_structure: {e}")
+        logger.error("Error in setup_project_structure: %s", e)
         raise
 
 
@@ -64,26 +113,161 @@ def check_environment():
     openai_api_key = os.getenv('OPENAI_API_KEY')
 
     if not telegram_token:
-        raise ValueError("TELEGRAM_TOKEN не найден в .env файле")
+        raise ValueError("TELEGRAM_TOKEN не найден в .env файле (создать шаблон: python bot.py --bootstrap)")
 
     if not openai_api_key:
-        raise ValueError("OPENAI_API_KEY не найден в .env файле")
+        raise ValueError("OPENAI_API_KEY не найден в .env файле (создать шаблон: python bot.py --bootstrap)")
 
     return telegram_token, openai_api_key
 
 
+def get_webhook_settings() -> Optional[WebhookSettings]:
+    """Параметры вебхука из окружения; None - режим опроса (polling)"""
+    mode = os.getenv('BOT_MODE', 'polling').lower()
+    if mode == 'polling':
+        return None
+    if mode != 'webhook':
+        raise ValueError(f"Неизвестный BOT_MODE: {mode}")
+
+    url = os.getenv('WEBHOOK_URL')
+    if not url:
+        raise ValueError("WEBHOOK_URL не найден в .env файле")
+
+    secret_token = os.getenv('WEBHOOK_SECRET')
+    if not secret_token:
+        # Вебхук регистрируется заново при каждом запуске, поэтому случайный секрет подходит
+        secret_token = secrets.token_urlsafe(32)
+        logger.warning("WEBHOOK_SECRET не задан, используется случайный секрет")
+
+    return WebhookSettings(
+        url=url,
+        listen=os.getenv('WEBHOOK_LISTEN', WebhookSettings.listen),
+        port=int(os.getenv('WEBHOOK_PORT', WebhookSettings.port)),
+        path=os.getenv('WEBHOOK_PATH', WebhookSettings.path),
+        secret_token=secret_token,
+    )
+
+
+def get_admin_ids() -> FrozenSet[int]:
+    """Идентификаторы пользователей, которым доступна команда /stats"""
+    admin_ids = os.getenv('ADMIN_IDS', '')
+    try:
+        return frozenset(int(user_id) for user_id in admin_ids.replace(' ', '').split(',') if user_id)
+    except ValueError:
+        raise ValueError(f"Некорректный ADMIN_IDS: {admin_ids}")
+
+
 class TelegramBot:
     """Основной класс бота"""
 
-    def __init__(self, token: str, advisor: HandballBallAdvisor):
-        self.application = Application.builder().token(token).build()
+    # Типы обновлений, которые действительно обрабатываются хендлерами
+    ALLOWED_UPDATES = [Update.MESSAGE, Update.INLINE_QUERY]
+
+    def __init__(self, token: str, advisor: HandballBallAdvisor, images: ImageDelivery,
+                 sessions: Optional[SessionStore] = None,
+                 persistence: Optional[ConversationPersistence] = None,
+                 analytics: Optional[UsageAnalytics] = None,
+                 admin_ids: FrozenSet[int] = frozenset(),
+                 catalog_path: Optional[Path] = None,
+                 receive_updates: bool = True,
+                 api_url: Optional[str] = None,
+                 overall_rate: Optional[float] = None,
+                 build_images: bool = True):
+        builder = (
+            Application.builder()
+            .token(token)
+            .concurrent_updates(ChatOrderedUpdateProcessor(Config.MAX_CONCURRENT_UPDATES))
+            .update_queue(BackpressureQueue(Config.UPDATE_QUEUE_SIZE, Config.MAX_PENDING_UPDATES))
+            .rate_limiter(PriorityRateLimiter(overall_rate=overall_rate or Config.TELEGRAM_OVERALL_RATE))
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+        )
+        if persistence is not None:
+            builder = builder.persistence(persistence)
+        if api_url:
+            # Собственный сервер Bot API (или его локальная замена в бенчмарке)
+            builder = builder.base_url(api_url)
+        if not receive_updates:
+            # Обновления приходят от супервизора, собственный опрос Telegram не нужен
+            builder = builder.updater(None)
+        self.application = builder.build()
         self.advisor = advisor
         self.menu_builder = MenuBuilder()
-        self.stats = BallStats()
+        self.analytics = analytics or UsageAnalytics(AnalyticsStore(":memory:"))
+        self.admin_ids = admin_ids
+        self.images = images
+        # При нескольких процессах варианты изображений строит только один из них
+        self.build_images = build_images
+        self.sessions = sessions or SessionStore(Config.SESSION_MAX_COUNT, Config.SESSION_IDLE_TTL)
+        self.metrics_server: Optional[MetricsServer] = None
+        self.catalog_watcher = CatalogWatcher(catalog_path, self.install_catalog) if catalog_path else None
+        self.conversations: Optional[IdleConversationHandler] = None
+        self._background_tasks: List[asyncio.Task] = []
+        self._register_metrics()
+
+    def _register_metrics(self):
+        """Показатели, которые считываются из компонентов в момент выгрузки метрик"""
+        update_queue = self.application.update_queue
+        rate_limiter = self.application.bot.rate_limiter
+        upstream = self.advisor.upstream
+        breaker = upstream.breaker
+        recommendation_cache = self.advisor.recommendation_cache
+        metrics.gauge('cache_hit_ratio', 'Cache hit ratio', lambda: {
+            (('cache', 'recommendations'),): self.advisor.recommendation_cache.hit_ratio,
+            (('cache', 'image_buffers'),): self.images.buffers.hit_ratio,
+        })
+        metrics.gauge('circuit_open', 'Whether the OpenAI circuit breaker is open',
+                      lambda: float(breaker.state != breaker.CLOSED))
+        metrics.gauge('openai_calls', 'OpenAI calls retried, hedged or rejected by the open circuit', lambda: {
+            (('event', 'retry'),): upstream.retries,
+            (('event', 'hedge'),): upstream.hedged,
+            (('event', 'rejected'),): upstream.rejected,
+        })
+        metrics.gauge('recommendation_cache', 'Recommendation cache size, lookups and evictions', lambda: {
+            (('stat', stat),): value
+            for stat, value in recommendation_cache.get_stats().items() if stat != 'hit_ratio'
+        })
+        metrics.gauge('telegram_photos', 'Photos uploaded or sent again by file_id', lambda: {
+            (('source', 'upload'),): self.images.uploads,
+            (('source', 'file_id'),): self.images.reuses,
+        })
+        metrics.gauge('telegram_rate_limiter', 'Rate limiter requests sent, RetryAfter replies and queue peak', lambda: {
+            (('stat', stat),): value
+            for stat, value in rate_limiter.get_stats().items() if stat not in rate_limiter.queue_depth
+        })
+        metrics.gauge('update_queue_size', 'Updates waiting in the queue', update_queue.qsize)
+        metrics.gauge('updates_in_flight', 'Updates taken from the queue and not finished',
+                      lambda: update_queue.in_flight)
+        metrics.gauge('telegram_queue_depth', 'Telegram requests waiting in the rate limiter', lambda: {
+            (('priority', priority),): depth for priority, depth in rate_limiter.queue_depth.items()
+        })
+        metrics.gauge('sessions_resident', 'Sessions held in memory', lambda: len(self.sessions))
+        metrics.gauge('session_evictions', 'Sessions evicted from memory', lambda: {
+            (('reason', 'idle'),): self.sessions.idle_evictions,
+            (('reason', 'lru'),): self.sessions.lru_evictions,
+        })
+        metrics.gauge('session_loads', 'Sessions loaded back from disk', lambda: self.sessions.loads)
+        metrics.gauge('sessions_purged', 'Expired sessions deleted from disk', lambda: self.sessions.purged)
+        metrics.gauge('conversations_active', 'Conversations held by the conversation handler',
+                      lambda: self.conversations.active_count() if self.conversations is not None else 0)
+        metrics.gauge('conversation_idle_evictions', 'Conversations ended after the idle timeout',
+                      lambda: self.conversations.idle_evictions if self.conversations is not None else 0)
+        metrics.gauge('catalog_balls', 'Balls in the current catalog version', lambda: len(self.advisor.catalog.balls))
+        metrics.gauge('log_records_discarded', 'Log records dropped on a full queue or sampled out', lambda: {
+            (('reason', reason),): count for reason, count in log_stats().items()
+        })
+        metrics.gauge('startup_phase_seconds', 'Duration of a startup phase', lambda: {
+            (('phase', phase),): seconds for phase, seconds in startup_timings.items()
+        })
 
     def setup_handlers(self):
-        conv_handler = ConversationHandler(
-            entry_points=[CommandHandler("start", self.start)],
+        conv_handler = IdleConversationHandler(
+            entry_points=[
+                CommandHandler("start", self.start),
+                CommandHandler("search", self.search_command),
+                # Свободный текст вне разговора - поиск по каталогу
+                MessageHandler(filters.TEXT & ~filters.COMMAND, self.search_text),
+            ],
             states={
                 States.CHOOSING_LEVEL: [
                     MessageHandler(filters.TEXT & ~filters.COMMAND, self.level_chosen)
@@ -91,6 +275,12 @@ class TelegramBot:
                 States.CHOOSING_SURFACE: [
                     MessageHandler(filters.TEXT & ~filters.COMMAND, self.surface_chosen)
                 ],
+                States.CHOOSING_SIZE: [
+                    MessageHandler(filters.TEXT & ~filters.COMMAND, self.size_chosen)
+                ],
+                States.CHOOSING_PRICE: [
+                    MessageHandler(filters.TEXT & ~filters.COMMAND, self.price_chosen)
+                ],
                 States.SHOWING_DETAILS: [
                     MessageHandler(filters.TEXT & ~filters.COMMAND, self.show_details)
                 ],
@@ -98,95 +288,319 @@ class TelegramBot:
                     MessageHandler(filters.TEXT & ~filters.COMMAND, self.show_photos)
                 ],
             },
-            fallbacks=[CommandHandler("cancel", self.cancel)],
+            fallbacks=[
+                CommandHandler("cancel", self.cancel),
+                CommandHandler("search", self.search_command),
+            ],
+            name="ball_selection",
+            persistent=self.application.persistence is not None,
+            # Разговоры вытесняются после того же простоя, что и сессии; JobQueue не нужен
+            idle_ttl=Config.SESSION_IDLE_TTL,
         )
+        self.conversations = conv_handler
 
         self.application.add_handler(conv_handler)
         self.application.add_handler(CommandHandler("help", self.help_command))
+        self.application.add_handler(InlineQueryHandler(self.inline_query))
+        self.application.add_handler(
+            CommandHandler("stats", self.stats_command, filters=filters.User(user_id=self.admin_ids))
+        )
         self.application.add_error_handler(self.error_handler)
 
+    async def post_init(self, application: Application):
+        if Config.METRICS_ENABLED:
+            self.metrics_server = MetricsServer(metrics, Config.METRICS_HOST, Config.METRICS_PORT)
+            try:
+                await self.metrics_server.start()
+            except OSError as e:
+                logger.error("Could not start metrics server: %s", e)
+                self.metrics_server = None
+            self._background_tasks.append(asyncio.create_task(monitor_event_loop(Config.METRICS_LOOP_LAG_INTERVAL)))
+            if Config.METRICS_DUMP_FILE:
+                self._background_tasks.append(asyncio.create_task(
+                    dump_periodically(Config.METRICS_DUMP_FILE, Config.METRICS_DUMP_INTERVAL)
+                ))
+        # Клиент OpenAI создается в фоне, первый запрос не ждет импорта openai
+        self._background_tasks.append(asyncio.create_task(self.advisor.connect()))
+        if Config.PREWARM_ON_STARTUP:
+            # Прогрев идет в фоне и не задерживает прием обновлений
+            self._background_tasks.append(asyncio.create_task(self.advisor.prewarm()))
+        self._background_tasks.append(
+            asyncio.create_task(self.analytics.run(Config.ANALYTICS_FLUSH_INTERVAL))
+        )
+        if self.sessions.backend is not None:
+            self._background_tasks.append(
+                asyncio.create_task(self.sessions.run_write_behind(Config.PERSISTENCE_INTERVAL))
+            )
+        if self.catalog_watcher is not None:
+            self._background_tasks.append(asyncio.create_task(self.catalog_watcher.run()))
+        logger.info("Startup finished in %.3fs", time.perf_counter() - STARTED)
+
+    async def post_shutdown(self, application: Application):
+        for task in self._background_tasks:
+            task.cancel()
+        await asyncio.gather(*self._background_tasks, return_exceptions=True)
+        self._background_tasks.clear()
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+
+    async def install_catalog(self, catalog: BallCatalog):
+        """Готовит изображения новой версии каталога и подменяет каталог советника.
+
+        Индексы и тексты карточек уже построены вместе с каталогом, поэтому подмена -
+        одно присваивание; сессии хранят названия мячей и разрешаются по новой версии.
+        """
+        image_urls = [ball.image_url for ball in catalog.balls]
+        if self.build_images:
+            await asyncio.to_thread(build_variants, image_urls)
+        else:
+            await asyncio.to_thread(load_variants, image_urls, Config.IMAGE_VARIANTS_WAIT)
+        await asyncio.to_thread(self.images.prepare, image_urls)
+        self.advisor.catalog = catalog
+
+    async def _session_balls(self, update: Update) -> Optional[BallList]:
+        session = await self.sessions.get(update.effective_user.id)
+        if session is None:
+            return None
+        return self.advisor.catalog.resolve(session.ball_ids)
+
+    async def _finish(self, update: Update, text: str = Messages.CANCELLED) -> int:
+        self.sessions.drop(update.effective_user.id)
+        await update.message.reply_text(text)
+        return ConversationHandler.END
+
+    @instrument_handler
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        self.sessions.create(update.effective_user.id)
         await update.message.reply_text(
             Messages.WELCOME,
             reply_markup=self.menu_builder.get_level_keyboard()
         )
         return States.CHOOSING_LEVEL
 
+    @instrument_handler
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(Messages.HELP)
 
+    @instrument_handler
+    async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # Сводка пересчитывается в фоне, здесь только отправка готового текста
+        await update.message.reply_text(self.analytics.report)
+
+    @instrument_handler
+    async def search_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        query = " ".join(context.args or ())
+        if not query:
+            await update.message.reply_text(Messages.SEARCH_USAGE)
+            return ConversationHandler.END
+        return await self._reply_search(update, query)
+
+    @instrument_handler
+    async def search_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        return await self._reply_search(update, update.message.text)
+
+    async def _reply_search(self, update: Update, query: str) -> int:
+        """Отвечает найденными в каталоге мячами и переходит к просмотру деталей"""
+        balls = self.advisor.catalog.search(query, Config.SEARCH_MAX_RESULTS)
+        if not balls:
+            return await self._finish(update, Messages.SEARCH_EMPTY)
+
+        session = self.sessions.create(update.effective_user.id)
+        session.ball_ids = self.advisor.catalog.ids_of(balls)
+        await update.message.reply_text(
+            self.advisor.catalog.cards.summary(balls) +
+            "\n\nЧто бы вы хотели узнать о найденных мячах?",
+            reply_markup=self.menu_builder.get_details_keyboard()
+        )
+        return States.SHOWING_DETAILS
+
+    @instrument_handler
+    async def inline_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # Результаты одинаковы для всех пользователей, поэтому Telegram может отдавать их из своего кэша
+        await update.inline_query.answer(
+            self.advisor.catalog.inline_index.lookup(update.inline_query.query),
+            cache_time=Config.INLINE_CACHE_TIME,
+            is_personal=False
+        )
+
+    @instrument_handler
     async def level_chosen(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-        context.user_data['level'] = update.message.text
-        logger.info(f"Выбран уровень: {update.message.text}")
+        session = await self.sessions.get_or_create(update.effective_user.id)
+        session.level = update.message.text
+        logger.info("Выбран уровень: %s", update.message.text, extra={'user_id': update.effective_user.id})
         await update.message.reply_text(
             Messages.SURFACE_QUESTION,
             reply_markup=self.menu_builder.get_surface_keyboard()
         )
         return States.CHOOSING_SURFACE
 
+    @instrument_handler
     async def surface_chosen(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        session = await self.sessions.get(update.effective_user.id)
+        if session is None or session.level is None:
+            return await self._finish(update, Messages.SESSION_EXPIRED)
+        session.surface = update.message.text
+        logger.info("Выбрана поверхность: %s", update.message.text, extra={'user_id': update.effective_user.id})
+        return await self._ask_size(update, session, Messages.SIZE_QUESTION)
+
+    async def _ask_size(self, update: Update, session: Session, text: str) -> int:
+        """Предлагает только размеры, для которых есть мячи выбранного уровня и поверхности"""
+        sizes = self.advisor.catalog.size_options(session.level, session.surface)
+        if not sizes:
+            return await self._finish(update, Messages.NOTHING_FOUND)
+        await update.message.reply_text(text, reply_markup=self.menu_builder.get_size_keyboard(sizes))
+        return States.CHOOSING_SIZE
+
+    @staticmethod
+    def _parse_size(text: str) -> Optional[int]:
+        match = re.search(r'\d+', text)
+        return int(match.group()) if match else None
+
+    @staticmethod
+    def _parse_max_price(text: str) -> Optional[float]:
+        if text in Choices.PRICE_LIMITS:
+            return Choices.PRICE_LIMITS[text]
+        match = re.search(r'\d+(?:[.,]\d+)?', text)
+        return float(match.group().replace(',', '.')) if match else None
+
+    @instrument_handler
+    async def size_chosen(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+        session = await self.sessions.get(update.effective_user.id)
+        if session is None or session.level is None:
+            return await self._finish(update, Messages.SESSION_EXPIRED)
+        session.size = self._parse_size(update.message.text)
+        labels = self.advisor.catalog.price_options(session.level, session.surface, session.size)
+        if not labels:
+            # Размер введен вручную и в подборке его нет
+            session.size = None
+            return await self._ask_size(update, session, Messages.NOTHING_FOUND_FILTERS)
+        await update.message.reply_text(
+            Messages.PRICE_QUESTION,
+            reply_markup=self.menu_builder.get_price_keyboard(labels)
+        )
+        return States.CHOOSING_PRICE
+
+    async def _retry_filters(self, update: Update, session: Session) -> int:
+        """Уточнения не оставили ни одного мяча: вместо завершения разговора - снова выбор размера"""
+        session.size = None
+        session.max_price = None
+        return await self._ask_size(update, session, Messages.NOTHING_FOUND_FILTERS)
+
+    @instrument_handler
+    async def price_chosen(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         try:
-            context.user_data['surface'] = update.message.text
-            logger.info(f"Выбрана поверхность: {update.message.text}")
+            session = await self.sessions.get(update.effective_user.id)
+            if session is None or session.level is None:
+                return await self._finish(update, Messages.SESSION_EXPIRED)
+            session.max_price = self._parse_max_price(update.message.text)
 
-            self.stats.update_stats(
-                context.user_data['level'],
-                context.user_data['surface']
-            )
+            if Config.STREAM_RECOMMENDATIONS:
+                return await self._reply_streaming(update, context, session)
 
-            recommendation, balls = await self.advisor.get_recommendation(context.user_data)
-            context.user_data['current_balls'] = balls
+            recommendation, balls = await self.advisor.get_recommendation(session.as_user_data())
+            session.ball_ids = self.advisor.catalog.ids_of(balls)
 
             await update.message.reply_text(recommendation)
 
             if balls:
+                # Учитываются только подборки, в которых нашлись мячи
+                self.analytics.record(session.level, session.surface, session.ball_ids)
                 await update.message.reply_text(
                     "Что бы вы хотели узнать о рекомендованных мячах?",
                     reply_markup=self.menu_builder.get_details_keyboard()
                 )
                 return States.SHOWING_DETAILS
             else:
-                await update.message.reply_text(
-                    "К сожалению, не найдено подходящих мячей для ваших критериев. "
-                    "Попробуйте изменить параметры поиска."
-                )
-                return ConversationHandler.END
+                return await self._retry_filters(update, session)
 
         except Exception as e:
-            logger.error(f"Error in surface_chosen: {e}", exc_info=True)
-            await update.message.reply_text(Messages.ERROR_API)
-            return ConversationHandler.END
+            logger.error("Error in price_chosen: %s", e, exc_info=True)
+            return await self._finish(update, Messages.ERROR_API)
+
+    async def _reply_streaming(self, update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session) -> int:
+        """Сразу отправляет подборку из каталога, а текст GPT дописывает в отдельное сообщение"""
+        user_data = session.as_user_data()
+        balls = self.advisor.get_balls(user_data)
+        session.ball_ids = self.advisor.catalog.ids_of(balls)
+
+        if not balls:
+            return await self._retry_filters(update, session)
+        self.analytics.record(session.level, session.surface, session.ball_ids)
 
+        placeholder = await update.message.reply_text(Messages.RECOMMENDATION_PENDING)
+        await update.message.reply_text(
+            self.advisor.catalog.cards.summary(balls) +
+            "\n\nЧто бы вы хотели узнать о рекомендованных мячах?",
+            reply_markup=self.menu_builder.get_details_keyboard()
+        )
+
+        # Генерация идет в фоне: разговор сразу переходит к следующему шагу
+        context.application.create_task(self._stream_into_message(placeholder, user_data), update=update)
+        return States.SHOWING_DETAILS
+
+    async def _stream_into_message(self, message: Message, user_data: dict):
+        loop = asyncio.get_running_loop()
+        last_edit_at = 0.0
+        shown_text = Messages.RECOMMENDATION_PENDING
+        text = None
+
+        try:
+            async for text in self.advisor.stream_recommendation(user_data):
+                if loop.time() - last_edit_at >= Config.STREAM_EDIT_INTERVAL:
+                    shown_text = await self._edit_message(message, text, shown_text)
+                    last_edit_at = loop.time()
+        except Exception as e:
+            logger.error("Error streaming recommendation: %s", e)
+            if not text:
+                text = self.advisor.fallback_recommendation(user_data)
+
+        if text and text != shown_text:
+            # Пауза, чтобы финальная правка не нарушила интервал между правками
+            await asyncio.sleep(max(0.0, last_edit_at + Config.STREAM_EDIT_INTERVAL - loop.time()))
+            await self._edit_message(message, text, shown_text)
+
+    @staticmethod
+    async def _edit_message(message: Message, text: str, shown_text: str) -> str:
+        if text == shown_text:
+            return shown_text
+        try:
+            await message.edit_text(text)
+        except BadRequest as e:
+            logger.warning("Could not edit recommendation message: %s", e)
+            return shown_text
+        return text
+
+    @instrument_handler
     async def show_details(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         if update.message.text == "Завершить":
-            await update.message.reply_text(Messages.CANCELLED)
-            return ConversationHandler.END
+            return await self._finish(update)
 
         if update.message.text == "Показать детали":
-            balls = context.user_data.get('current_balls', [])
-            for ball in balls:
-                message = (
-                        f"🏐 *{ball.name}*\n"
-                        f"📊 Уровень: {ball.level}\n"
-                        f"💰 Цена: {ball.price:.2f} €\n"
-                        f"📏 Размер: {ball.size}\n"
-                        f"🏭 Материал: {ball.material}\n"
-                        f"🏟 Тип поверхности: {ball.surface_type}\n\n"
-                        f"📝 Описание: {ball.description}\n\n"
-                        f"✨ Особенности:\n" +
-                        "\n".join(f"• {feature}" for feature in ball.features)
+            balls = await self._session_balls(update)
+            if balls is None:
+                return await self._finish(update, Messages.SESSION_EXPIRED)
+            # Все карточки уходят одним сообщением (или несколькими, если не помещаются),
+            # клавиатура прикрепляется к последнему
+            messages = self.advisor.catalog.cards.details(balls)
+            for message in messages[:-1]:
+                # Ярлыки Message.reply_* не принимают rate_limit_args, поэтому через бота
+                await context.bot.send_message(
+                    chat_id=update.effective_chat.id,
+                    text=message,
+                    parse_mode='Markdown',
+                    rate_limit_args={'priority': Priority.BULK}
+                )
+            if messages:
+                await update.message.reply_text(
+                    messages[-1],
+                    parse_mode='Markdown',
+                    reply_markup=self.menu_builder.get_after_details_keyboard()
+                )
+            if not messages:
+                await update.message.reply_text(
+                    "Что еще вы хотели бы узнать?",
+                    reply_markup=self.menu_builder.get_after_details_keyboard()
                 )
-                await update.message.reply_text(message, parse_mode='Markdown')
-
-            keyboard = [
-                [KeyboardButton("Показать фото")],
-                [KeyboardButton("Завершить")]
-            ]
-            reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
-            await update.message.reply_text(
-                "Что еще вы хотели бы узнать?",
-                reply_markup=reply_markup
-            )
             return States.SHOWING_PHOTOS
 
         if update.message.text == "Показать фото":
@@ -194,77 +608,228 @@ class TelegramBot:
 
         return States.SHOWING_DETAILS
 
+    @instrument_handler
     async def show_photos(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         if update.message.text == "Завершить":
-            await update.message.reply_text(Messages.CANCELLED)
-            return ConversationHandler.END
+            return await self._finish(update)
 
         if update.message.text == "Показать фото":
-            balls = context.user_data.get('current_balls', [])
-            for ball in balls:
-                try:
-                    image_path = Path(ball.image_url)
-                    if image_path.exists():
-                        with open(image_path, 'rb') as photo:
-                            await update.message.reply_photo(
-                                photo=photo,
-                                caption=f"🏐 {ball.name}\n💰 Цена: {ball.price:.2f} €\n📏 Размер: {ball.size}"
-                            )
-                    else:
-                        await update.message.reply_text(
-                            f"🏐 Изображение мяча {ball.name} временно недоступно\n"
-                            f"💰 Цена: {ball.price:.2f} €\n"
-                            f"📏 Размер: {ball.size}"
-                        )
-                except Exception as e:
-                    logger.error(f"Error sending photo for {ball.name}: {e}")
-                    await update.message.reply_text(f"Не удалось загрузить фото мяча {ball.name}")
-
-            keyboard = [
-                [KeyboardButton("Показать детали")],
-                [KeyboardButton("Завершить")]
-            ]
-            reply_markup = ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
+            balls = await self._session_balls(update)
+            if balls is None:
+                return await self._finish(update, Messages.SESSION_EXPIRED)
+            try:
+                missing = await self.images.send_photos(
+                    update.message,
+                    balls,
+                    self.advisor.catalog.cards,
+                    rate_limit_args={'priority': Priority.BULK}
+                )
+            except Exception as e:
+                logger.error("Error sending photos: %s", e)
+                missing = []
+                await update.message.reply_text("Не удалось загрузить фото мячей")
+
+            if missing:
+                await update.message.reply_text("\n\n".join(
+                    f"🏐 Изображение мяча {ball.name} временно недоступно\n"
+                    f"💰 Цена: {ball.price:.2f} €\n"
+                    f"📏 Размер: {ball.size}"
+                    for ball in missing
+                ))
+
             await update.message.reply_text(
                 "Что еще вы хотели бы узнать?",
-                reply_markup=reply_markup
+                reply_markup=self.menu_builder.get_after_photos_keyboard()
             )
             return States.SHOWING_DETAILS
 
         return States.SHOWING_PHOTOS
 
+    @instrument_handler
     async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-        await update.message.reply_text(Messages.CANCELLED)
-        return ConversationHandler.END
+        return await self._finish(update)
 
     async def error_handler(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
-        logger.error(f"Exception while handling an update: {context.error}")
+        logger.error("Exception while handling an update: %s", context.error, exc_info=context.error)
         if isinstance(update, Update) and update.message:
             await update.message.reply_text(Messages.ERROR_API)
 
-    def run(self):
+    async def serve(self, source: multiprocessing.Queue):
+        """Обрабатывает обновления, которые супервизор передает через очередь source.
+
+        None в очереди или SIGTERM завершают работу; без Updater хуки post_init
+        и post_shutdown вызываются здесь же.
+        """
+        self.setup_handlers()
+        stopping = asyncio.Event()
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+        except NotImplementedError:
+            pass
+
+        application = self.application
+        async with application:
+            await self.post_init(application)
+            await application.start()
+            try:
+                while not stopping.is_set():
+                    try:
+                        payload = await asyncio.to_thread(source.get, timeout=Config.WORKER_RESTART_DELAY)
+                    except queue.Empty:
+                        continue
+                    if payload is None:
+                        break
+                    await application.update_queue.put(Update.de_json(json.loads(payload), application.bot))
+            finally:
+                await application.stop()
+                await self.post_shutdown(application)
+
+    def run(self, webhook: Optional[WebhookSettings] = None):
         self.setup_handlers()
-        self.application.run_polling(allowed_updates=Update.ALL_TYPES)
 
+        if webhook is None:
+            self.application.run_polling(allowed_updates=self.ALLOWED_UPDATES)
+            return
+
+        logger.info("Starting webhook on %s:%s/%s", webhook.listen, webhook.port, webhook.path)
+        self.application.run_webhook(
+            listen=webhook.listen,
+            port=webhook.port,
+            url_path=webhook.path,
+            webhook_url=f"{webhook.url.rstrip('/')}/{webhook.path}",
+            secret_token=webhook.secret_token,
+            allowed_updates=self.ALLOWED_UPDATES,
+        )
 
-def main():
-    """Основная функция запуска бота"""
+
+def get_worker_count() -> int:
+    """Число рабочих процессов из WORKERS; 1 - обычный запуск в одном процессе"""
+    workers = os.getenv('WORKERS', str(Config.WORKERS))
     try:
+        count = int(workers)
+    except ValueError:
+        raise ValueError(f"Некорректный WORKERS: {workers}")
+    if count < 1:
+        raise ValueError(f"Некорректный WORKERS: {workers}")
+    return count
+
+
+def create_bot(telegram_token: str, openai_api_key: str, worker_id: str = "main",
+               receive_updates: bool = True, workers: int = 1, build_images: bool = True) -> TelegramBot:
+    """Собирает бота с хранилищами; рабочие процессы супервизора открывают одни и те же базы.
+    Общий лимит Telegram относится к токену, поэтому делится между workers процессами"""
+    storage_dir = Path(Config.STORAGE_DIR)
+    with startup_phase('catalog'):
+        store = RecommendationStore(storage_dir / Config.RECOMMENDATION_STORE_FILE)
+        advisor = HandballBallAdvisor(openai_api_key, store=store)
+        advisor.load_persisted()
+    with startup_phase('images'):
+        # Варианты строятся при --bootstrap (или супервизором), здесь они только находятся по манифесту
+        load_variants(ball.image_url for ball in advisor.catalog.balls)
+        images = ImageDelivery(FileIdStore(storage_dir / Config.FILE_ID_STORE_FILE))
+        images.prepare(ball.image_url for ball in advisor.catalog.balls)
+    with startup_phase('stores'):
+        sessions = SessionStore(
+            Config.SESSION_MAX_COUNT,
+            Config.SESSION_IDLE_TTL,
+            backend=SessionRecordStore(storage_dir / Config.SESSION_STORE_FILE),
+            touch_interval=Config.SESSION_TOUCH_INTERVAL,
+            purge_interval=Config.SESSION_PURGE_INTERVAL
+        )
+        persistence = ConversationPersistence(ConversationStore(storage_dir / Config.CONVERSATION_STORE_FILE))
+        analytics = UsageAnalytics(AnalyticsStore(storage_dir / Config.ANALYTICS_STORE_FILE), worker=worker_id)
+    with startup_phase('application'):
+        return TelegramBot(
+            telegram_token, advisor, images, sessions, persistence, analytics, get_admin_ids(),
+            catalog_path=HandballBallDatabase.CATALOG_PATH,
+            receive_updates=receive_updates,
+            api_url=os.getenv('TELEGRAM_API_URL'),
+            overall_rate=Config.TELEGRAM_OVERALL_RATE / workers,
+            build_images=build_images
+        )
+
+
+def bootstrap():
+    """Подготовка файловой системы перед первым запуском: каталоги, шаблон .env и варианты
+    изображений. Выполняется отдельно (python bot.py --bootstrap), а не при каждом запуске бота"""
+    with startup_phase('directories'):
         setup_project_structure()
-        logger.info("Project structure created successfully")
+    with startup_phase('image_variants'):
+        balls_by_level = load_balls(HandballBallDatabase.CATALOG_PATH)
+        ready = build_variants(ball.image_url for balls in balls_by_level.values() for ball in balls)
+    logger.info("Bootstrap finished, image variants ready: %s", ready)
+
+
+def run_worker(index: int, workers: int, source: multiprocessing.Queue):
+    """Точка входа рабочего процесса супервизора"""
+    # Ctrl+C получает вся группа процессов; останавливает рабочих супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_id = f"worker-{index}"
+    # У каждого процесса свой порт и файл метрик и свой файл журнала;
+    # прогрев рекомендаций через общую базу и сборку вариантов изображений
+    # при перезагрузке каталога достаточно выполнить одному процессу
+    Config.METRICS_PORT += index
+    Config.METRICS_DUMP_FILE = str(Path(Config.LOG_DIR) / f"metrics-{worker_id}.prom")
+    Config.LOG_FILE = f"bot-{worker_id}.jsonl"
+    Config.PREWARM_ON_STARTUP = Config.PREWARM_ON_STARTUP and index == 0
+    with startup_phase('logging'):
+        setup_logging()
+    try:
+        with startup_phase('environment'):
+            telegram_token, openai_api_key = check_environment()
+        bot = create_bot(telegram_token, openai_api_key, worker_id, receive_updates=False, workers=workers,
+                         build_images=index == 0)
+        logger.info("Worker %s initialized", worker_id)
+        asyncio.run(bot.serve(source))
+    except Exception as e:
+        logger.critical("Critical error in %s: %s", worker_id, e, exc_info=True)
+        sys.exit(1)
+
+
+def supervise(telegram_token: str, workers: int):
+    """Запуск нескольких рабочих процессов с распределением обновлений по чатам"""
+    # Варианты изображений готовятся один раз, рабочие процессы только находят их на диске
+    with startup_phase('image_variants'):
+        balls_by_level = load_balls(HandballBallDatabase.CATALOG_PATH)
+        build_variants(ball.image_url for balls in balls_by_level.values() for ball in balls)
+    supervisor = Supervisor(
+        telegram_token, run_worker, workers, TelegramBot.ALLOWED_UPDATES,
+        api_url=os.getenv('TELEGRAM_API_URL')
+    )
+    try:
+        asyncio.run(supervisor.run())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        logger.info("Supervisor stopped")
 
-        telegram_token, openai_api_key = check_environment()
-        logger.info("Environment checked successfully")
 
-        advisor = HandballBallAdvisor(openai_api_key)
-        bot = TelegramBot(telegram_token, advisor)
+def main():
+    """Основная функция запуска бота"""
+    with startup_phase('logging'):
+        setup_logging()
+    try:
+        if '--bootstrap' in sys.argv[1:]:
+            bootstrap()
+            return
+
+        with startup_phase('environment'):
+            telegram_token, openai_api_key = check_environment()
+            webhook = get_webhook_settings()
+            workers = get_worker_count()
+
+        if workers > 1:
+            if webhook is not None:
+                raise ValueError("BOT_MODE=webhook не поддерживается при WORKERS больше 1")
+            supervise(telegram_token, workers)
+            return
+
+        bot = create_bot(telegram_token, openai_api_key, os.getenv('WORKER_ID', 'main'))
         logger.info("Bot initialized, starting...")
-        bot.run()
+        bot.run(webhook)
 
     except Exception as e:
-        logger.critical(f"Critical error: {e}", exc_info=True)
+        logger.critical("Critical error: %s", e, exc_info=True)
         sys.exit(1)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,150 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class TTLCache:
+    """Ограниченный по размеру кэш с временем жизни записей и вытеснением LRU"""
+
+    def __init__(self, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires_at = entry
+        if expires_at <= self._clock():
+            del self._data[key]
+            self.misses += 1
+            return None
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        expires_at = self._clock() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get_stats(self) -> dict:
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hit_ratio,
+        }
+
+
+class SingleFlight:
+    """Объединяет одновременные запросы с одинаковым ключом в один вызов"""
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        future = self.join(key)
+        if future is None:
+            future = self._register(key, asyncio.ensure_future(func()))
+
+        # shield: отмена одного ожидающего не должна отменять общий запрос
+        return await asyncio.shield(future)
+
+    def join(self, key: Hashable) -> Optional[asyncio.Future]:
+        """Возвращает уже выполняющийся запрос с таким ключом, если он есть"""
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.shared += 1
+        return future
+
+    def lead(self, key: Hashable) -> asyncio.Future:
+        """Регистрирует запрос, результат которого вызывающий установит сам"""
+        return self._register(key, asyncio.get_running_loop().create_future())
+
+    def _register(self, key: Hashable, future: asyncio.Future) -> asyncio.Future:
+        self.calls += 1
+        self._in_flight[key] = future
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return future
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        if not future.cancelled():
+            # Помечаем исключение как полученное, даже если все ожидающие ушли
+            future.exception()
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
+
+
+class ByteBufferCache:
+    """LRU-кэш двоичных данных, ограниченный суммарным размером в байтах"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        value = self._data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        previous = self._data.pop(key, None)
+        if previous is not None:
+            self.total_bytes -= len(previous)
+        self._data[key] = value
+        self.total_bytes += len(value)
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self.total_bytes -= len(evicted)
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self) -> int:
+        return len(self._data)
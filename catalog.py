@@ -0,0 +1,299 @@
+import asyncio
+import bisect
+import itertools
+import json
+import logging
+import mmap
+import os
+from array import array
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple, Union
+
+from models import HandballBall, Choices, Config, SIZE_CIRCUMFERENCE, parse_sizes
+from render import CardRenderer
+from search import SearchIndex, parse_query
+from inline import InlineIndex
+
+BallList = Tuple[HandballBall, ...]
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_surface(surface: str) -> str:
+    """Приводит название поверхности к единому виду для индексации"""
+    return surface.strip().lower()
+
+
+def _slice(ranks: Sequence[int], start: int, end: int) -> Sequence[int]:
+    """Часть отсортированного массива рангов, попадающая в [start, end)"""
+    return ranks[bisect.bisect_left(ranks, start):bisect.bisect_left(ranks, end)]
+
+
+def _intersect(smaller: Sequence[int], larger: Sequence[int]) -> List[int]:
+    """Пересечение отсортированных массивов: двоичный поиск каждого элемента меньшего в большем"""
+    if len(smaller) > len(larger):
+        smaller, larger = larger, smaller
+    result = []
+    for rank in smaller:
+        position = bisect.bisect_left(larger, rank)
+        if position < len(larger) and larger[position] == rank:
+            result.append(rank)
+    return result
+
+
+def load_balls(path: Union[str, Path]) -> Dict[str, List[HandballBall]]:
+    """Читает каталог в формате JSON Lines через отображение файла в память.
+
+    Файл не копируется в память целиком: строки разбираются по одной прямо из отображения.
+    """
+    balls_by_level: Dict[str, List[HandballBall]] = {}
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            raise ValueError(f"Файл каталога пуст: {path}")
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for line_number, line in enumerate(iter(data.readline, b''), 1):
+                if not line.strip():
+                    continue
+                try:
+                    ball = HandballBall.from_record(json.loads(line))
+                except (ValueError, KeyError, TypeError) as e:
+                    raise ValueError(f"Ошибка в строке {line_number} каталога {path}: {e!r}") from e
+                level_key = Choices.LEVEL_KEYS.get(ball.level, Choices.DEFAULT_LEVEL_KEY)
+                balls_by_level.setdefault(level_key, []).append(ball)
+    return balls_by_level
+
+
+class BallCatalog:
+    """Каталог мячей, построенный один раз, с заранее рассчитанными индексами"""
+
+    def __init__(self, balls_by_level: Dict[str, List[HandballBall]]):
+        self.by_level: Dict[str, BallList] = {
+            level_key: tuple(balls) for level_key, balls in balls_by_level.items()
+        }
+        self.balls: BallList = tuple(
+            ball for balls in self.by_level.values() for ball in balls
+        )
+        # Название мяча служит его идентификатором в сессиях пользователей
+        self.by_id: Dict[str, HandballBall] = {ball.name: ball for ball in self.balls}
+
+        # Мячи по возрастанию цены; номер мяча в этом порядке (ранг) используется во всех
+        # индексах диапазонов, поэтому диапазон цены - это отрезок рангов [start, end)
+        self.by_price: BallList = tuple(sorted(self.balls, key=lambda ball: ball.price))
+        self._prices = array('d', (ball.price for ball in self.by_price))
+        self._ranks: Dict[str, int] = {ball.name: rank for rank, ball in enumerate(self.by_price)}
+        # Размер -> ранги мячей этого размера; ранги идут по возрастанию, массивы уже отсортированы
+        size_ranks: Dict[int, List[int]] = {}
+        for rank, ball in enumerate(self.by_price):
+            for size in ball.sizes:
+                size_ranks.setdefault(size, []).append(rank)
+        self._size_ranks: Dict[int, array] = {size: array('l', ranks) for size, ranks in size_ranks.items()}
+
+        # Таблица готовых ответов для всех комбинаций с клавиатур
+        self.answers: Dict[Tuple[str, Optional[str]], BallList] = {}
+        for level in Choices.LEVELS:
+            self.answers[(level, None)] = self._select(level, None)
+            for surface in Choices.SURFACES:
+                self.answers[(level, surface)] = self._select(level, surface)
+
+        self._answer_ranks: Dict[Tuple[str, Optional[str]], array] = {
+            key: self._ranks_of(balls) for key, balls in self.answers.items()
+        }
+        # Кнопки размеров, для которых в ответе есть мячи: пустые варианты не предлагаются
+        self._size_options: Dict[Tuple[str, Optional[str]], Tuple[str, ...]] = {
+            key: self._sizes_in(balls) for key, balls in self.answers.items()
+        }
+        # Ответы для всех комбинаций кнопок размера и цены: (уровень, поверхность, размеры, цена)
+        self._narrowed: Dict[Tuple[str, Optional[str], Optional[FrozenSet[int]], float], BallList] = {}
+        size_choices = [None] + [parse_sizes(label) for label in Choices.SIZES]
+        price_choices = [float('inf') if limit is None else limit for limit in Choices.PRICE_LIMITS.values()]
+        for (level, surface), answer_ranks in self._answer_ranks.items():
+            for sizes in size_choices:
+                for max_price in price_choices:
+                    if sizes is not None or max_price != float('inf'):
+                        self._narrowed[(level, surface, sizes, max_price)] = self.query(
+                            sizes, max_price=max_price, within=answer_ranks
+                        )
+
+        # Карточки готовятся и для суженных подборок, чтобы ответы с клавиатур не рендерились заново
+        self.cards = CardRenderer(self.balls, itertools.chain(self.answers.values(), self._narrowed.values()))
+        self.search_index = SearchIndex(self.balls)
+        self.inline_index = InlineIndex(self.balls, self.cards)
+
+    @classmethod
+    def from_file(cls, path: Union[str, Path]) -> 'BallCatalog':
+        return cls(load_balls(path))
+
+    def lookup(self, level: str, surface: Optional[str] = None) -> BallList:
+        """Возвращает мячи для уровня и поверхности"""
+        answer = self.answers.get((level, surface))
+        if answer is not None:
+            return answer
+        # Произвольный ввод вне клавиатуры: считаем без кэширования,
+        # чтобы таблица ответов не росла от пользовательского текста
+        return self._select(level, surface)
+
+    def narrow(self, level: str, surface: Optional[str] = None, sizes: Optional[Iterable[int]] = None,
+               min_price: float = 0.0, max_price: float = float('inf')) -> BallList:
+        """Мячи для уровня и поверхности, суженные по размеру и цене, по возрастанию цены"""
+        if sizes is None and min_price <= 0 and max_price == float('inf'):
+            return self.lookup(level, surface)
+        if min_price <= 0:
+            answer = self._narrowed.get((level, surface, None if sizes is None else frozenset(sizes), max_price))
+            if answer is not None:
+                return answer
+
+        answer_ranks = self._answer_ranks.get((level, surface))
+        if answer_ranks is None:
+            answer_ranks = self._ranks_of(self.lookup(level, surface))
+        return self.query(sizes, min_price, max_price, within=answer_ranks)
+
+    def size_options(self, level: str, surface: Optional[str] = None) -> Tuple[str, ...]:
+        """Кнопки размеров из Choices.SIZES, для которых есть мячи уровня и поверхности"""
+        options = self._size_options.get((level, surface))
+        return options if options is not None else self._sizes_in(self.lookup(level, surface))
+
+    def price_options(self, level: str, surface: Optional[str] = None,
+                      size: Optional[int] = None) -> Tuple[str, ...]:
+        """Кнопки цены из Choices.PRICE_LIMITS, под которые попадает хотя бы один мяч"""
+        balls = self.narrow(level, surface, sizes=None if size is None else (size,))
+        if not balls:
+            return ()
+        cheapest = min(ball.price for ball in balls)
+        return tuple(
+            label for label, limit in Choices.PRICE_LIMITS.items() if limit is None or limit >= cheapest
+        )
+
+    @staticmethod
+    def _sizes_in(balls: BallList) -> Tuple[str, ...]:
+        available = frozenset().union(*(ball.sizes for ball in balls))
+        return tuple(label for label in Choices.SIZES if parse_sizes(label) <= available)
+
+    def query(self, sizes: Optional[Iterable[int]] = None, min_price: float = 0.0,
+              max_price: float = float('inf'), within: Optional[Sequence[int]] = None) -> BallList:
+        """Мячи с любым из размеров sizes и ценой в [min_price, max_price], по возрастанию цены.
+
+        Диапазон цены находится двоичным поиском, размеры - срезами отсортированных массивов
+        рангов; within ограничивает результат заранее известным набором рангов.
+        """
+        start = bisect.bisect_left(self._prices, min_price)
+        end = bisect.bisect_right(self._prices, max_price)
+
+        if sizes is None:
+            ranks: Sequence[int] = range(start, end)
+        else:
+            postings = [
+                _slice(self._size_ranks[size], start, end) for size in set(sizes) if size in self._size_ranks
+            ]
+            ranks = postings[0] if len(postings) == 1 else sorted(set().union(*postings))
+        if within is not None:
+            ranks = _intersect(_slice(within, start, end), ranks)
+        return tuple(self.by_price[rank] for rank in ranks)
+
+    def in_circumference(self, low: float, high: float, min_price: float = 0.0,
+                         max_price: float = float('inf')) -> BallList:
+        """Мячи, диапазон окружности которых пересекается с [low, high] см"""
+        sizes = [
+            size for size, (size_low, size_high) in SIZE_CIRCUMFERENCE.items()
+            if size_low <= high and low <= size_high
+        ]
+        return tuple(
+            ball for ball in self.query(sizes, min_price, max_price)
+            if ball.circumference is not None and ball.circumference[0] <= high and low <= ball.circumference[1]
+        )
+
+    def search(self, text: str, limit: Optional[int] = None) -> BallList:
+        """Поиск по свободному тексту без обращения к GPT"""
+        query = parse_query(text)
+        if query.terms:
+            return self.search_index.search(query, limit)
+        # Запрос только из ограничений размера, окружности и цены отвечается индексами диапазонов
+        if query.circumference is None:
+            return self.query(query.sizes, query.min_price, query.max_price)[:limit]
+        balls = self.in_circumference(*query.circumference, query.min_price, query.max_price)
+        if query.sizes is not None:
+            balls = tuple(ball for ball in balls if query.sizes & ball.sizes)
+        return balls[:limit]
+
+    @staticmethod
+    def ids_of(balls: Iterable[HandballBall]) -> Tuple[str, ...]:
+        return tuple(ball.name for ball in balls)
+
+    def resolve(self, ball_ids: Iterable[str]) -> BallList:
+        """Мячи по идентификаторам; отсутствующие в каталоге пропускаются"""
+        return tuple(self.by_id[ball_id] for ball_id in ball_ids if ball_id in self.by_id)
+
+    def _ranks_of(self, balls: Iterable[HandballBall]) -> array:
+        return array('l', sorted(self._ranks[ball.name] for ball in balls if ball.name in self._ranks))
+
+    def _select(self, level: str, surface: Optional[str]) -> BallList:
+        level_key = Choices.LEVEL_KEYS.get(level, Choices.DEFAULT_LEVEL_KEY)
+        balls = self.by_level.get(level_key, ())
+
+        if surface is None:
+            return balls
+
+        surface = surface.lower()
+        filtered_balls = tuple(
+            ball for ball in balls
+            if (normalize_surface(ball.surface_type) in surface or
+                'универсальный' in normalize_surface(ball.surface_type) or
+                'универсальное' in surface)
+        )
+        return filtered_balls if filtered_balls else balls
+
+
+class CatalogWatcher:
+    """Следит за файлом каталога и передает новую версию каталога в on_reload.
+
+    Каталог со всеми индексами и готовыми текстами строится в пуле потоков, поэтому
+    обработка обновлений не приостанавливается; подмена выполняется одним присваиванием
+    в on_reload. Если файл содержит ошибку, остается прежняя версия каталога.
+    Файл лучше обновлять атомарно: записать рядом и переименовать.
+    """
+
+    def __init__(self, path: Union[str, Path], on_reload: Callable[['BallCatalog'], Awaitable[None]],
+                 interval: float = Config.CATALOG_WATCH_INTERVAL):
+        self.path = Path(path)
+        self.on_reload = on_reload
+        self.interval = interval
+        self.reloads = 0
+        self._signature = self._stat()
+
+    def _stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = self.path.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    async def check(self) -> bool:
+        """Перезагружает каталог, если файл изменился с прошлой проверки"""
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+
+        try:
+            catalog = await asyncio.to_thread(BallCatalog.from_file, self.path)
+        except Exception as e:
+            logger.error("Error reloading catalog %s: %s", self.path, e)
+            return False
+
+        try:
+            await self.on_reload(catalog)
+        except Exception as e:
+            # Файл верный, но установить версию не удалось: повторим на следующей проверке
+            self._signature = None
+            logger.error("Error installing catalog %s: %s", self.path, e, exc_info=True)
+            return False
+        self.reloads += 1
+        logger.info("Catalog reloaded from %s: %d balls", self.path, len(catalog.balls))
+        return True
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error("Error checking catalog %s: %s", self.path, e, exc_info=True)
@@ -1,7 +1,19 @@
+import asyncio
+import contextlib
 import logging
-from typing import Dict, List, Any, Tuple
-from openai import AsyncOpenAI
-from models import HandballBall, Config, ImagePaths
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Any, AsyncIterator, Optional, Tuple
+from models import HandballBall, Config, Choices
+from catalog import BallCatalog, BallList, load_balls
+from cache import TTLCache, SingleFlight
+from storage import RecommendationStore
+from resilience import CircuitBreaker, CircuitOpenError, ResilientCaller
+from metrics import metrics, record_token_usage
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 logger = logging.getLogger(__name__)
 
@@ -9,220 +21,244 @@ logger = logging.getLogger(__name__)
 class HandballBallDatabase:
     """База данных гандбольных мячей"""
 
-    @staticmethod
-    def get_balls_database() -> Dict[str, List[HandballBall]]:
-        return {
-            'novice': [
-                HandballBall(
-                    name="Erima Pure Grip No. 4 Handball",
-                    level="Новичок",
-                    price=29.99,
-                    material="Синтетическая кожа с покрытием Pure Grip",
-                    size="0 (48-50 см)",
-                    description="Идеальный тренировочный мяч для начинающих игроков и детей. Оборудован специальным покрытием Pure Grip для лучшего контроля.",
-                    surface_type="Универсальный",
-                    image_url=ImagePaths.ERIMA_PURE_GRIP_4,
-                    features=[
-                        "Технология Pure Grip для лучшего сцепления",
-                        "Оптимальный размер 0 для детей и начинающих",
-                        "Прочная синтетическая кожа",
-                        "Отличный контроль мяча",
-                        "Подходит для всех покрытий"
-                    ]
-                ),
-                HandballBall(
-                    name="Molten Handball H00F1800",
-                    level="Новичок",
-                    price=24.99,
-                    material="Мягкая синтетическая кожа",
-                    size="0 (48-50 см)",
-                    description="Легкий и удобный мяч для начинающих гандболистов. Идеально подходит для детских тренировок и развития базовых навыков.",
-                    surface_type="Зал",
-                    image_url=ImagePaths.MOLTEN_H0F1800,
-                    features=[
-                        "Мягкая поверхность для комфортной игры",
-                        "Размер 0 для юных спортсменов",
-                        "Хорошее сцепление",
-                        "Стабильная траектория полета",
-                        "Оптимален для зала"
-                    ]
-                ),
-                HandballBall(
-                    name="Select Tucana DB v24 Handball",
-                    level="Новичок",
-                    price=27.99,
-                    material="HPU материал с двойным сцеплением",
-                    size="1 (50-52 см)",
-                    description="Тренировочный мяч с двойным сцеплением для начинающих игроков постарше. Обеспечивает отличный контроль и точность передач.",
-                    surface_type="Универсальный",
-                    image_url=ImagePaths.SELECT_TUCANA,
-                    features=[
-                        "Технология двойного сцепления DB",
-                        "Размер 1 для игроков постарше",
-                        "Улучшенный контроль",
-                        "Высокая износостойкость",
-                        "Универсальное использование"
-                    ]
-                )
-            ],
-            'intermediate': [
-                HandballBall(
-                    name="Select Replica EHF European League v24",
-                    level="Средний",
-                    price=49.99,
-                    material="HPU 1700 с микрофиброй",
-                    size="1-2-3",
-                    description="Реплика официального мяча Европейской лиги. Доступен в разных размерах для разных возрастных категорий.",
-                    surface_type="Зал",
-                    image_url=ImagePaths.SELECT_REPLICA_EHF,
-                    features=[
-                        "Дизайн официального мяча EHF",
-                        "Выбор размера под возраст",
-                        "Превосходное сцепление",
-                        "Контролируемый отскок",
-                        "Высокая прочность"
-                    ]
-                ),
-                HandballBall(
-                    name="Molten SchoolMasteR Handball",
-                    level="Средний",
-                    price=42.99,
-                    material="Синтетическая кожа PRO",
-                    size="1-2-3",
-                    description="Профессиональный тренировочный мяч для школ и клубов. Подходит для регулярных тренировок и соревнований.",
-                    surface_type="Универсальный",
-                    image_url=ImagePaths.MOLTEN_SCHOOLMASTER,
-                    features=[
-                        "Профессиональное покрытие PRO",
-                        "Три варианта размера",
-                        "Стабильная форма",
-                        "Улучшенный отскок",
-                        "Долгий срок службы"
-                    ]
-                ),
-                HandballBall(
-                    name="Erima Vranjes",
-                    level="Средний",
-                    price=45.99,
-                    material="Синтетическая кожа Premium",
-                    size="1-2-3",
-                    description="Универсальный мяч среднего уровня для тренировок и соревнований. Обеспечивает отличный контроль и точность.",
-                    surface_type="Универсальный",
-                    image_url=ImagePaths.ERIMA_VRANJES,
-                    features=[
-                        "Премиальное покрытие",
-                        "Размеры для всех возрастов",
-                        "Отличное сцепление",
-                        "Точная траектория",
-                        "Повышенная прочность"
-                    ]
-                )
-            ],
-            'professional': [
-                HandballBall(
-                    name="Erima Pure Grip No. 1 Handball",
-                    level="Профессионал",
-                    price=79.99,
-                    material="Премиум синтетическая кожа Pro+",
-                    size="2-3",
-                    description="Профессиональный мяч высшего класса с технологией Pure Grip Pro+. Используется в профессиональных соревнованиях.",
-                    surface_type="Профессиональный",
-                    image_url=ImagePaths.ERIMA_PURE_GRIP_1,
-                    features=[
-                        "Технология Pure Grip Pro+",
-                        "Профессиональные размеры 2-3",
-                        "Максимальное сцепление",
-                        "Идеальный баланс",
-                        "Соревновательный стандарт"
-                    ]
-                ),
-                HandballBall(
-                    name="Molten H3X5001-BW Handball",
-                    level="Профессионал",
-                    price=84.99,
-                    material="Премиум композитная кожа X5000",
-                    size="2-3",
-                    description="Официальный игровой мяч IHF для профессиональных соревнований высшего уровня. Сертифицирован для международных турниров.",
-                    surface_type="Профессиональный",
-                    image_url=ImagePaths.MOLTEN_H3X5001,
-                    features=[
-                        "Сертификация IHF",
-                        "Технология X5000 Premium",
-                        "Профессиональные размеры",
-                        "Превосходная аэродинамика",
-                        "Высочайшая точность"
-                    ]
-                ),
-                HandballBall(
-                    name="Select Ultimate EHF Champions League v24",
-                    level="Профессионал",
-                    price=89.99,
-                    material="Shark Skin с микрофиброй",
-                    size="2-3",
-                    description="Официальный мяч Лиги чемпионов EHF. Эталон качества для профессионального гандбола.",
-                    surface_type="Профессиональный",
-                    image_url=ImagePaths.SELECT_ULTIMATE_CL,
-                    features=[
-                        "Официальный мяч EHF",
-                        "Технология Shark Skin",
-                        "Оптимальный вес и баланс",
-                        "Исключительное сцепление",
-                        "Максимальная износостойкость"
-                    ]
-                )
-            ]
-        }
+    # Файл каталога ищется рядом с модулем, независимо от текущего каталога
+    CATALOG_PATH = Path(__file__).resolve().parent / Config.CATALOG_FILE
+
+    @classmethod
+    def get_balls_database(cls, path: Optional[Path] = None) -> Dict[str, List[HandballBall]]:
+        return load_balls(path or cls.CATALOG_PATH)
 
 
 class HandballBallAdvisor:
     """Класс для предоставления рекомендаций по выбору мяча"""
 
-    def __init__(self, openai_api_key: str):
+    def __init__(self, openai_api_key: str, store: Optional[RecommendationStore] = None,
+                 catalog: Optional[BallCatalog] = None):
         if not openai_api_key:
             raise ValueError("OpenAI API key is required")
 
-        self.client = AsyncOpenAI(api_key=openai_api_key)
-        self.ball_db = HandballBallDatabase()
+        self._api_key = openai_api_key
+        self._client: Optional["AsyncOpenAI"] = None
+        self._client_lock = threading.Lock()
+        self.upstream = ResilientCaller(
+            max_retries=Config.MAX_RETRIES,
+            base_delay=Config.RETRY_BASE_DELAY,
+            max_delay=Config.RETRY_DELAY,
+            attempt_timeout=Config.API_TIMEOUT,
+            deadline=Config.RECOMMENDATION_DEADLINE,
+            breaker=CircuitBreaker(Config.CIRCUIT_FAILURE_THRESHOLD, Config.CIRCUIT_RESET_TIMEOUT),
+            hedge_percentile=Config.HEDGE_PERCENTILE,
+        )
+        # Каталог заменяется целиком при перезагрузке файла; обработчики берут ссылку один раз
+        self.catalog = catalog or BallCatalog(HandballBallDatabase.get_balls_database())
+        self.recommendation_cache = TTLCache(
+            maxsize=Config.RECOMMENDATION_CACHE_SIZE,
+            ttl=Config.RECOMMENDATION_CACHE_TTL
+        )
+        self._in_flight = SingleFlight()
+        self.store = store
+
+    @property
+    def client(self) -> "AsyncOpenAI":
+        """Клиент OpenAI; импорт пакета openai занимает большую часть запуска,
+        поэтому он откладывается до первого обращения"""
+        if self._client is None:
+            self._create_client()
+        return self._client
+
+    @client.setter
+    def client(self, client: "AsyncOpenAI"):
+        self._client = client
+
+    def _create_client(self):
+        with self._client_lock:
+            if self._client is not None:
+                return
+            from openai import (
+                AsyncOpenAI,
+                APIConnectionError,
+                APITimeoutError,
+                InternalServerError,
+                RateLimitError,
+            )
+            # Повторы и таймауты выполняет ResilientCaller, а не клиент
+            self.upstream.retry_on += (APIConnectionError, APITimeoutError, InternalServerError, RateLimitError)
+            self._client = AsyncOpenAI(api_key=self._api_key, max_retries=0, timeout=Config.API_TIMEOUT)
 
-    async def get_recommendation(self, user_data: Dict[str, Any]) -> Tuple[str, List[HandballBall]]:
-        level_map = {
-            'Новичок': 'novice',
-            'Средний': 'intermediate',
-            'Профессионал': 'professional'
-        }
+    async def connect(self):
+        """Создает клиент в потоке, чтобы импорт openai не останавливал цикл событий"""
+        if self._client is None:
+            await asyncio.to_thread(self._create_client)
 
+    def load_persisted(self) -> int:
+        """Заполняет кэш рекомендациями, сохраненными до перезапуска"""
+        if self.store is None:
+            return 0
+
+        entries = self.store.load(Config.GPT_MODEL, Config.PROMPT_VERSION, Config.RECOMMENDATION_STORE_TTL)
+        for (level, surface), text in entries.items():
+            self.recommendation_cache.set(self._cache_key({'level': level, 'surface': surface}), text)
+        logger.info("Loaded %d persisted recommendations", len(entries))
+        return len(entries)
+
+    async def prewarm(self, concurrency: int = Config.PREWARM_CONCURRENCY):
+        """Заранее генерирует рекомендации для всех комбинаций с клавиатур"""
+        await self.connect()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def warm(user_data: Dict[str, Any]):
+            async with semaphore:
+                try:
+                    await self._get_gpt_recommendation(user_data)
+                except Exception as e:
+                    logger.warning("Prewarm failed for %s: %s", user_data, e)
+
+        await asyncio.gather(*(
+            warm({'level': level, 'surface': surface})
+            for level in Choices.LEVELS
+            for surface in Choices.SURFACES
+        ))
+        logger.info("Prewarm finished, cache size: %d", len(self.recommendation_cache))
+
+    def get_balls(self, user_data: Dict[str, Any]) -> BallList:
+        size = user_data.get('size')
+        max_price = user_data.get('max_price')
+        if size is None and max_price is None:
+            return self.catalog.lookup(user_data['level'], user_data.get('surface'))
+        return self.catalog.narrow(
+            user_data['level'],
+            user_data.get('surface'),
+            sizes=None if size is None else (size,),
+            max_price=float('inf') if max_price is None else max_price
+        )
+
+    @staticmethod
+    def fallback_recommendation(user_data: Dict[str, Any]) -> str:
+        return (
+            f"На основе вашего уровня ({user_data['level']}) "
+            f"и места использования ({user_data.get('surface', 'разных условий')}) "
+            f"я подобрал подходящие мячи. У каждого из них есть свои преимущества, "
+            f"просмотрите детальную информацию ниже, чтобы выбрать наиболее подходящий вариант."
+        )
+
+    async def get_recommendation(self, user_data: Dict[str, Any]) -> Tuple[str, BallList]:
         try:
-            balls = self.ball_db.get_balls_database().get(level_map.get(user_data['level'], 'novice'), [])
-
-            if 'surface' in user_data:
-                surface = user_data['surface'].lower()
-                filtered_balls = [
-                    ball for ball in balls
-                    if (ball.surface_type.lower() in surface or
-                        'универсальный' in ball.surface_type.lower() or
-                        'универсальное' in surface)
-                ]
-                balls = filtered_balls if filtered_balls else balls
+            balls = self.get_balls(user_data)
 
             try:
                 gpt_recommendation = await self._get_gpt_recommendation(user_data)
             except Exception as e:
-                logger.error(f"Error getting GPT recommendation: {e}")
-                gpt_recommendation = (
-                    f"На основе вашего уровня ({user_data['level']}) "
-                    f"и места использования ({user_data.get('surface', 'разных условий')}) "
-                    f"я подобрал подходящие мячи. У каждого из них есть свои преимущества, "
-                    f"просмотрите детальную информацию ниже, чтобы выбрать наиболее подходящий вариант."
-                )
+                logger.error("Error getting GPT recommendation: %s", e)
+                gpt_recommendation = self.fallback_recommendation(user_data)
 
             return gpt_recommendation, balls
 
         except Exception as e:
-            logger.error(f"Error in get_recommendation: {str(e)}")
+            logger.error("Error in get_recommendation: %s", e)
             raise
 
-    async def _get_gpt_recommendation(self, user_data: Dict[str, Any]) -> str:
-        messages = [
+    async def stream_recommendation(self, user_data: Dict[str, Any]) -> AsyncIterator[str]:
+        """Отдает рекомендацию по мере генерации: каждый элемент - весь текст на данный момент"""
+        cache_key = self._cache_key(user_data)
+        cached = self.recommendation_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+        # Такой же запрос уже выполняется: ждем его целиком вместо второго потока
+        pending = self._in_flight.join(cache_key)
+        if pending is not None:
+            yield await asyncio.shield(pending)
+            return
+
+        future = self._in_flight.lead(cache_key)
+        try:
+            stored = await self._load_stored(cache_key)
+            if stored is not None:
+                future.set_result(stored)
+                yield stored
+                return
+
+            text = ''
+            # aclosing: при закрытии этого генератора поток OpenAI закрывается сразу, а не при сборке мусора
+            async with contextlib.aclosing(self._stream_completion(user_data)) as stream:
+                async for text in stream:
+                    yield text
+            text = text.strip()
+            future.set_result(text)
+        except BaseException as e:
+            if not future.done():
+                # Ожидающие получают ошибку, а не отмену, и показывают запасной текст
+                future.set_exception(e if isinstance(e, Exception) else
+                                     RuntimeError("Recommendation stream was interrupted"))
+            raise
+
+        await self._remember(cache_key, text)
+
+    async def _stream_completion(self, user_data: Dict[str, Any]) -> AsyncIterator[str]:
+        breaker = self.upstream.breaker
+        if not breaker.allow():
+            raise CircuitOpenError("Upstream circuit is open")
+
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + Config.RECOMMENDATION_DEADLINE
+        started = time.perf_counter()
+        outcome = 'error'
+        parts = []
+        try:
+            stream = await asyncio.wait_for(
+                self.client.chat.completions.create(
+                    model=Config.GPT_MODEL,
+                    messages=self._build_messages(user_data),
+                    temperature=0.7,
+                    max_tokens=300,
+                    stream=True,
+                    stream_options={'include_usage': True}
+                ),
+                timeout=Config.API_TIMEOUT
+            )
+            chunks = stream.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=deadline_at - loop.time())
+                except StopAsyncIteration:
+                    break
+                # Последний фрагмент приходит без choices и содержит только usage
+                record_token_usage(getattr(chunk, 'usage', None), 'stream')
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if not parts:
+                        metrics.observe('openai_first_token_seconds', time.perf_counter() - started)
+                    parts.append(delta)
+                    yield ''.join(parts)
+            if not ''.join(parts).strip():
+                raise ValueError("OpenAI returned an empty recommendation")
+            outcome = 'ok'
+        except Exception as e:
+            breaker.record_failure()
+            logger.error("Error in GPT stream: %s", e)
+            raise
+        except BaseException:
+            # Генератор закрыт или задача отменена: пробный запрос не должен остаться занятым
+            breaker.release()
+            raise
+        finally:
+            metrics.observe('openai_request_seconds', time.perf_counter() - started, mode='stream', outcome=outcome)
+
+        breaker.record_success()
+
+    @staticmethod
+    def _cache_key(user_data: Dict[str, Any]) -> Tuple[str, str, str, int]:
+        return (
+            user_data['level'],
+            user_data.get('surface', ''),
+            Config.GPT_MODEL,
+            Config.PROMPT_VERSION
+        )
+
+    @staticmethod
+    def _build_messages(user_data: Dict[str, Any]) -> List[Dict[str, str]]:
+        return [
             {
                 "role": "system",
                 "content": "Вы - эксперт по гандбольному оборудованию. Дайте краткую рекомендацию на русском языке."
@@ -238,6 +274,40 @@ class HandballBallAdvisor:
             }
         ]
 
+    async def _get_gpt_recommendation(self, user_data: Dict[str, Any]) -> str:
+        cache_key = self._cache_key(user_data)
+        cached = self.recommendation_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        # Одновременные пользователи с тем же выбором ждут один общий запрос
+        return await self._in_flight.do(
+            cache_key,
+            lambda: self._request_recommendation(user_data, cache_key)
+        )
+
+    async def _request_recommendation(self, user_data: Dict[str, Any], cache_key: Tuple) -> str:
+        stored = await self._load_stored(cache_key)
+        if stored is not None:
+            return stored
+
+        messages = self._build_messages(user_data)
+        try:
+            response = await self.upstream.call(lambda: self._complete(messages))
+            recommendation = (response.choices[0].message.content or '').strip()
+            if not recommendation:
+                raise ValueError("OpenAI returned an empty recommendation")
+        except Exception as e:
+            logger.error("Error in GPT request: %s", e)
+            raise
+
+        await self._remember(cache_key, recommendation)
+        return recommendation
+
+    async def _complete(self, messages: List[Dict[str, str]]) -> Any:
+        """Одна попытка запроса к OpenAI с учетом задержки и израсходованных токенов"""
+        started = time.perf_counter()
+        outcome = 'error'
         try:
             response = await self.client.chat.completions.create(
                 model=Config.GPT_MODEL,
@@ -245,7 +315,29 @@ class HandballBallAdvisor:
                 temperature=0.7,
                 max_tokens=300
             )
-            return response.choices[0].message.content.strip()
-        except Exception as e:
-            logger.error(f"Error in GPT request: {e}")
-            raise
\ No newline at end of file
+            outcome = 'ok'
+        except asyncio.CancelledError:
+            # Попытка прервана таймаутом или выигравшим хеджированным запросом
+            outcome = 'cancelled'
+            raise
+        finally:
+            metrics.observe('openai_request_seconds', time.perf_counter() - started, mode='completion', outcome=outcome)
+        record_token_usage(response.usage, 'completion')
+        return response
+
+    async def _load_stored(self, cache_key: Tuple) -> Optional[str]:
+        if self.store is None:
+            return None
+
+        stored = await self.store.aget(*cache_key, max_age=Config.RECOMMENDATION_STORE_TTL)
+        if stored is not None:
+            self.recommendation_cache.set(cache_key, stored)
+        return stored
+
+    async def _remember(self, cache_key: Tuple, recommendation: str):
+        self.recommendation_cache.set(cache_key, recommendation)
+        if self.store is not None:
+            try:
+                await self.store.asave(*cache_key, recommendation)
+            except Exception as e:
+                logger.error("Error saving recommendation: %s", e)
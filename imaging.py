@@ -0,0 +1,210 @@
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from models import Config, ImagePaths
+
+logger = logging.getLogger(__name__)
+
+# Увеличить при изменении параметров обработки, чтобы пересобрать варианты
+PIPELINE_VERSION = 1
+
+VARIANT_SETTINGS = {
+    ImagePaths.PHOTO_VARIANT: (Config.IMAGE_PHOTO_MAX_SIDE, Config.IMAGE_PHOTO_QUALITY),
+}
+
+
+def file_digest(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def variant_path(digest: str, kind: str) -> Path:
+    return Path(ImagePaths.VARIANTS_PATH) / f"{digest[:32]}_v{PIPELINE_VERSION}_{kind}.jpg"
+
+
+def manifest_path() -> Path:
+    return Path(ImagePaths.VARIANTS_PATH) / f"manifest_v{PIPELINE_VERSION}.json"
+
+
+def source_stamp(path: Path) -> List[int]:
+    """Размер и время изменения исходника: по ним видно, что файл не менялся, без чтения содержимого"""
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def read_manifest() -> Dict[str, dict]:
+    """Исходный путь -> {'stamp': [размер, mtime], 'variants': {вид: путь}}"""
+    try:
+        return json.loads(manifest_path().read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def _temporary_path(target: Path) -> Path:
+    """Уникальное имя для записи рядом с target: несколько процессов не пишут в один файл"""
+    return target.with_name(f".{target.name}.{os.getpid()}.{uuid.uuid4().hex}.tmp")
+
+
+def _write_manifest(manifest: Dict[str, dict]):
+    target = manifest_path()
+    temporary = _temporary_path(target)
+    try:
+        temporary.write_text(json.dumps(manifest, ensure_ascii=False), encoding='utf-8')
+        os.replace(temporary, target)
+    finally:
+        temporary.unlink(missing_ok=True)
+
+
+def _manifest_variants(entry: Optional[dict], stamp: List[int]) -> Optional[Dict[str, str]]:
+    """Варианты из манифеста, если исходник не менялся и все файлы на месте"""
+    if entry is None or entry.get('stamp') != stamp:
+        return None
+    variants = {kind: target for kind, target in entry.get('variants', {}).items() if kind in VARIANT_SETTINGS}
+    if set(variants) != set(VARIANT_SETTINGS) or not all(Path(target).exists() for target in variants.values()):
+        return None
+    return variants
+
+
+def _register_from_manifest(sources: List[str]) -> Tuple[int, int]:
+    """Регистрирует варианты из манифеста; возвращает число найденных и устаревших"""
+    manifest = read_manifest()
+    ready = 0
+    stale = 0
+    for source in sources:
+        try:
+            stamp = source_stamp(Path(source))
+        except OSError:
+            continue
+        variants = _manifest_variants(manifest.get(source), stamp)
+        if variants is None:
+            stale += 1
+            continue
+        ImagePaths.register_variants(source, variants)
+        ready += 1
+    return ready, stale
+
+
+def load_variants(sources: Iterable[str], wait: float = 0.0) -> int:
+    """Регистрирует в ImagePaths уже построенные варианты по манифесту.
+
+    Изображения не читаются и не хэшируются, поэтому это подходит для каждого запуска
+    и каждого рабочего процесса; строит варианты build_variants (python bot.py --bootstrap).
+    wait - сколько секунд ждать, пока варианты строит другой процесс.
+    Возвращает количество изображений, для которых варианты найдены.
+    """
+    sources = list(sources)
+    deadline = time.monotonic() + wait
+    ready, stale = _register_from_manifest(sources)
+    while stale and time.monotonic() < deadline:
+        time.sleep(Config.IMAGE_VARIANTS_POLL_INTERVAL)
+        ready, stale = _register_from_manifest(sources)
+
+    if stale:
+        logger.warning("Image variants missing or outdated for %d images, "
+                       "originals will be sent (rebuild: python bot.py --bootstrap)", stale)
+    logger.info("Image variants found: %d", ready)
+    return ready
+
+
+def _build_variants(source: str, digest: str) -> Dict[str, str]:
+    """Создает уменьшенные перекодированные копии одного изображения (в дочернем процессе)"""
+    from PIL import Image
+
+    results = {}
+    with Image.open(source) as original:
+        image = original.convert('RGB')
+        for kind, (max_side, quality) in VARIANT_SETTINGS.items():
+            target = variant_path(digest, kind)
+            if not target.exists():
+                variant = image.copy()
+                variant.thumbnail((max_side, max_side), Image.LANCZOS)
+                temporary = _temporary_path(target)
+                try:
+                    # Новое изображение сохраняется без EXIF и прочих метаданных исходника
+                    variant.save(temporary, 'JPEG', quality=quality, optimize=True, progressive=True)
+                    os.replace(temporary, target)
+                finally:
+                    temporary.unlink(missing_ok=True)
+            results[kind] = str(target)
+    return results
+
+
+def build_variants(sources: Iterable[str], workers: Optional[int] = Config.IMAGE_WORKERS) -> int:
+    """Готовит варианты изображений для Telegram и регистрирует их в ImagePaths.
+
+    Возвращает количество изображений, для которых варианты доступны.
+    """
+    # Pillow импортируется только здесь: рабочие процессы, которые находят варианты
+    # по манифесту (load_variants), его не загружают. Без Pillow отправляются исходные файлы
+    if importlib.util.find_spec('PIL') is None:
+        logger.warning("Pillow is not installed, original images will be sent as is")
+        return 0
+
+    Path(ImagePaths.VARIANTS_PATH).mkdir(parents=True, exist_ok=True)
+
+    manifest = read_manifest()
+    stamps: Dict[str, List[int]] = {}
+    pending: Dict[str, str] = {}
+    ready = 0
+    for source in sources:
+        path = Path(source)
+        try:
+            stamps[source] = stamp = source_stamp(path)
+        except OSError:
+            continue
+        variants = _manifest_variants(manifest.get(source), stamp)
+        if variants is not None:
+            # Исходник не менялся с прошлой сборки: хэшировать его заново не нужно
+            ImagePaths.register_variants(source, variants)
+            ready += 1
+            continue
+        digest = file_digest(path)
+        variants = {kind: variant_path(digest, kind) for kind in VARIANT_SETTINGS}
+        if all(target.exists() for target in variants.values()):
+            # Содержимое не менялось: готовые варианты переиспользуются
+            built = {kind: str(target) for kind, target in variants.items()}
+            ImagePaths.register_variants(source, built)
+            manifest[source] = {'stamp': stamps[source], 'variants': built}
+            ready += 1
+        else:
+            pending[source] = digest
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                source: pool.submit(_build_variants, source, digest)
+                for source, digest in pending.items()
+            }
+            for source, future in futures.items():
+                try:
+                    built = future.result()
+                    ImagePaths.register_variants(source, built)
+                    manifest[source] = {'stamp': stamps[source], 'variants': built}
+                    ready += 1
+                except Exception as e:
+                    logger.error("Error building variants for %s: %s", source, e)
+
+    try:
+        _write_manifest(manifest)
+    except OSError as e:
+        logger.error("Error writing image variants manifest: %s", e)
+    logger.info("Image variants ready: %d, rebuilt: %d", ready, len(pending))
+    return ready
+
+
+if __name__ == '__main__':
+    from data import HandballBallDatabase
+
+    logging.basicConfig(level=logging.INFO)
+    build_variants(
+        ball.image_url
+        for balls in HandballBallDatabase.get_balls_database().values()
+        for ball in balls
+    )
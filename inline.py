@@ -0,0 +1,81 @@
+import re
+from typing import Dict, FrozenSet, Iterable, List, Sequence, Tuple
+
+from telegram import InlineQueryResultArticle, InputTextMessageContent
+
+from models import HandballBall, Config
+from cache import TTLCache
+from render import CardRenderer
+
+_TOKEN = re.compile(r'[a-zа-я0-9]+')
+
+
+def normalize_tokens(text: str) -> Tuple[str, ...]:
+    """Слова запроса в нижнем регистре, без повторов и в фиксированном порядке"""
+    return tuple(sorted(set(_TOKEN.findall(text.lower().replace('ё', 'е')))))
+
+
+class InlineIndex:
+    """Префиксный индекс для inline-режима по названиям, брендам и размерам мячей.
+
+    Для каждого префикса каждого слова заранее сохранено множество номеров мячей,
+    поэтому поиск - одно обращение к словарю на слово запроса и пересечение множеств.
+    Готовые результаты для Telegram строятся один раз для версии каталога.
+    """
+
+    def __init__(self, balls: Sequence[HandballBall], cards: CardRenderer):
+        self.balls = tuple(balls)
+        prefixes: Dict[str, set] = {}
+        for index, ball in enumerate(self.balls):
+            for token in self._tokens(ball):
+                for end in range(1, len(token) + 1):
+                    prefixes.setdefault(token[:end], set()).add(index)
+        self._prefixes: Dict[str, FrozenSet[int]] = {
+            prefix: frozenset(indexes) for prefix, indexes in prefixes.items()
+        }
+
+        self.results = tuple(
+            InlineQueryResultArticle(
+                id=str(index),
+                title=ball.name,
+                description=f"{ball.price:.2f} € · размер {ball.size} · {ball.level}",
+                input_message_content=InputTextMessageContent(cards.card(ball), parse_mode='Markdown'),
+            )
+            for index, ball in enumerate(self.balls)
+        )
+        # Порядок выдачи - по цене, чтобы результаты не прыгали при наборе запроса
+        self._order = tuple(sorted(range(len(self.balls)), key=lambda index: self.balls[index].price))
+        self._cache = TTLCache(maxsize=Config.INLINE_CACHE_SIZE, ttl=Config.INLINE_CACHE_TTL)
+
+    @staticmethod
+    def _tokens(ball: HandballBall) -> Iterable[str]:
+        yield from _TOKEN.findall(ball.name.lower())
+        # Бренд входит в название; размеры индексируются номером и словом вида "размер2",
+        # чтобы запрос "размер 2" сужал выдачу до мячей нужного размера
+        for size in sorted(ball.sizes):
+            yield str(size)
+            yield f"размер{size}"
+
+    def lookup(self, query: str, limit: int = Config.INLINE_MAX_RESULTS) -> Tuple[InlineQueryResultArticle, ...]:
+        tokens = normalize_tokens(query)
+        key = (tokens, limit)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+
+        matches = None
+        for token in tokens:
+            indexes = self._prefixes.get(token, frozenset())
+            matches = indexes if matches is None else matches & indexes
+            if not matches:
+                break
+
+        results: List[InlineQueryResultArticle] = []
+        for index in self._order:
+            if matches is None or index in matches:
+                results.append(self.results[index])
+                if len(results) == limit:
+                    break
+        answer = tuple(results)
+        self._cache.set(key, answer)
+        return answer
@@ -0,0 +1,156 @@
+import atexit
+import json
+import logging
+import queue
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+from typing import Dict, Optional
+
+from models import Config
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Атрибуты LogRecord; все остальные поля записи пришли из extra и попадают в JSON
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Одна запись журнала - одна строка JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает заданную долю записей ниже WARNING для логгера и его потомков.
+
+    Доли задаются по имени логгера: {'httpx': 0.1} оставит каждую десятую запись.
+    Отбор детерминированный (накопление доли), предупреждения и ошибки проходят всегда.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = dict(rates)
+        self._resolved: Dict[str, Optional[float]] = {}
+        self._credit: Dict[str, float] = {}
+        self.sampled_out = 0
+
+    def _rate(self, name: str) -> Optional[float]:
+        if name not in self._resolved:
+            rate = None
+            prefix = name
+            while prefix:
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+                prefix = prefix.rpartition('.')[0]
+            self._resolved[name] = rate
+        return self._resolved[name]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate is None or rate >= 1:
+            return True
+
+        credit = self._credit.get(record.name, 0.0) + rate
+        if credit >= 1:
+            self._credit[record.name] = credit - 1
+            return True
+        self._credit[record.name] = credit
+        self.sampled_out += 1
+        return False
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Передает записи в очередь без форматирования и никогда не блокирует вызывающего.
+
+    Стандартный QueueHandler форматирует сообщение в потоке вызова; здесь подстановка
+    аргументов выполняется уже в потоке QueueListener. Если очередь переполнена,
+    запись отбрасывается и учитывается в dropped.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'dropped': self.dropped,
+            'sampled_out': sum(item.sampled_out for item in self.filters if isinstance(item, SamplingFilter)),
+        }
+
+
+# Обработчик, установленный setup_logging: его счетчики выгружаются в метрики
+_queue_handler: Optional[DeferredQueueHandler] = None
+
+
+def log_stats() -> Dict[str, int]:
+    """Сколько записей журнала отброшено из-за переполнения очереди и отбора доли"""
+    if _queue_handler is None:
+        return {'dropped': 0, 'sampled_out': 0}
+    return _queue_handler.get_stats()
+
+
+def setup_logging(log_dir: str = Config.LOG_DIR, level: int = logging.INFO,
+                  sampling: Optional[Dict[str, float]] = None) -> QueueListener:
+    """Настраивает корневой логгер: запись в очередь, а форматирование, вывод в консоль
+    и ротация JSON-файлов в logs/ - в фоновом потоке"""
+    global _queue_handler
+    Path(log_dir).mkdir(parents=True, exist_ok=True)
+
+    file_handler = RotatingFileHandler(
+        Path(log_dir) / Config.LOG_FILE,
+        maxBytes=Config.LOG_MAX_BYTES,
+        backupCount=Config.LOG_BACKUP_COUNT,
+        encoding='utf-8'
+    )
+    file_handler.setFormatter(JsonLinesFormatter())
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    queue_handler = DeferredQueueHandler(queue.Queue(Config.LOG_QUEUE_SIZE))
+    queue_handler.addFilter(SamplingFilter(Config.LOG_SAMPLING if sampling is None else sampling))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    _queue_handler = queue_handler
+
+    listener = QueueListener(queue_handler.queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+
+    def stop():
+        # Дописываем оставшиеся в очереди записи; повторная остановка QueueListener падает
+        if listener._thread is not None:
+            listener.stop()
+
+    atexit.register(stop)
+    return listener
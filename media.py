@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from telegram import InputMediaPhoto, Message
+from telegram.error import BadRequest
+
+from models import Config, HandballBall, ImagePaths
+from storage import FileIdStore
+from cache import ByteBufferCache
+from render import CardRenderer
+
+logger = logging.getLogger(__name__)
+
+# Telegram принимает в одной медиагруппе от 2 до 10 элементов
+MEDIA_GROUP_LIMIT = 10
+
+
+class ImageDelivery:
+    """Отправка фотографий мячей одной медиагруппой с повторным использованием file_id"""
+
+    def __init__(self, file_ids: FileIdStore, buffer_bytes: int = Config.IMAGE_BUFFER_CACHE_BYTES):
+        self.file_ids = file_ids
+        self.buffers = ByteBufferCache(buffer_bytes)
+        # Исходный путь из каталога -> (путь к отправляемому файлу, хэш) или None, если файла нет
+        self._resolved: Dict[str, Optional[Tuple[Path, str]]] = {}
+        self.uploads = 0
+        self.reuses = 0
+
+    @staticmethod
+    def _resolve(image_url: str) -> Optional[Tuple[Path, str]]:
+        path = Path(ImagePaths.variant(image_url))
+        try:
+            return path, hashlib.sha256(path.read_bytes()).hexdigest()
+        except FileNotFoundError:
+            return None
+
+    def prepare(self, image_urls: Iterable[str]) -> int:
+        """Проверяет наличие файлов при запуске, чтобы не обращаться к диску в обработчиках"""
+        for image_url in image_urls:
+            self._resolved[image_url] = self._resolve(image_url)
+        available = sum(1 for resolved in self._resolved.values() if resolved is not None)
+        logger.info("Images resolved: %d of %d available", available, len(self._resolved))
+        return available
+
+    async def _lookup(self, image_url: str) -> Optional[Tuple[Path, str]]:
+        if image_url not in self._resolved:
+            # Изображение не было известно при запуске: проверяем его вне цикла событий
+            self._resolved[image_url] = await asyncio.to_thread(self._resolve, image_url)
+        return self._resolved[image_url]
+
+    async def _read(self, path: Path, digest: str) -> bytes:
+        data = self.buffers.get(digest)
+        if data is None:
+            data = await asyncio.to_thread(path.read_bytes)
+            self.buffers.set(digest, data)
+        return data
+
+    async def send_photos(self, message: Message, balls: Sequence[HandballBall], cards: CardRenderer,
+                          rate_limit_args: Optional[Dict[str, Any]] = None) -> List[HandballBall]:
+        """Отправляет фото мячей и возвращает мячи, для которых изображения нет"""
+        missing = []
+        items = []
+        for ball in balls:
+            resolved = await self._lookup(ball.image_url)
+            if resolved is None:
+                missing.append(ball)
+                continue
+            items.append((ball, *resolved))
+
+        for start in range(0, len(items), MEDIA_GROUP_LIMIT):
+            chunk = items[start:start + MEDIA_GROUP_LIMIT]
+            try:
+                await self._send_chunk(message, chunk, cards, True, rate_limit_args)
+            except BadRequest as e:
+                # Сохраненный file_id мог стать недействительным: загружаем файлы заново
+                logger.warning("Resending photos without cached file_id: %s", e)
+                for _, path, digest in chunk:
+                    await self.file_ids.adelete(str(path), digest)
+                await self._send_chunk(message, chunk, cards, False, rate_limit_args)
+
+        return missing
+
+    async def _send_chunk(self, message: Message, chunk: list, cards: CardRenderer, use_file_ids: bool,
+                          rate_limit_args: Optional[Dict[str, Any]]):
+        media = []
+        used_file_ids = []
+        for ball, path, digest in chunk:
+            file_id = await self.file_ids.aget(str(path), digest) if use_file_ids else None
+            used_file_ids.append(file_id)
+            if file_id is not None:
+                self.reuses += 1
+            else:
+                self.uploads += 1
+            media.append(InputMediaPhoto(
+                media=file_id or await self._read(path, digest),
+                caption=cards.caption(ball)
+            ))
+
+        # Ярлыки Message.reply_* не принимают rate_limit_args, поэтому отправка идет через бота
+        bot = message.get_bot()
+        if len(media) == 1:
+            sent = [await bot.send_photo(
+                chat_id=message.chat_id,
+                photo=media[0].media,
+                caption=media[0].caption,
+                rate_limit_args=rate_limit_args
+            )]
+        else:
+            sent = await bot.send_media_group(
+                chat_id=message.chat_id, media=media, rate_limit_args=rate_limit_args
+            )
+
+        for (_, path, digest), used_file_id, sent_message in zip(chunk, used_file_ids, sent):
+            # Запись в базу нужна только после загрузки файла или если Telegram вернул другой file_id
+            if sent_message.photo and sent_message.photo[-1].file_id != used_file_id:
+                await self.file_ids.aset(str(path), digest, sent_message.photo[-1].file_id)
@@ -0,0 +1,264 @@
+import asyncio
+import bisect
+import functools
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional, Sequence, Tuple, TypeVar, Union
+
+from models import Config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+Labels = Tuple[Tuple[str, str], ...]
+GaugeValue = Union[float, Dict[Labels, float]]
+
+# Границы корзин по умолчанию: от миллисекунд до таймаута OpenAI
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    escaped = (
+        f'{key}="' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for key, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    value = float(value)
+    if value == float('inf'):
+        return "+Inf"
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин в формате Prometheus"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Метрики процесса: гистограммы и счетчики с метками, а также показатели,
+    которые вычисляются в момент выгрузки (размеры очередей, доля попаданий в кэш)"""
+
+    def __init__(self):
+        self._meta: Dict[str, Tuple[str, str]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._gauges: Dict[str, Callable[[], GaugeValue]] = {}
+
+    def histogram(self, name: str, help_text: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self._meta[name] = ('histogram', help_text)
+        self._buckets[name] = tuple(buckets)
+        self._histograms.setdefault(name, {})
+
+    def counter(self, name: str, help_text: str):
+        self._meta[name] = ('counter', help_text)
+        self._counters.setdefault(name, {})
+
+    def gauge(self, name: str, help_text: str, collect: Callable[[], GaugeValue]):
+        """collect возвращает число или словарь {метки: значение}; вызывается при выгрузке"""
+        self._meta[name] = ('gauge', help_text)
+        self._gauges[name] = collect
+
+    def observe(self, name: str, value: float, **labels: str):
+        series = self._histograms[name]
+        key = _labels(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram(self._buckets[name])
+        histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1.0, **labels: str):
+        series = self._counters[name]
+        key = _labels(labels)
+        series[key] = series.get(key, 0.0) + amount
+
+    def get_histogram(self, name: str, **labels: str) -> Optional[Histogram]:
+        return self._histograms.get(name, {}).get(_labels(labels))
+
+    def render(self) -> str:
+        """Текстовый формат экспозиции Prometheus 0.0.4"""
+        lines = []
+        for name, (kind, help_text) in self._meta.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == 'histogram':
+                for labels, histogram in self._histograms[name].items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                        cumulative += count
+                        lines.append(
+                            f"{name}_bucket{_format_labels(labels, (('le', _format_value(bound)),))} {cumulative}"
+                        )
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+            elif kind == 'counter':
+                for labels, value in self._counters[name].items():
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            else:
+                try:
+                    value = self._gauges[name]()
+                except Exception as e:
+                    logger.warning("Error collecting metric %s: %s", name, e)
+                    continue
+                series = value if isinstance(value, dict) else {(): value}
+                for labels, series_value in series.items():
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(series_value)}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: Union[str, Path], text: Optional[str] = None):
+        """Атомарно записывает метрики в файл (например, для node_exporter textfile).
+
+        text - заранее подготовленный render(): при записи из другого потока словари
+        реестра читаются в цикле событий, где они изменяются.
+        """
+        if text is None:
+            text = self.render()
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(text, encoding='utf-8')
+        os.replace(tmp_path, path)
+
+
+metrics = MetricsRegistry()
+metrics.histogram('bot_handler_seconds', 'Time spent in a conversation handler')
+metrics.counter('bot_handler_errors_total', 'Conversation handler calls that raised')
+metrics.histogram('openai_request_seconds', 'OpenAI completion latency per attempt')
+metrics.histogram('openai_first_token_seconds', 'Time to the first streamed OpenAI token')
+metrics.counter('openai_tokens_total', 'OpenAI tokens used')
+metrics.histogram('telegram_request_seconds', 'Telegram Bot API request latency by method')
+metrics.histogram('telegram_queue_wait_seconds', 'Time a Telegram request waited in the rate limiter')
+metrics.histogram(
+    'event_loop_lag_seconds', 'Delay of the event loop behind schedule',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+
+
+def instrument_handler(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """Учитывает время выполнения и ошибки обработчика под его именем"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs) -> T:
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            metrics.inc('bot_handler_errors_total', handler=name)
+            raise
+        finally:
+            metrics.observe('bot_handler_seconds', time.perf_counter() - started, handler=name)
+
+    return wrapper
+
+
+def record_token_usage(usage, kind: str):
+    """Учитывает токены из поля usage ответа OpenAI"""
+    if usage is None:
+        return
+    metrics.inc('openai_tokens_total', usage.prompt_tokens or 0, type='prompt', kind=kind)
+    metrics.inc('openai_tokens_total', usage.completion_tokens or 0, type='completion', kind=kind)
+
+
+async def monitor_event_loop(interval: float = Config.METRICS_LOOP_LAG_INTERVAL):
+    """Измеряет, на сколько просыпание после sleep(interval) отстает от расписания"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        metrics.observe('event_loop_lag_seconds', max(0.0, loop.time() - started - interval))
+
+
+async def dump_periodically(path: Union[str, Path], interval: float = Config.METRICS_DUMP_INTERVAL):
+    """Периодически выгружает метрики в файл, пока задача не будет отменена"""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                # Текст собирается в цикле событий, в поток уходит только запись файла
+                await asyncio.to_thread(metrics.dump, path, metrics.render())
+            except Exception as e:
+                logger.error("Error dumping metrics to %s: %s", path, e, exc_info=True)
+    finally:
+        try:
+            metrics.dump(path)
+        except Exception as e:
+            logger.error("Error dumping metrics to %s: %s", path, e, exc_info=True)
+
+
+class MetricsServer:
+    """Минимальный HTTP-сервер, отдающий метрики по GET /metrics"""
+
+    READ_TIMEOUT = 5
+
+    def __init__(self, registry: MetricsRegistry = metrics,
+                 host: str = Config.METRICS_HOST, port: int = Config.METRICS_PORT):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("Metrics available at http://%s:%s/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=self.READ_TIMEOUT)
+            # Заголовки не нужны, но их надо дочитать до пустой строки
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=self.READ_TIMEOUT)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?', 1)[0] == '/metrics':
+                status = "200 OK"
+                body = self.registry.render().encode('utf-8')
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                status = "404 Not Found"
+                body = b"Not Found\n"
+                content_type = "text/plain; charset=utf-8"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            logger.debug("Metrics request failed: %s", e)
+        finally:
+            writer.close()
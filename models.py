@@ -1,5 +1,8 @@
-from dataclasses import dataclass
-from typing import List, Dict, Any
+import re
+import sys
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Any, FrozenSet, Optional, Tuple
 from telegram import ReplyKeyboardMarkup, KeyboardButton
 
 
@@ -9,6 +12,54 @@ class States:
     CHOOSING_SURFACE = 1
     SHOWING_DETAILS = 2
     SHOWING_PHOTOS = 3
+    # Номера существующих состояний не меняются: они сохраняются в persistence
+    CHOOSING_SIZE = 4
+    CHOOSING_PRICE = 5
+
+
+class Choices:
+    """Варианты ответов, доступные на клавиатурах"""
+    LEVELS = ("Новичок", "Средний", "Профессионал")
+    SURFACES = ("В зале", "На улице", "Универсальное использование")
+    LEVEL_KEYS = {
+        'Новичок': 'novice',
+        'Средний': 'intermediate',
+        'Профессионал': 'professional'
+    }
+    DEFAULT_LEVEL_KEY = 'novice'
+    SIZES = ("Размер 0", "Размер 1", "Размер 2", "Размер 3")
+    ANY_SIZE = "Любой размер"
+    # Верхняя граница цены для кнопок; None - без ограничения
+    PRICE_LIMITS = {
+        "До 30 €": 30.0,
+        "До 50 €": 50.0,
+        "До 80 €": 80.0,
+        "Любая цена": None,
+    }
+
+
+# Окружность мяча (см) для размеров по стандарту IHF
+SIZE_CIRCUMFERENCE = {0: (48.0, 50.0), 1: (50.0, 52.0), 2: (54.0, 56.0), 3: (58.0, 60.0)}
+
+_SIZE_NUMBER = re.compile(r'\d+')
+_CIRCUMFERENCE = re.compile(r'(\d+(?:[.,]\d+)?)\s*-\s*(\d+(?:[.,]\d+)?)\s*см')
+
+
+def parse_sizes(size: str) -> FrozenSet[int]:
+    """Номера размеров из строки вида "1-2-3" или "0 (48-50 см)" """
+    return frozenset(int(number) for number in _SIZE_NUMBER.findall(size.split('(', 1)[0]))
+
+
+def parse_circumference(size: str, sizes: FrozenSet[int]) -> Optional[Tuple[float, float]]:
+    """Диапазон окружности в см: из строки, а если он не указан - по таблице размеров"""
+    match = _CIRCUMFERENCE.search(size)
+    if match:
+        low, high = sorted(float(value.replace(',', '.')) for value in match.groups())
+        return low, high
+    ranges = [SIZE_CIRCUMFERENCE[number] for number in sizes if number in SIZE_CIRCUMFERENCE]
+    if not ranges:
+        return None
+    return min(low for low, _ in ranges), max(high for _, high in ranges)
 
 
 class Config:
@@ -17,15 +68,120 @@ class Config:
     RETRY_DELAY = 15
     MAX_PROMPT_LENGTH = 4000
     GPT_MODEL = "gpt-3.5-turbo"
-    API_TIMEOUT = 30
+    # Таймаут одной попытки: заметно меньше RECOMMENDATION_DEADLINE, чтобы на повторы оставалось время
+    API_TIMEOUT = 8
+    # Базовая задержка повторов; RETRY_DELAY ограничивает ее сверху
+    RETRY_BASE_DELAY = 0.5
+    # Общий бюджет времени на получение рекомендации, включая повторы
+    RECOMMENDATION_DEADLINE = 20
+    CIRCUIT_FAILURE_THRESHOLD = 5
+    CIRCUIT_RESET_TIMEOUT = 60
+    # Перцентиль задержки, после которого отправляется дублирующий запрос (None - выключено)
+    HEDGE_PERCENTILE = None
+    # Версия шаблона запроса к GPT: увеличить при изменении текста промпта
+    PROMPT_VERSION = 1
+    RECOMMENDATION_CACHE_SIZE = 64
+    RECOMMENDATION_CACHE_TTL = 6 * 60 * 60
+    STORAGE_DIR = "storage"
+    RECOMMENDATION_STORE_FILE = "recommendations.sqlite3"
+    RECOMMENDATION_STORE_TTL = 7 * 24 * 60 * 60
+    FILE_ID_STORE_FILE = "file_ids.sqlite3"
+    IMAGE_PHOTO_MAX_SIDE = 1280
+    IMAGE_PHOTO_QUALITY = 82
+    # Количество процессов для обработки изображений (None - по числу ядер)
+    IMAGE_WORKERS = None
+    IMAGE_BUFFER_CACHE_BYTES = 16 * 1024 * 1024
+    # Рабочие процессы, кроме первого, не строят варианты, а ждут их появления в манифесте
+    IMAGE_VARIANTS_WAIT = 60
+    IMAGE_VARIANTS_POLL_INTERVAL = 1
+    # Сколько обновлений разных чатов обрабатывается одновременно
+    MAX_CONCURRENT_UPDATES = 64
+    # Сколько обновлений может ждать в очереди, прежде чем прием новых приостановится
+    UPDATE_QUEUE_SIZE = 1000
+    MAX_PENDING_UPDATES = 512
+    # Лимиты Telegram на отправку: запросов в секунду всего, в личный чат и в группу
+    TELEGRAM_OVERALL_RATE = 30
+    TELEGRAM_CHAT_RATE = 1
+    TELEGRAM_CHAT_BURST = 3
+    TELEGRAM_GROUP_RATE = 20 / 60
+    TELEGRAM_MAX_RETRIES = 3
+    # Сессия подбора удаляется после простоя или при превышении общего числа сессий
+    SESSION_IDLE_TTL = 30 * 60
+    SESSION_MAX_COUNT = 10000
+    SESSION_STORE_FILE = "sessions.sqlite3"
+    CONVERSATION_STORE_FILE = "conversations.sqlite3"
+    # Интервал отложенной записи сессий и состояний разговоров на диск
+    PERSISTENCE_INTERVAL = 5
+    # Неизмененная сессия перезаписывается, только если last_seen сдвинулся больше чем на столько
+    SESSION_TOUCH_INTERVAL = 60
+    # Как часто с диска удаляются сессии пользователей, которые так и не вернулись
+    SESSION_PURGE_INTERVAL = 60 * 60
+    PREWARM_ON_STARTUP = True
+    PREWARM_CONCURRENCY = 3
+    # Сразу отвечать подборкой из каталога и дописывать текст GPT по мере генерации
+    STREAM_RECOMMENDATIONS = True
+    # Минимальный интервал между правками сообщения (лимиты Telegram на редактирование)
+    STREAM_EDIT_INTERVAL = 1.0
+    # Статистика: кольцевые буферы поминутных и почасовых счетчиков, сбрасываемые на диск
+    ANALYTICS_STORE_FILE = "analytics.sqlite3"
+    ANALYTICS_FLUSH_INTERVAL = 15
+    ANALYTICS_MINUTE_SLOTS = 120
+    ANALYTICS_HOUR_SLOTS = 48
+    ANALYTICS_MINUTE_RETENTION = 2 * 24 * 60 * 60
+    ANALYTICS_HOUR_RETENTION = 365 * 24 * 60 * 60
+    # Метрики в формате Prometheus: локальный HTTP-адрес и периодическая выгрузка в файл
+    METRICS_ENABLED = True
+    METRICS_HOST = "127.0.0.1"
+    METRICS_PORT = 9108
+    METRICS_DUMP_FILE = "logs/metrics.prom"
+    METRICS_DUMP_INTERVAL = 60
+    METRICS_LOOP_LAG_INTERVAL = 0.5
+    # Журнал: JSON-строки с ротацией, запись из фонового потока через ограниченную очередь
+    LOG_DIR = "logs"
+    LOG_FILE = "bot.jsonl"
+    LOG_MAX_BYTES = 10 * 1024 * 1024
+    LOG_BACKUP_COUNT = 5
+    LOG_QUEUE_SIZE = 10000
+    # Доля сохраняемых записей ниже WARNING по имени логгера
+    LOG_SAMPLING = {'httpx': 0.1}
+    SEARCH_MAX_RESULTS = 5
+    # Файл каталога (JSON Lines) и интервал проверки его изменений для горячей перезагрузки
+    CATALOG_FILE = "catalog.jsonl"
+    CATALOG_WATCH_INTERVAL = 5
+    # Inline-режим: сколько результатов отдавать и сколько секунд Telegram может кэшировать ответ
+    INLINE_MAX_RESULTS = 20
+    INLINE_CACHE_TIME = 300
+    INLINE_CACHE_SIZE = 1024
+    INLINE_CACHE_TTL = 60 * 60
+    # Несколько рабочих процессов: супервизор получает обновления и делит их по чатам
+    WORKERS = 1
+    WORKER_QUEUE_SIZE = 1000
+    WORKER_RESTART_DELAY = 1
+    WORKER_STOP_TIMEOUT = 30
+    POLL_TIMEOUT = 30
+    POLL_RETRY_DELAY = 5
 
 
 class Messages:
     """Текстовые сообщения бота"""
     WELCOME = "👋 Добро пожаловать! Я помогу вам выбрать подходящий мяч для гандбола.\n\nВыберите ваш уровень игры:"
     SURFACE_QUESTION = "Отлично! Где вы планируете использовать мяч?"
+    SIZE_QUESTION = "Какой размер мяча вам нужен?"
+    PRICE_QUESTION = "На какую цену вы рассчитываете?"
     SHOW_DETAILS = "Хотите увидеть детальную информацию о рекомендованных мячах?"
     SHOW_PHOTOS = "Хотите посмотреть фотографии мячей?"
+    RECOMMENDATION_PENDING = "⏳ Готовлю персональную рекомендацию..."
+    NOTHING_FOUND_FILTERS = "😔 С таким размером и ценой мячей нет. Выберите другой размер:"
+    NOTHING_FOUND = (
+        "К сожалению, не найдено подходящих мячей для ваших критериев. "
+        "Попробуйте изменить параметры поиска."
+    )
+    SEARCH_USAGE = "Напишите, какой мяч вы ищете, например: /search мяч для детей в зал до 30 €"
+    SEARCH_EMPTY = (
+        "😔 По вашему запросу ничего не нашлось. "
+        "Попробуйте другие слова или начните подбор командой /start"
+    )
+    SESSION_EXPIRED = "Сессия подбора истекла. Для начала нового подбора введите /start"
     ERROR_API = "Произошла ошибка при обработке запроса. Пожалуйста, попробуйте позже."
     CANCELLED = "Выбор мяча завершен. Для начала нового подбора введите /start"
     ERROR_TOO_LONG = "Запрос слишком длинный, попробуйте сократить требования."
@@ -34,38 +190,41 @@ class Messages:
     HELP = """
 🏐 Команды бота:
 /start - Начать подбор мяча
+/search - Найти мяч по описанию
 /help - Показать это сообщение
 /cancel - Отменить текущий процесс
 
 ℹ️ Как пользоваться:
 1. Выберите ваш уровень игры
 2. Укажите где планируете использовать мяч
-3. Получите персональные рекомендации
-4. Изучите детали и фото мячей
+3. Выберите размер и бюджет
+4. Получите персональные рекомендации
+5. Изучите детали и фото мячей
+
+🔎 Можно просто написать, что вы ищете, например: «мяч для детей в зал до 30 €»
 """
 
 
 class ImagePaths:
     """Пути к изображениям мячей"""
     BASE_PATH = "images"
+    VARIANTS_PATH = f"{BASE_PATH}/variants"
+    PHOTO_VARIANT = "photo"
 
-    # Мячи для новичков (размер 0 и 1)
-    ERIMA_PURE_GRIP_4 = f"{BASE_PATH}/novice/erima_pure_grip_4.jpg"  # размер 0
-    MOLTEN_H0F1800 = f"{BASE_PATH}/novice/molten_h0f1800.jpg"  # размер 0
-    SELECT_TUCANA = f"{BASE_PATH}/novice/select_tucana.jpg"  # размер 1
+    # Подготовленные варианты изображений: исходный путь -> {вид: путь}
+    _variants: Dict[str, Dict[str, str]] = {}
 
-    # Мячи для среднего уровня (размер 1,2,3)
-    SELECT_REPLICA_EHF = f"{BASE_PATH}/intermediate/select_replica_ehf.jpg"
-    MOLTEN_SCHOOLMASTER = f"{BASE_PATH}/intermediate/molten_schoolmaster.jpg"
-    ERIMA_VRANJES = f"{BASE_PATH}/intermediate/erima_vranjes.jpg"
+    @classmethod
+    def register_variants(cls, image_path: str, variants: Dict[str, str]):
+        cls._variants[image_path] = variants
 
-    # Мячи для профессионалов (размер 2 и 3)
-    ERIMA_PURE_GRIP_1 = f"{BASE_PATH}/professional/erima_pure_grip_1.jpg"
-    MOLTEN_H3X5001 = f"{BASE_PATH}/professional/molten_h3x5001.jpg"
-    SELECT_ULTIMATE_CL = f"{BASE_PATH}/professional/select_ultimate_cl.jpg"
+    @classmethod
+    def variant(cls, image_path: str, kind: str = PHOTO_VARIANT) -> str:
+        """Путь к подготовленному варианту, а если его нет - к исходному файлу"""
+        return cls._variants.get(image_path, {}).get(kind, image_path)
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class HandballBall:
     """Класс для хранения информации о гандбольном мяче"""
     name: str
@@ -76,31 +235,80 @@ class HandballBall:
     description: str
     surface_type: str
     image_url: str
-    features: List[str]
+    features: Tuple[str, ...]
+    # Разбираются из size один раз при создании мяча
+    sizes: FrozenSet[int] = field(init=False, repr=False, compare=False)
+    circumference: Optional[Tuple[float, float]] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        sizes = parse_sizes(self.size)
+        object.__setattr__(self, 'sizes', sizes)
+        object.__setattr__(self, 'circumference', parse_circumference(self.size, sizes))
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> 'HandballBall':
+        """Мяч из записи файла каталога; повторяющиеся строки интернируются и хранятся один раз"""
+        return cls(
+            name=sys.intern(record['name']),
+            level=sys.intern(record['level']),
+            price=float(record['price']),
+            material=sys.intern(record['material']),
+            size=sys.intern(record['size']),
+            description=record['description'],
+            surface_type=sys.intern(record['surface_type']),
+            image_url=sys.intern(record['image_url']),
+            features=tuple(sys.intern(feature) for feature in record['features']),
+        )
+
+
+@dataclass
+class WebhookSettings:
+    """Параметры приема обновлений через вебхук"""
+    url: str
+    listen: str = "127.0.0.1"
+    port: int = 8443
+    path: str = "telegram"
+    secret_token: Optional[str] = None
 
 
 class MenuBuilder:
-    """Класс для создания меню и клавиатур"""
+    """Класс для создания меню и клавиатур
+
+    Клавиатуры неизменяемы, поэтому каждая строится один раз и переиспользуется.
+    """
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def get_level_keyboard() -> ReplyKeyboardMarkup:
-        keyboard = [
-            [KeyboardButton("Новичок")],
-            [KeyboardButton("Средний")],
-            [KeyboardButton("Профессионал")]
-        ]
+        keyboard = [[KeyboardButton(level)] for level in Choices.LEVELS]
         return ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def get_surface_keyboard() -> ReplyKeyboardMarkup:
+        keyboard = [[KeyboardButton(surface)] for surface in Choices.SURFACES]
+        return ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_size_keyboard(sizes: Tuple[str, ...] = Choices.SIZES) -> ReplyKeyboardMarkup:
+        """sizes - кнопки размеров, для которых в каталоге есть мячи (BallCatalog.size_options)"""
         keyboard = [
-            [KeyboardButton("В зале")],
-            [KeyboardButton("На улице")],
-            [KeyboardButton("Универсальное использование")]
+            [KeyboardButton(size) for size in sizes[start:start + 2]]
+            for start in range(0, len(sizes), 2)
         ]
+        keyboard.append([KeyboardButton(Choices.ANY_SIZE)])
+        return ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_price_keyboard(labels: Tuple[str, ...] = tuple(Choices.PRICE_LIMITS)) -> ReplyKeyboardMarkup:
+        """labels - кнопки цены, под которые попадает хотя бы один мяч (BallCatalog.price_options)"""
+        keyboard = [[KeyboardButton(label)] for label in labels]
         return ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def get_details_keyboard() -> ReplyKeyboardMarkup:
         keyboard = [
             [KeyboardButton("Показать детали")],
@@ -109,6 +317,24 @@ class MenuBuilder:
         ]
         return ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
 
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_after_details_keyboard() -> ReplyKeyboardMarkup:
+        keyboard = [
+            [KeyboardButton("Показать фото")],
+            [KeyboardButton("Завершить")]
+        ]
+        return ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_after_photos_keyboard() -> ReplyKeyboardMarkup:
+        keyboard = [
+            [KeyboardButton("Показать детали")],
+            [KeyboardButton("Завершить")]
+        ]
+        return ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
+
 
 class BallStats:
     """Класс для сбора статистики"""
@@ -124,18 +350,29 @@ class BallStats:
             'На улице': 0,
             'Универсальное использование': 0
         }
+        self.ball_stats: Dict[str, int] = {}
         self.total_requests = 0
 
-    def update_stats(self, level: str, surface: str):
-        self.level_stats[level] = self.level_stats.get(level, 0) + 1
-        self.surface_stats[surface] = self.surface_stats.get(surface, 0) + 1
-        self.total_requests += 1
+    @classmethod
+    def from_counts(cls, counts: Dict[tuple, int]) -> 'BallStats':
+        """Статистика из агрегированных счетчиков вида {(измерение, значение): количество}"""
+        stats = cls()
+        for (dimension, value), count in counts.items():
+            if dimension == 'total':
+                stats.total_requests += count
+            elif dimension == 'level':
+                stats.level_stats[value] = stats.level_stats.get(value, 0) + count
+            elif dimension == 'surface':
+                stats.surface_stats[value] = stats.surface_stats.get(value, 0) + count
+            elif dimension == 'ball':
+                stats.ball_stats[value] = stats.ball_stats.get(value, 0) + count
+        return stats
 
-    def get_stats_message(self) -> str:
+    def get_stats_message(self, title: str = "📊 Статистика запросов:", top_balls: int = 5) -> str:
         if self.total_requests == 0:
             return "📊 Статистика пока отсутствует"
 
-        message = "📊 Статистика запросов:\n\n"
+        message = f"{title}\n\n"
         message += "По уровню игры:\n"
         for level, count in self.level_stats.items():
             percentage = (count / self.total_requests * 100)
@@ -146,4 +383,10 @@ class BallStats:
             percentage = (count / self.total_requests * 100)
             message += f"- {surface}: {count} ({percentage:.1f}%)\n"
 
-        return message
\ No newline at end of file
+        if self.ball_stats and top_balls:
+            message += "\nЧаще всего рекомендуются:\n"
+            popular = sorted(self.ball_stats.items(), key=lambda item: (-item[1], item[0]))[:top_balls]
+            for name, count in popular:
+                message += f"- {name}: {count}\n"
+
+        return message
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, ConversationHandler, PersistenceInput
+
+from models import Config
+from storage import ConversationStore
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationPersistence(BasePersistence):
+    """Сохранение состояний ConversationHandler с отложенной пакетной записью.
+
+    Application передает изменения раз в update_interval; они копятся в памяти и
+    записываются одной транзакцией в пуле потоков, не задерживая обработку обновлений.
+    Данные пользователей хранит SessionStore, поэтому user/chat/bot data здесь не сохраняются.
+    """
+
+    # Задержка перед записью, чтобы все изменения одного цикла попали в одну транзакцию
+    FLUSH_DELAY = 0.1
+
+    def __init__(self, store: ConversationStore, update_interval: float = Config.PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        self.store = store
+        self._pending: Dict[Tuple[str, Tuple[int, ...]], Optional[int]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def get_conversations(self, name: str) -> Dict[Tuple[int, ...], int]:
+        conversations = await asyncio.to_thread(self.store.load, name, Config.SESSION_IDLE_TTL)
+        logger.info("Restored %d conversations for %s", len(conversations), name)
+        return conversations
+
+    async def update_conversation(self, name: str, key: Tuple[int, ...], new_state: Optional[object]) -> None:
+        self._pending[(name, key)] = new_state
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.FLUSH_DELAY)
+        await self._write_pending()
+
+    async def _write_pending(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            await asyncio.to_thread(
+                self.store.write_batch,
+                [(name, key, state) for (name, key), state in batch.items()]
+            )
+        except Exception as e:
+            logger.error("Error writing conversations: %s", e)
+            # Не теряем изменения: более новые значения из _pending имеют приоритет
+            self._pending = {**batch, **self._pending}
+
+    async def flush(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self._write_pending()
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data: object) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+
+class IdleConversationHandler(ConversationHandler):
+    """ConversationHandler, который завершает разговоры после простоя idle_ttl.
+
+    Встроенный conversation_timeout требует JobQueue (APScheduler); здесь, как и в
+    SessionStore, простаивающие разговоры вытесняются лениво при следующем обновлении.
+    Завершение проходит через persistence, поэтому запись удаляется и с диска.
+    """
+
+    def __init__(self, *args, idle_ttl: float, clock: Callable[[], float] = time.monotonic, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.idle_ttl = idle_ttl
+        self._clock = clock
+        # Порядок - от давно неактивных к недавним, поэтому просроченные всегда в начале
+        self._last_seen: "OrderedDict[Tuple[int, ...], float]" = OrderedDict()
+        self._restored_tracked = False
+        self.idle_evictions = 0
+
+    def check_update(self, update: object) -> Optional[Tuple[object, Tuple[int, ...], Any, object]]:
+        self.evict_idle()
+        return super().check_update(update)
+
+    async def handle_update(self, update, application, check_result, context) -> Optional[object]:
+        try:
+            return await super().handle_update(update, application, check_result, context)
+        finally:
+            key = check_result[1]
+            if key in self._conversations:
+                self._last_seen[key] = self._clock()
+                self._last_seen.move_to_end(key)
+            else:
+                self._last_seen.pop(key, None)
+
+    def evict_idle(self) -> int:
+        """Завершает разговоры без обновлений дольше idle_ttl; возвращает их число"""
+        now = self._clock()
+        if not self._restored_tracked:
+            # Разговоры, восстановленные из persistence, отсчитываются от запуска
+            for key in self._conversations:
+                self._last_seen.setdefault(key, now)
+            self._restored_tracked = True
+
+        deadline = now - self.idle_ttl
+        evicted = 0
+        while self._last_seen:
+            key, last_seen = next(iter(self._last_seen.items()))
+            if last_seen > deadline:
+                break
+            del self._last_seen[key]
+            if key in self._conversations:
+                self._update_state(self.END, key)
+                evicted += 1
+        self.idle_evictions += evicted
+        return evicted
+
+    def active_count(self) -> int:
+        return len(self._conversations)
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Coroutine, Deque, Dict, Optional, Tuple
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from models import Config
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Priority:
+    """Приоритеты исходящих запросов: меньшее значение отправляется раньше"""
+    INTERACTIVE = 0
+    BULK = 1
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class PriorityRateLimiter(BaseRateLimiter[Dict[str, Any]]):
+    """Планировщик исходящих запросов к Telegram.
+
+    Держит общую корзину токенов и корзину на каждый чат, пропускает интерактивные ответы
+    раньше массовых (детали, фото) и при ответе 429 приостанавливает отправку на retry_after.
+    Приоритет передается через rate_limit_args={'priority': Priority.BULK}.
+    """
+
+    CLEANUP_INTERVAL = 60
+
+    def __init__(self,
+                 overall_rate: float = Config.TELEGRAM_OVERALL_RATE,
+                 chat_rate: float = Config.TELEGRAM_CHAT_RATE,
+                 chat_burst: float = Config.TELEGRAM_CHAT_BURST,
+                 group_rate: float = Config.TELEGRAM_GROUP_RATE,
+                 max_retries: int = Config.TELEGRAM_MAX_RETRIES):
+        self.overall_rate = overall_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+
+        self._queues: Tuple[Deque[tuple], ...] = (deque(), deque())
+        self._chat_buckets: Dict[Any, TokenBucket] = {}
+        self._overall: Optional[TokenBucket] = None
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.sent = 0
+        self.retry_after_count = 0
+        self.max_queue_depth = 0
+
+    async def initialize(self) -> None:
+        # ExtBot.initialize вызывается и из Application, и из Updater
+        if self._task is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._overall = TokenBucket(self.overall_rate, self.overall_rate, loop.time())
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @property
+    def queue_depth(self) -> Dict[str, int]:
+        return {
+            'interactive': len(self._queues[Priority.INTERACTIVE]),
+            'bulk': len(self._queues[Priority.BULK]),
+        }
+
+    def get_stats(self) -> dict:
+        return {
+            **self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'sent': self.sent,
+            'retry_after': self.retry_after_count,
+            'tracked_chats': len(self._chat_buckets),
+        }
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Any]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ) -> Any:
+        chat_id = data.get('chat_id')
+        priority = (rate_limit_args or {}).get('priority', Priority.INTERACTIVE)
+
+        for attempt in range(self.max_retries + 1):
+            # Запросы без чата (ответы на inline-запросы и служебные методы) не ограничиваются
+            if chat_id is not None:
+                queued_at = time.perf_counter()
+                await self._acquire(chat_id, priority)
+                metrics.observe('telegram_queue_wait_seconds', time.perf_counter() - queued_at, method=endpoint)
+            try:
+                result = await self._send(callback, args, kwargs, endpoint)
+            except RetryAfter as e:
+                self.retry_after_count += 1
+                if attempt == self.max_retries:
+                    raise
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') \
+                    else float(e.retry_after)
+                logger.warning("Flood limit on %s, pausing for %ss", endpoint, retry_after)
+                loop = asyncio.get_running_loop()
+                self._paused_until = max(self._paused_until, loop.time() + retry_after)
+                if chat_id is None:
+                    await asyncio.sleep(retry_after)
+                continue
+
+            self.sent += 1
+            return result
+
+    @staticmethod
+    async def _send(callback: Callable[..., Coroutine[Any, Any, Any]], args: Any,
+                    kwargs: Dict[str, Any], endpoint: str) -> Any:
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            metrics.observe('telegram_request_seconds', time.perf_counter() - started, method=endpoint)
+
+    async def _acquire(self, chat_id: Any, priority: int):
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues[max(Priority.INTERACTIVE, min(priority, Priority.BULK))]
+        queue.append((chat_id, future))
+        self.max_queue_depth = max(self.max_queue_depth, sum(len(q) for q in self._queues))
+        self._wakeup.set()
+        await future
+
+    def _chat_bucket(self, chat_id: Any, now: float) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Отрицательные идентификаторы - группы и каналы с более строгим лимитом
+            is_group = isinstance(chat_id, int) and chat_id < 0
+            bucket = TokenBucket(
+                self.group_rate if is_group else self.chat_rate,
+                1 if is_group else self.chat_burst,
+                now
+            )
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _pick(self, now: float) -> Tuple[Optional[tuple], float]:
+        """Первый по приоритету запрос, чат которого не исчерпал лимит, и время до следующего"""
+        soonest = float('inf')
+        for queue in self._queues:
+            for entry in queue:
+                chat_id, future = entry
+                if future.done():
+                    continue
+                delay = self._chat_bucket(chat_id, now).delay(now)
+                if delay <= 0:
+                    queue.remove(entry)
+                    return entry, 0.0
+                soonest = min(soonest, delay)
+        return None, soonest
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        last_cleanup = loop.time()
+
+        while True:
+            for queue in self._queues:
+                while queue and queue[0][1].done():
+                    queue.popleft()
+
+            if not any(self._queues):
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = loop.time()
+            wait = max(self._paused_until - now, self._overall.delay(now))
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+
+            entry, wait = self._pick(now)
+            if entry is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait if wait != float('inf') else None)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            chat_id, future = entry
+            self._overall.consume(now)
+            self._chat_bucket(chat_id, now).consume(now)
+            future.set_result(None)
+
+            if now - last_cleanup > self.CLEANUP_INTERVAL:
+                last_cleanup = now
+                for idle_chat in [key for key, bucket in self._chat_buckets.items() if bucket.is_full(now)]:
+                    del self._chat_buckets[idle_chat]
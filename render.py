@@ -0,0 +1,76 @@
+from typing import Dict, Iterable, Sequence, Tuple
+
+from models import HandballBall
+
+# Максимальная длина текста одного сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+
+def render_card(ball: HandballBall) -> str:
+    return (
+            f"🏐 *{ball.name}*\n"
+            f"📊 Уровень: {ball.level}\n"
+            f"💰 Цена: {ball.price:.2f} €\n"
+            f"📏 Размер: {ball.size}\n"
+            f"🏭 Материал: {ball.material}\n"
+            f"🏟 Тип поверхности: {ball.surface_type}\n\n"
+            f"📝 Описание: {ball.description}\n\n"
+            f"✨ Особенности:\n" +
+            "\n".join(f"• {feature}" for feature in ball.features)
+    )
+
+
+def render_caption(ball: HandballBall) -> str:
+    return f"🏐 {ball.name}\n💰 Цена: {ball.price:.2f} €\n📏 Размер: {ball.size}"
+
+
+def render_summary(balls: Sequence[HandballBall]) -> str:
+    return "🏐 Подходящие мячи:\n" + "\n".join(f"• {ball.name} — {ball.price:.2f} €" for ball in balls)
+
+
+def join_messages(parts: Iterable[str], separator: str = "\n\n") -> Tuple[str, ...]:
+    """Склеивает части в как можно меньшее число сообщений, не разрывая части"""
+    messages = []
+    current = ""
+    for part in parts:
+        candidate = f"{current}{separator}{part}" if current else part
+        if current and len(candidate) > MESSAGE_LIMIT:
+            messages.append(current)
+            current = part
+        else:
+            current = candidate
+    if current:
+        messages.append(current)
+    return tuple(messages)
+
+
+class CardRenderer:
+    """Тексты карточек, подписей и подборок, построенные один раз для версии каталога"""
+
+    def __init__(self, balls: Sequence[HandballBall], answers: Iterable[Sequence[HandballBall]] = ()):
+        self._cards: Dict[str, str] = {ball.name: render_card(ball) for ball in balls}
+        self._captions: Dict[str, str] = {ball.name: render_caption(ball) for ball in balls}
+        self._details: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+        self._summaries: Dict[Tuple[str, ...], str] = {}
+        for answer in answers:
+            key = tuple(ball.name for ball in answer)
+            if key not in self._details:
+                self._details[key] = join_messages(self.card(ball) for ball in answer)
+                self._summaries[key] = render_summary(answer)
+
+    def card(self, ball: HandballBall) -> str:
+        card = self._cards.get(ball.name)
+        return card if card is not None else render_card(ball)
+
+    def caption(self, ball: HandballBall) -> str:
+        caption = self._captions.get(ball.name)
+        return caption if caption is not None else render_caption(ball)
+
+    def details(self, balls: Sequence[HandballBall]) -> Tuple[str, ...]:
+        """Карточки всех мячей подборки, собранные в минимальное число сообщений"""
+        details = self._details.get(tuple(ball.name for ball in balls))
+        return details if details is not None else join_messages(self.card(ball) for ball in balls)
+
+    def summary(self, balls: Sequence[HandballBall]) -> str:
+        summary = self._summaries.get(tuple(ball.name for ball in balls))
+        return summary if summary is not None else render_summary(balls)
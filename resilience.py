@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional, Tuple, Type, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class CircuitOpenError(Exception):
+    """Вызов отклонен: внешний сервис временно считается недоступным"""
+
+
+class CircuitBreaker:
+    """Размыкатель цепи: после серии ошибок отправляет запросы сразу в запасной путь"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int, reset_timeout: float,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+
+        if self.state == self.OPEN:
+            if self._clock() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+
+        # В полуоткрытом состоянии пропускаем только один пробный запрос
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("Circuit closed")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def release(self):
+        """Вызов прерван (отмена, закрытие генератора) и не считается ни успехом, ни ошибкой;
+        пробный запрос освобождается, чтобы цепь не осталась полуоткрытой навсегда"""
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning("Circuit opened after %d failures", self.failures)
+            self.state = self.OPEN
+            self.opened_at = self._clock()
+
+
+class LatencyTracker:
+    """Скользящее окно задержек для расчета перцентилей"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self._samples = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, latency: float):
+        self._samples.append(latency)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+        return ordered[index]
+
+
+class ResilientCaller:
+    """Обертка над вызовом внешнего API: дедлайн, повторы с джиттером,
+    размыкатель цепи и опциональный хеджированный запрос"""
+
+    def __init__(self, *, max_retries: int, base_delay: float, max_delay: float,
+                 attempt_timeout: float, deadline: float, breaker: CircuitBreaker,
+                 retry_on: Tuple[Type[BaseException], ...] = (),
+                 hedge_percentile: Optional[float] = None,
+                 latency: Optional[LatencyTracker] = None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.breaker = breaker
+        self.retry_on = retry_on + (asyncio.TimeoutError,)
+        self.hedge_percentile = hedge_percentile
+        self.latency = latency or LatencyTracker()
+        self.retries = 0
+        self.hedged = 0
+        self.rejected = 0
+
+    async def call(self, func: Callable[[], Awaitable[T]]) -> T:
+        # Размыкатель учитывает логический вызов целиком: одна ошибка - после исчерпания повторов
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpenError("Upstream circuit is open")
+
+        try:
+            result = await self._call_with_retries(func)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+
+        self.breaker.record_success()
+        return result
+
+    async def _call_with_retries(self, func: Callable[[], Awaitable[T]]) -> T:
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + self.deadline
+        attempt = 0
+
+        while True:
+            remaining = deadline_at - loop.time()
+            try:
+                return await asyncio.wait_for(
+                    self._attempt(func),
+                    timeout=min(self.attempt_timeout, remaining)
+                )
+            except self.retry_on as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                if loop.time() + delay >= deadline_at:
+                    raise
+                logger.warning("Upstream call failed (%r), retry %d in %.2fs", e, attempt, delay)
+                self.retries += 1
+                await asyncio.sleep(delay)
+
+    async def _attempt(self, func: Callable[[], Awaitable[T]]) -> T:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        hedge_delay = (
+            self.latency.percentile(self.hedge_percentile)
+            if self.hedge_percentile is not None else None
+        )
+
+        if hedge_delay is None:
+            result = await func()
+        else:
+            result = await self._hedged(func, hedge_delay)
+
+        self.latency.record(loop.time() - started)
+        return result
+
+    async def _hedged(self, func: Callable[[], Awaitable[T]], hedge_delay: float) -> T:
+        tasks = [asyncio.ensure_future(func())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if done:
+                return tasks[0].result()
+
+            # Основной запрос медленнее перцентиля: отправляем второй и берем первый успешный
+            self.hedged += 1
+            tasks.append(asyncio.ensure_future(func()))
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
@@ -0,0 +1,209 @@
+import bisect
+import math
+import re
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from models import HandballBall
+
+_WORD = re.compile(r'[a-zа-я0-9]+')
+_NUMBER = r'(\d+(?:[.,]\d+)?)'
+_CURRENCY = r'\s*(?:€|eur\w*|евро)?'
+_PRICE_RANGE = re.compile(
+    rf'\bот\s*{_NUMBER}{_CURRENCY}\s*до\s*{_NUMBER}{_CURRENCY}|{_NUMBER}\s*[-–—]\s*{_NUMBER}\s*(?:€|eur\w*|евро)'
+)
+# Ключевые слова цены отделены \b, чтобы не совпадать внутри слов ("подо 30")
+_PRICE_MAX = re.compile(rf'(?:\b(?:до|дешевле|не дороже|не более|максимум)|<=?)\s*{_NUMBER}{_CURRENCY}')
+_PRICE_MIN = re.compile(rf'(?:\b(?:от|дороже|не дешевле|не менее|минимум)|>=?)\s*{_NUMBER}{_CURRENCY}')
+_SIZE_WORD = r'(?:размер\w*|size)'
+# Диапазоны размеров: "от 2 до 3 размера", "с 1 по 2 размер", "размер 2-3", "2-3 размер"
+_SIZE_RANGE = re.compile(
+    rf'\b(?:от|с)\s*(\d)\s*(?:до|по)\s*(\d)(?:-?\w{{1,2}})?\s*\b{_SIZE_WORD}'
+    rf'|\b{_SIZE_WORD}\s*(\d)\s*(?:[-–—]|до|по)\s*(\d)(?!\d)'
+    rf'|\b(\d)\s*[-–—]\s*(\d)(?:-?\w{{1,2}})?\s*\b{_SIZE_WORD}'
+)
+# Один размер: "размер 2", "3 размер", "3-го размера"
+_SIZE = re.compile(rf'\b{_SIZE_WORD}\s*(\d)(?!\d)|\b(\d)(?:-?\w{{1,2}})?\s*\b{_SIZE_WORD}')
+# Окружность в см: "54 см", "54-56 см", "окружность от 54 до 56 см"
+_CIRCUMFERENCE = re.compile(
+    rf'(?:\bокружност\w*\s*)?(?:\bот\s*{_NUMBER}\s*до\s*{_NUMBER}|{_NUMBER}\s*[-–—]\s*{_NUMBER}|{_NUMBER})\s*см\b'
+)
+
+# Служебные слова запроса, не несущие смысла для поиска
+STOP_WORDS = frozenset((
+    'и', 'в', 'во', 'на', 'для', 'с', 'со', 'по', 'до', 'от', 'к', 'из', 'а', 'но', 'или', 'не',
+    'мне', 'нужен', 'нужна', 'нужно', 'хочу', 'ищу', 'какой', 'какие', 'мяч', 'мяча', 'мячи',
+    'мячик', 'евро', 'eur', 'euro',
+))
+
+# Окончания для упрощенного стемминга, от длинных к коротким
+_ENDINGS = tuple(sorted((
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ых', 'их', 'ой', 'ей', 'ый', 'ий',
+    'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ую', 'юю', 'ов', 'ев', 'ам', 'ям', 'ах', 'ях', 'ом',
+    'ем', 'а', 'я', 'ы', 'и', 'о', 'е', 'у', 'ю', 'ь',
+), key=len, reverse=True))
+MIN_STEM = 3
+
+
+def stem(word: str) -> str:
+    """Отбрасывает типичное окончание русского слова, сохраняя основу не короче MIN_STEM"""
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    text = text.lower().replace('ё', 'е')
+    return [stem(word) for word in _WORD.findall(text) if word not in STOP_WORDS]
+
+
+def _price(value: str) -> float:
+    return float(value.replace(',', '.'))
+
+
+class SearchQuery(NamedTuple):
+    terms: Tuple[str, ...]
+    min_price: float = 0.0
+    max_price: float = float('inf')
+    sizes: Optional[FrozenSet[int]] = None
+    circumference: Optional[Tuple[float, float]] = None
+
+
+def parse_query(text: str) -> SearchQuery:
+    """Разбирает запрос на слова и ограничения цены ("до 30 €", "от 20 до 40 евро"),
+    размера ("размер 2", "от 2 до 3 размера") и окружности ("54-56 см")"""
+    text = text.lower()
+    min_price, max_price = 0.0, float('inf')
+
+    # Окружность разбирается раньше цены: "до 56 см" - не цена
+    circumference = None
+    match = _CIRCUMFERENCE.search(text)
+    if match:
+        bounds = [_price(value) for value in match.groups() if value is not None]
+        circumference = min(bounds), max(bounds)
+        text = text[:match.start()] + ' ' + text[match.end():]
+
+    # Размер разбирается первым, чтобы "размер 2 до 30" и "от 2 до 3 размера"
+    # не читались как цена
+    sizes = set()
+    for match in _SIZE_RANGE.finditer(text):
+        low, high = sorted(int(value) for value in match.groups() if value is not None)
+        sizes.update(range(low, high + 1))
+    text = _SIZE_RANGE.sub(' ', text)
+    for match in _SIZE.finditer(text):
+        sizes.add(int(match.group(1) or match.group(2)))
+    text = _SIZE.sub(' ', text)
+    sizes = frozenset(sizes) or None
+
+    match = _PRICE_RANGE.search(text)
+    if match:
+        bounds = [_price(value) for value in match.groups() if value is not None]
+        low, high = sorted(bounds)
+        min_price, max_price = low, high
+        text = text[:match.start()] + ' ' + text[match.end():]
+    else:
+        match = _PRICE_MAX.search(text)
+        if match:
+            max_price = _price(match.group(1))
+            text = text[:match.start()] + ' ' + text[match.end():]
+        match = _PRICE_MIN.search(text)
+        if match:
+            min_price = _price(match.group(1))
+            text = text[:match.start()] + ' ' + text[match.end():]
+
+    return SearchQuery(tuple(dict.fromkeys(tokenize(text))), min_price, max_price, sizes, circumference)
+
+
+class SearchIndex:
+    """Инвертированный индекс каталога с ранжированием BM25, строится один раз для версии каталога.
+
+    Слово запроса совпадает с термином индекса точно или как префикс (с меньшим весом),
+    что сглаживает неточности упрощенного стемминга: "детей" -> "дет" находит "детск".
+    """
+
+    K1 = 1.5
+    B = 0.75
+    PREFIX_WEIGHT = 0.5
+    # Веса полей: совпадение в названии важнее совпадения в описании
+    FIELD_WEIGHTS = (
+        ('name', 3.0),
+        ('level', 1.0),
+        ('surface_type', 1.0),
+        ('size', 1.0),
+        ('material', 1.0),
+        ('description', 1.0),
+        ('features', 1.0),
+    )
+
+    def __init__(self, balls: Sequence[HandballBall]):
+        self.balls = tuple(balls)
+        postings: Dict[str, Dict[int, float]] = {}
+        lengths = []
+        for doc_id, ball in enumerate(self.balls):
+            length = 0.0
+            for text, weight in self._fields(ball):
+                for term in tokenize(text):
+                    docs = postings.setdefault(term, {})
+                    docs[doc_id] = docs.get(doc_id, 0.0) + weight
+                    length += weight
+            lengths.append(length)
+
+        count = len(self.balls)
+        average = sum(lengths) / count if count else 1.0
+        self._postings: Dict[str, Tuple[Tuple[int, float], ...]] = {
+            term: tuple(docs.items()) for term, docs in postings.items()
+        }
+        self._idf: Dict[str, float] = {
+            term: math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in postings.items()
+        }
+        self._norms = tuple(self.K1 * (1 - self.B + self.B * length / average) for length in lengths)
+        self._vocabulary = sorted(postings)
+
+    def _fields(self, ball: HandballBall) -> Iterable[Tuple[str, float]]:
+        for field, weight in self.FIELD_WEIGHTS:
+            value = getattr(ball, field)
+            yield (" ".join(value) if isinstance(value, (list, tuple)) else str(value)), weight
+
+    def _expand(self, term: str) -> List[Tuple[str, float]]:
+        expanded = [(term, 1.0)] if term in self._postings else []
+        if len(term) >= MIN_STEM:
+            start = bisect.bisect_right(self._vocabulary, term)
+            end = bisect.bisect_left(self._vocabulary, term + '\uffff')
+            expanded.extend((candidate, self.PREFIX_WEIGHT) for candidate in self._vocabulary[start:end])
+        return expanded
+
+    def score(self, terms: Iterable[str]) -> Dict[int, float]:
+        scores: Dict[int, float] = {}
+        for term in terms:
+            for index_term, weight in self._expand(term):
+                idf = self._idf[index_term]
+                for doc_id, tf in self._postings[index_term]:
+                    gain = weight * idf * tf * (self.K1 + 1) / (tf + self._norms[doc_id])
+                    scores[doc_id] = scores.get(doc_id, 0.0) + gain
+        return scores
+
+    @staticmethod
+    def _fits(ball: HandballBall, circumference: Tuple[float, float]) -> bool:
+        low, high = circumference
+        return ball.circumference is not None and ball.circumference[0] <= high and low <= ball.circumference[1]
+
+    def search(self, query: Union[str, SearchQuery], limit: Optional[int] = None) -> Tuple[HandballBall, ...]:
+        """Мячи по убыванию релевантности; запрос только с ценой возвращает мячи по цене"""
+        if isinstance(query, str):
+            query = parse_query(query)
+        if query.terms:
+            scores = self.score(query.terms)
+        else:
+            scores = dict.fromkeys(range(len(self.balls)), 0.0)
+
+        ranked = sorted(
+            (doc_id for doc_id in scores
+             if query.min_price <= self.balls[doc_id].price <= query.max_price and
+             (query.sizes is None or query.sizes & self.balls[doc_id].sizes) and
+             (query.circumference is None or self._fits(self.balls[doc_id], query.circumference))),
+            key=lambda doc_id: (-scores[doc_id], self.balls[doc_id].price)
+        )
+        if limit is not None:
+            ranked = ranked[:limit]
+        return tuple(self.balls[doc_id] for doc_id in ranked)
@@ -0,0 +1,261 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from storage import SessionRecordStore
+
+logger = logging.getLogger(__name__)
+
+
+class Session:
+    """Состояние подбора одного пользователя: только выбор и идентификаторы мячей каталога"""
+
+    __slots__ = ('level', 'surface', 'size', 'max_price', 'ball_ids', 'last_seen', 'written', 'written_seen')
+
+    def __init__(self, now: float):
+        self.level: Optional[str] = None
+        self.surface: Optional[str] = None
+        # Уточнения подбора: None - без ограничения
+        self.size: Optional[int] = None
+        self.max_price: Optional[float] = None
+        self.ball_ids: Tuple[str, ...] = ()
+        self.last_seen = now
+        # Что уже записано на диск: выбор пользователя и last_seen (None - ничего)
+        self.written: Optional[tuple] = None
+        self.written_seen = 0.0
+
+    def choice(self) -> tuple:
+        return self.level, self.surface, self.size, self.max_price, self.ball_ids
+
+    def as_user_data(self) -> Dict[str, Any]:
+        user_data = {'level': self.level}
+        if self.surface is not None:
+            user_data['surface'] = self.surface
+        if self.size is not None:
+            user_data['size'] = self.size
+        if self.max_price is not None:
+            user_data['max_price'] = self.max_price
+        return user_data
+
+
+class SessionStore:
+    """Сессии пользователей с вытеснением по времени простоя и общим ограничением LRU.
+
+    Если задан backend, сессии сохраняются на диск отложенной пакетной записью,
+    а после перезапуска загружаются лениво, при первом обращении пользователя.
+    Сессия без изменений перезаписывается, только если last_seen сдвинулся больше чем
+    на touch_interval; раз в purge_interval с диска удаляются просроченные записи.
+    """
+
+    def __init__(self, max_sessions: int, idle_ttl: float,
+                 backend: Optional[SessionRecordStore] = None,
+                 clock: Callable[[], float] = time.time,
+                 touch_interval: float = 0.0,
+                 purge_interval: Optional[float] = None):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.backend = backend
+        self._clock = clock
+        self.touch_interval = touch_interval
+        self.purge_interval = purge_interval
+        # Порядок - от давно неактивных к недавним, поэтому просроченные всегда в начале
+        self._sessions: "OrderedDict[int, Session]" = OrderedDict()
+        self._dirty: Set[int] = set()
+        self._deleted: Set[int] = set()
+        # Вытесненные по LRU сессии, которые еще не записаны на диск
+        self._evicted: Dict[int, tuple] = {}
+        self.idle_evictions = 0
+        self.lru_evictions = 0
+        self.loads = 0
+        self.purged = 0
+
+    async def get(self, user_id: int) -> Optional[Session]:
+        now = self._clock()
+        self._evict_idle(now)
+        session = self._sessions.get(user_id)
+        if session is None:
+            session = await self._load(user_id, now)
+            if session is None:
+                return None
+        session.last_seen = now
+        self._sessions.move_to_end(user_id)
+        # Сессия только кандидат на запись: flush пропустит ее, если она не изменилась
+        self._mark_dirty(user_id)
+        return session
+
+    def create(self, user_id: int) -> Session:
+        """Начинает новую сессию, заменяя прежнюю"""
+        now = self._clock()
+        self._evict_idle(now)
+        session = Session(now)
+        self._evicted.pop(user_id, None)
+        self._insert(user_id, session)
+        self._mark_dirty(user_id)
+        return session
+
+    async def get_or_create(self, user_id: int) -> Session:
+        session = await self.get(user_id)
+        return session if session is not None else self.create(user_id)
+
+    def drop(self, user_id: int):
+        self._sessions.pop(user_id, None)
+        self._dirty.discard(user_id)
+        self._evicted.pop(user_id, None)
+        if self.backend is not None:
+            self._deleted.add(user_id)
+
+    def _insert(self, user_id: int, session: Session):
+        self._sessions[user_id] = session
+        self._sessions.move_to_end(user_id)
+        while len(self._sessions) > self.max_sessions:
+            evicted_id, evicted = self._sessions.popitem(last=False)
+            # Вытесненная по LRU сессия остается на диске и загрузится при следующем обращении
+            if evicted_id in self._dirty:
+                self._dirty.discard(evicted_id)
+                if self._needs_write(evicted):
+                    self._evicted[evicted_id] = self._record(evicted_id, evicted)
+            self.lru_evictions += 1
+
+    def _needs_write(self, session: Session) -> bool:
+        return (session.choice() != session.written
+                or session.last_seen - session.written_seen >= self.touch_interval)
+
+    @staticmethod
+    def _record(user_id: int, session: Session) -> tuple:
+        return (user_id, session.level, session.surface, session.size, session.max_price,
+                session.ball_ids, session.last_seen)
+
+    def _mark_dirty(self, user_id: int):
+        if self.backend is not None:
+            self._dirty.add(user_id)
+            self._deleted.discard(user_id)
+
+    async def _load(self, user_id: int, now: float) -> Optional[Session]:
+        if self.backend is None or user_id in self._deleted:
+            return None
+
+        pending = self._evicted.pop(user_id, None)
+        if pending is not None:
+            record = pending[1:]
+            self._dirty.add(user_id)
+        else:
+            record = await asyncio.to_thread(self.backend.load, user_id)
+        if record is None:
+            return None
+
+        level, surface, size, max_price, ball_ids, last_seen = record
+        if last_seen <= now - self.idle_ttl:
+            self._deleted.add(user_id)
+            self.idle_evictions += 1
+            return None
+
+        session = Session(last_seen)
+        session.level = level
+        session.surface = surface
+        session.size = size
+        session.max_price = max_price
+        session.ball_ids = ball_ids
+        if pending is None:
+            session.written = session.choice()
+            session.written_seen = last_seen
+        self._insert(user_id, session)
+        self.loads += 1
+        return session
+
+    def _evict_idle(self, now: float):
+        deadline = now - self.idle_ttl
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if session.last_seen > deadline:
+                break
+            del self._sessions[user_id]
+            self._dirty.discard(user_id)
+            if self.backend is not None:
+                self._deleted.add(user_id)
+            self.idle_evictions += 1
+
+    def evict_idle(self) -> int:
+        before = self.idle_evictions
+        self._evict_idle(self._clock())
+        return self.idle_evictions - before
+
+    async def flush(self):
+        """Записывает изменившиеся сессии одной транзакцией в пуле потоков"""
+        if self.backend is None or not (self._dirty or self._deleted or self._evicted):
+            return
+
+        records = list(self._evicted.values())
+        written = []
+        for user_id in self._dirty:
+            session = self._sessions.get(user_id)
+            if session is None:
+                continue
+            if not self._needs_write(session):
+                continue
+            records.append(self._record(user_id, session))
+            written.append((session, session.written, session.written_seen))
+            session.written = session.choice()
+            session.written_seen = session.last_seen
+        deletions = tuple(self._deleted)
+        self._dirty = set()
+        self._deleted = set()
+        self._evicted = {}
+        if not records and not deletions:
+            return
+
+        try:
+            await asyncio.to_thread(self.backend.write_batch, records, deletions)
+        except Exception as e:
+            logger.error("Error writing sessions: %s", e)
+            for session, choice, seen in written:
+                session.written, session.written_seen = choice, seen
+            for record in records:
+                if record[0] in self._sessions:
+                    self._dirty.add(record[0])
+                else:
+                    self._evicted.setdefault(record[0], record)
+            self._deleted.update(deletions)
+
+    async def purge(self) -> int:
+        """Удаляет с диска сессии пользователей, которые не вернулись до истечения срока"""
+        if self.backend is None:
+            return 0
+        # Запас touch_interval: на диске last_seen может отставать от действительного
+        purged = await asyncio.to_thread(self.backend.delete_older_than, self.idle_ttl + self.touch_interval)
+        self.purged += purged
+        if purged:
+            logger.info("Purged %d expired sessions", purged)
+        return purged
+
+    async def run_write_behind(self, interval: float):
+        """Периодически сохраняет сессии, пока задача не будет отменена"""
+        loop = asyncio.get_running_loop()
+        purge_at = loop.time()
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                self.evict_idle()
+                await self.flush()
+                if self.purge_interval is not None and loop.time() >= purge_at:
+                    purge_at = loop.time() + self.purge_interval
+                    try:
+                        await self.purge()
+                    except Exception as e:
+                        logger.error("Error purging sessions: %s", e)
+        finally:
+            await asyncio.shield(self.flush())
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get_stats(self) -> dict:
+        return {
+            'resident': len(self._sessions),
+            'idle_evictions': self.idle_evictions,
+            'lru_evictions': self.lru_evictions,
+            'loads': self.loads,
+            'purged': self.purged,
+            'dirty': len(self._dirty),
+        }
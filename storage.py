@@ -0,0 +1,318 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStore:
+    """Базовый класс для хранилищ на SQLite, доступных из пула потоков"""
+
+    SCHEMA = ""
+    # Сколько секунд ждать блокировку записи, если базу одновременно пишут другие процессы
+    BUSY_TIMEOUT = 10
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=self.BUSY_TIMEOUT, check_same_thread=False)
+        # WAL и synchronous=NORMAL: запись без fsync на каждую транзакцию и чтение без блокировок
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(self.SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RecommendationStore(SQLiteStore):
+    """Постоянное хранилище сгенерированных рекомендаций на SQLite"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS recommendations ("
+        " level TEXT NOT NULL,"
+        " surface TEXT NOT NULL,"
+        " model TEXT NOT NULL,"
+        " prompt_version INTEGER NOT NULL,"
+        " text TEXT NOT NULL,"
+        " created_at REAL NOT NULL,"
+        " PRIMARY KEY (level, surface, model, prompt_version))"
+    )
+
+    def load(self, model: str, prompt_version: int, max_age: float) -> Dict[Tuple[str, str], str]:
+        """Загружает свежие рекомендации для текущей модели и версии промпта"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT level, surface, text FROM recommendations "
+                "WHERE model = ? AND prompt_version = ? AND created_at >= ?",
+                (model, prompt_version, time.time() - max_age)
+            ).fetchall()
+        return {(level, surface): text for level, surface, text in rows}
+
+    def get(self, level: str, surface: str, model: str, prompt_version: int,
+            max_age: float) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text FROM recommendations "
+                "WHERE level = ? AND surface = ? AND model = ? AND prompt_version = ? "
+                "AND created_at >= ?",
+                (level, surface, model, prompt_version, time.time() - max_age)
+            ).fetchone()
+        return row[0] if row else None
+
+    def save(self, level: str, surface: str, model: str, prompt_version: int, text: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO recommendations "
+                "(level, surface, model, prompt_version, text, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (level, surface, model, prompt_version, text, time.time())
+            )
+            self._conn.commit()
+
+    async def aget(self, *args, **kwargs) -> Optional[str]:
+        return await asyncio.to_thread(self.get, *args, **kwargs)
+
+    async def asave(self, *args, **kwargs):
+        await asyncio.to_thread(self.save, *args, **kwargs)
+
+
+class FileIdStore(SQLiteStore):
+    """Telegram file_id загруженных фотографий, по пути и хэшу содержимого файла"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS file_ids ("
+        " path TEXT NOT NULL,"
+        " digest TEXT NOT NULL,"
+        " file_id TEXT NOT NULL,"
+        " PRIMARY KEY (path, digest))"
+    )
+
+    def __init__(self, path: Union[str, Path]):
+        super().__init__(path)
+        with self._lock:
+            rows = self._conn.execute("SELECT path, digest, file_id FROM file_ids").fetchall()
+        self._file_ids: Dict[Tuple[str, str], str] = {(path, digest): file_id for path, digest, file_id in rows}
+
+    def get(self, path: str, digest: str) -> Optional[str]:
+        return self._file_ids.get((path, digest))
+
+    def load(self, path: str, digest: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_id FROM file_ids WHERE path = ? AND digest = ?", (path, digest)
+            ).fetchone()
+        if row is None:
+            return None
+        self._file_ids[(path, digest)] = row[0]
+        return row[0]
+
+    async def aget(self, path: str, digest: str) -> Optional[str]:
+        """file_id из памяти, а при промахе - из базы, куда его мог записать другой процесс"""
+        file_id = self._file_ids.get((path, digest))
+        if file_id is None:
+            file_id = await asyncio.to_thread(self.load, path, digest)
+        return file_id
+
+    def save(self, path: str, digest: str, file_id: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_ids (path, digest, file_id) VALUES (?, ?, ?)",
+                (path, digest, file_id)
+            )
+            self._conn.commit()
+
+    def delete(self, path: str, digest: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM file_ids WHERE path = ? AND digest = ?", (path, digest))
+            self._conn.commit()
+
+    async def aset(self, path: str, digest: str, file_id: str):
+        self._file_ids[(path, digest)] = file_id
+        await asyncio.to_thread(self.save, path, digest, file_id)
+
+    async def adelete(self, path: str, digest: str):
+        self._file_ids.pop((path, digest), None)
+        await asyncio.to_thread(self.delete, path, digest)
+
+
+class ConversationStore(SQLiteStore):
+    """Состояния ConversationHandler: имя разговора, ключ (чат, пользователь) и состояние"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS conversations ("
+        " name TEXT NOT NULL,"
+        " key TEXT NOT NULL,"
+        " state INTEGER NOT NULL,"
+        " updated_at REAL NOT NULL,"
+        " PRIMARY KEY (name, key))"
+    )
+
+    @staticmethod
+    def _encode_key(key: Tuple[int, ...]) -> str:
+        return ",".join(str(part) for part in key)
+
+    @staticmethod
+    def _decode_key(key: str) -> Tuple[int, ...]:
+        return tuple(int(part) for part in key.split(","))
+
+    def load(self, name: str, max_age: float) -> Dict[Tuple[int, ...], int]:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM conversations WHERE updated_at < ?", (time.time() - max_age,)
+            )
+            self._conn.commit()
+            rows = self._conn.execute(
+                "SELECT key, state FROM conversations WHERE name = ?", (name,)
+            ).fetchall()
+        return {self._decode_key(key): state for key, state in rows}
+
+    def write_batch(self, items: Iterable[Tuple[str, Tuple[int, ...], Optional[int]]]):
+        """Записывает изменения одной транзакцией; состояние None удаляет запись"""
+        now = time.time()
+        upserts = []
+        deletions = []
+        for name, key, state in items:
+            if state is None:
+                deletions.append((name, self._encode_key(key)))
+            else:
+                upserts.append((name, self._encode_key(key), state, now))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO conversations (name, key, state, updated_at) VALUES (?, ?, ?, ?)",
+                upserts
+            )
+            self._conn.executemany("DELETE FROM conversations WHERE name = ? AND key = ?", deletions)
+            self._conn.commit()
+
+
+class SessionRecordStore(SQLiteStore):
+    """Компактные записи сессий подбора: выбор пользователя и идентификаторы мячей"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS sessions ("
+        " user_id INTEGER PRIMARY KEY,"
+        " level TEXT,"
+        " surface TEXT,"
+        " ball_ids TEXT NOT NULL,"
+        " last_seen REAL NOT NULL,"
+        " size INTEGER,"
+        " max_price REAL)"
+    )
+    # Колонки, добавленные после первой версии схемы: в старые базы добавляются при открытии
+    ADDED_COLUMNS = (("size", "INTEGER"), ("max_price", "REAL"))
+
+    # Разделитель идентификаторов мячей, который не встречается в названиях
+    ID_SEPARATOR = "\x1f"
+
+    def __init__(self, path: Union[str, Path]):
+        super().__init__(path)
+        with self._lock:
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+            for name, kind in self.ADDED_COLUMNS:
+                if name not in columns:
+                    self._conn.execute(f"ALTER TABLE sessions ADD COLUMN {name} {kind}")
+            self._conn.commit()
+
+    def load(self, user_id: int) -> Optional[tuple]:
+        """(level, surface, size, max_price, ball_ids, last_seen) или None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT level, surface, size, max_price, ball_ids, last_seen FROM sessions WHERE user_id = ?",
+                (user_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        level, surface, size, max_price, ball_ids, last_seen = row
+        return (level, surface, size, max_price,
+                tuple(ball_ids.split(self.ID_SEPARATOR)) if ball_ids else (), last_seen)
+
+    def write_batch(self, records: List[tuple], deletions: Iterable[int]):
+        """records: (user_id, level, surface, size, max_price, ball_ids, last_seen)"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO sessions "
+                "(user_id, level, surface, size, max_price, ball_ids, last_seen) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (user_id, level, surface, size, max_price, self.ID_SEPARATOR.join(ball_ids), last_seen)
+                    for user_id, level, surface, size, max_price, ball_ids, last_seen in records
+                ]
+            )
+            self._conn.executemany("DELETE FROM sessions WHERE user_id = ?", [(user_id,) for user_id in deletions])
+            self._conn.commit()
+
+    def delete_older_than(self, max_age: float) -> int:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM sessions WHERE last_seen < ?", (time.time() - max_age,))
+            self._conn.commit()
+        return cursor.rowcount
+
+
+class AnalyticsStore(SQLiteStore):
+    """Агрегированные счетчики статистики по интервалам времени и рабочим процессам"""
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS usage ("
+        " width INTEGER NOT NULL,"
+        " bucket INTEGER NOT NULL,"
+        " worker TEXT NOT NULL,"
+        " dimension TEXT NOT NULL,"
+        " value TEXT NOT NULL,"
+        " count INTEGER NOT NULL,"
+        " PRIMARY KEY (width, bucket, worker, dimension, value))"
+    )
+
+    def write_batch(self, worker: str, items: Iterable[Tuple[int, int, str, str, int]]):
+        """Прибавляет приращения (width, bucket, dimension, value, count) одной транзакцией"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO usage (width, bucket, worker, dimension, value, count) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (width, bucket, worker, dimension, value) "
+                "DO UPDATE SET count = count + excluded.count",
+                [(width, bucket, worker, dimension, value, count)
+                 for width, bucket, dimension, value, count in items]
+            )
+            self._conn.commit()
+
+    def seed_lifetime(self, lifetime_width: int, source_width: int):
+        """Заполняет счетчики за все время из source_width в базе, созданной до их появления.
+
+        Один запрос: выполняется, только если таких счетчиков еще нет, а INSERT OR IGNORE
+        не дает нескольким процессам, запущенным одновременно, посчитать историю дважды.
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO usage (width, bucket, worker, dimension, value, count) "
+                "SELECT ?, 0, '', dimension, value, SUM(count) FROM usage "
+                "WHERE width = ? AND NOT EXISTS (SELECT 1 FROM usage WHERE width = ?) "
+                "GROUP BY dimension, value",
+                (lifetime_width, source_width, lifetime_width)
+            )
+            self._conn.commit()
+
+    def rollup(self, width: int, since: float = 0.0) -> Dict[Tuple[str, str], int]:
+        """Сумма счетчиков всех рабочих процессов по интервалам, начавшимся не раньше since"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT dimension, value, SUM(count) FROM usage "
+                "WHERE width = ? AND bucket >= ? GROUP BY dimension, value",
+                (width, int(since))
+            ).fetchall()
+        return {(dimension, value): count for dimension, value, count in rows}
+
+    def delete_older_than(self, width: int, max_age: float) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM usage WHERE width = ? AND bucket < ?", (width, int(time.time() - max_age))
+            )
+            self._conn.commit()
+        return cursor.rowcount
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+from multiprocessing.process import BaseProcess
+from typing import Callable, List, Optional, Sequence
+
+from telegram import Bot, Update
+from telegram.error import NetworkError, RetryAfter, TelegramError
+
+from models import Config
+
+logger = logging.getLogger(__name__)
+
+# Точка входа рабочего процесса: номер процесса, число процессов и очередь обновлений в формате JSON
+WorkerTarget = Callable[[int, int, multiprocessing.Queue], None]
+
+
+def shard_key(update: Update) -> int:
+    """Чат обновления, а для inline-запросов - пользователь"""
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    if update.effective_user is not None:
+        return update.effective_user.id
+    return update.update_id
+
+
+def shard_of(update: Update, workers: int) -> int:
+    return shard_key(update) % workers
+
+
+class Supervisor:
+    """Получает обновления от Telegram и распределяет их по рабочим процессам.
+
+    Обновления одного чата всегда попадают в один и тот же процесс, поэтому состояние
+    разговора и сессия подбора остаются локальными для него. Кэш рекомендаций, file_id
+    и статистика общие: процессы работают с одними базами SQLite в режиме WAL.
+    Число процессов должно оставаться прежним между перезапусками, иначе чаты
+    окажутся в процессах без своих разговоров.
+    """
+
+    def __init__(self, token: str, target: WorkerTarget, workers: int,
+                 allowed_updates: Optional[Sequence[str]] = None, api_url: Optional[str] = None):
+        self.token = token
+        # Тот же сервер Bot API, что и у рабочих процессов (TELEGRAM_API_URL)
+        self.api_url = api_url
+        self.target = target
+        self.workers = workers
+        self.allowed_updates = allowed_updates
+        # spawn: дочерний процесс не наследует потоки журнала и соединения SQLite родителя
+        self._context = multiprocessing.get_context('spawn')
+        self.queues = [self._context.Queue(Config.WORKER_QUEUE_SIZE) for _ in range(workers)]
+        self.processes: List[Optional[BaseProcess]] = [None] * workers
+        self.dispatched = [0] * workers
+        self.restarts = 0
+        # Следующее ожидаемое обновление: все предыдущие уже переданы процессам
+        self.offset: Optional[int] = None
+
+    def _start_worker(self, index: int):
+        process = self._context.Process(
+            target=self.target, args=(index, self.workers, self.queues[index]), name=f"worker-{index}"
+        )
+        process.start()
+        self.processes[index] = process
+        logger.info("Started worker %s, pid %s", index, process.pid)
+
+    async def _watch(self):
+        """Перезапускает завершившиеся процессы; необработанные обновления ждут в их очередях"""
+        while True:
+            await asyncio.sleep(Config.WORKER_RESTART_DELAY)
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive():
+                    logger.error("Worker %s exited with code %s, restarting", index, process.exitcode)
+                    self.restarts += 1
+                    self._start_worker(index)
+
+    async def _dispatch(self, update: Update):
+        index = shard_of(update, self.workers)
+        payload = update.to_json()
+        try:
+            self.queues[index].put_nowait(payload)
+        except queue.Full:
+            # Процесс не успевает: опрос Telegram приостанавливается, пока в очереди нет места
+            await asyncio.to_thread(self.queues[index].put, payload)
+        self.dispatched[index] += 1
+
+    async def _poll(self, bot: Bot):
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=self.offset,
+                    timeout=Config.POLL_TIMEOUT,
+                    allowed_updates=self.allowed_updates,
+                )
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') \
+                    else float(e.retry_after)
+                logger.warning("Flood limit on getUpdates, pausing for %ss", retry_after)
+                await asyncio.sleep(retry_after)
+                continue
+            except NetworkError as e:
+                logger.warning("Error fetching updates: %s", e)
+                await asyncio.sleep(Config.POLL_RETRY_DELAY)
+                continue
+
+            for update in updates:
+                await self._dispatch(update)
+                self.offset = update.update_id + 1
+
+    async def _confirm_offset(self, bot: Bot):
+        """Подтверждает Telegram переданные обновления, как это делает Updater при остановке;
+        иначе после перезапуска последняя пачка придет и будет обработана повторно"""
+        if self.offset is None:
+            return
+        try:
+            await bot.get_updates(offset=self.offset, timeout=0, allowed_updates=self.allowed_updates)
+        except TelegramError as e:
+            logger.warning("Error confirming update offset %s: %s", self.offset, e)
+
+    def _stop_workers(self):
+        for worker_queue in self.queues:
+            try:
+                worker_queue.put(None, timeout=Config.WORKER_STOP_TIMEOUT)
+            except queue.Full:
+                pass
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            process.join(Config.WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                logger.warning("Worker %s did not stop in time, terminating", index)
+                process.terminate()
+                process.join()
+        logger.info("Workers stopped, updates dispatched: %s, restarts: %s", self.dispatched, self.restarts)
+
+    def _create_bot(self) -> Bot:
+        if self.api_url:
+            return Bot(self.token, base_url=self.api_url)
+        return Bot(self.token)
+
+    async def run(self):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except NotImplementedError:
+            pass
+
+        for index in range(self.workers):
+            self._start_worker(index)
+        watcher = asyncio.create_task(self._watch())
+        try:
+            async with self._create_bot() as bot:
+                # Вебхук и getUpdates взаимоисключающие
+                await bot.delete_webhook()
+                logger.info("Supervisor polling for updates with %s workers", self.workers)
+                try:
+                    await self._poll(bot)
+                finally:
+                    await self._confirm_offset(bot)
+        finally:
+            watcher.cancel()
+            await asyncio.gather(watcher, return_exceptions=True)
+            await asyncio.to_thread(self._stop_workers)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Модули проекта лежат в корне репозитория, как и при запуске python bot.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
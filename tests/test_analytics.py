@@ -0,0 +1,79 @@
+import asyncio
+from collections import Counter
+
+from analytics import HOUR, LIFETIME, MINUTE, BucketRing, UsageAnalytics
+from storage import AnalyticsStore
+
+
+def test_ring_counts_per_interval():
+    ring = BucketRing(MINUTE, 4)
+    ring.add(0, [('total', '')])
+    ring.add(59, [('total', ''), ('level', "Новичок")])
+    ring.add(60, [('total', '')])
+    assert ring.drain() == [
+        (0, Counter({('total', ''): 2, ('level', "Новичок"): 1})),
+        (60, Counter({('total', ''): 1})),
+    ]
+    assert ring.drain() == []
+
+
+def test_ring_drops_interval_overwritten_before_drain():
+    ring = BucketRing(MINUTE, 2)
+    ring.add(0, [('total', '')])
+    # Через полный оборот кольца та же ячейка занята новым интервалом
+    ring.add(2 * MINUTE, [('total', '')])
+    assert ring.dropped == 1
+    assert ring.drain() == [(2 * MINUTE, Counter({('total', ''): 1}))]
+
+
+def test_restore_returns_counts_to_their_interval():
+    ring = BucketRing(MINUTE, 4)
+    ring.add(0, [('total', '')])
+    drained = ring.drain()
+    ring.add(30, [('total', '')])
+    ring.restore(drained)
+    assert ring.drain() == [(0, Counter({('total', ''): 2}))]
+    assert ring.dropped == 0
+
+
+def test_restore_drops_counts_whose_slot_was_reused():
+    ring = BucketRing(MINUTE, 2)
+    ring.add(0, [('total', ''), ('level', "Средний")])
+    drained = ring.drain()
+    ring.add(2 * MINUTE, [('total', '')])
+    ring.restore(drained)
+    assert ring.dropped == 2
+    assert ring.drain() == [(2 * MINUTE, Counter({('total', ''): 1}))]
+
+
+class FailingStore(AnalyticsStore):
+    def __init__(self):
+        super().__init__(":memory:")
+        self.fail = True
+
+    def write_batch(self, worker, items):
+        if self.fail:
+            raise OSError("disk full")
+        super().write_batch(worker, items)
+
+
+def test_failed_flush_keeps_counts_for_next_flush():
+    store = FailingStore()
+    analytics = UsageAnalytics(store, clock=lambda: 10 * HOUR)
+    analytics.record("Новичок", "В зале", ["Ball"])
+    asyncio.run(analytics.flush())
+    assert analytics.flushes == 0
+
+    store.fail = False
+    asyncio.run(analytics.flush())
+    assert analytics.flushes == 1
+    assert store.rollup(LIFETIME)[('ball', "Ball")] == 1
+    assert store.rollup(MINUTE)[('total', '')] == 1
+
+
+def test_lifetime_is_seeded_once_from_hourly_history():
+    store = AnalyticsStore(":memory:")
+    store.write_batch("old", [(HOUR, 0, 'total', '', 5)])
+    UsageAnalytics(store)
+    UsageAnalytics(store)
+    assert store.rollup(LIFETIME) == {('total', ''): 5}
@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from cache import SingleFlight, TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ttl_cache_expires_entries():
+    clock = Clock()
+    cache = TTLCache(maxsize=10, ttl=5, clock=clock)
+    cache.set('a', 1)
+    clock.now = 4.9
+    assert cache.get('a') == 1
+    clock.now = 5
+    assert cache.get('a') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert len(cache) == 0
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.evictions == 1
+
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do('key', fetch) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ["value"] * 5
+    assert len(calls) == 1
+    assert (flight.calls, flight.shared) == (1, 4)
+    assert len(flight) == 0
+
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream failed")
+
+    async def scenario():
+        return await asyncio.gather(flight.do('key', failing), flight.do('key', failing),
+                                    return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flight.calls == 1
+
+
+def test_cancelled_waiter_does_not_cancel_shared_call():
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return "value"
+
+    async def scenario():
+        first = asyncio.create_task(flight.do('key', fetch))
+        second = asyncio.create_task(flight.do('key', fetch))
+        await asyncio.sleep(0.005)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == "value"
+
+
+def test_lead_future_is_forgotten_when_done():
+    flight = SingleFlight()
+
+    async def scenario():
+        future = flight.lead('key')
+        assert flight.join('key') is future
+        future.set_result(1)
+        await asyncio.sleep(0)
+        return flight.join('key')
+
+    assert asyncio.run(scenario()) is None
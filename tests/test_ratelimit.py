@@ -0,0 +1,114 @@
+import asyncio
+import time
+
+import pytest
+from telegram.error import RetryAfter
+
+from ratelimit import Priority, PriorityRateLimiter, TokenBucket
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2, capacity=2, now=0.0)
+    bucket.consume(0.0)
+    bucket.consume(0.0)
+    assert bucket.delay(0.0) == pytest.approx(0.5)
+    assert bucket.delay(0.5) == 0.0
+    assert bucket.is_full(1.0)
+
+
+async def run_with_limiter(limiter: PriorityRateLimiter, scenario):
+    await limiter.initialize()
+    try:
+        return await scenario()
+    finally:
+        await limiter.shutdown()
+
+
+def send(limiter, sent, name, chat_id=1, priority=Priority.INTERACTIVE):
+    async def callback():
+        sent.append(name)
+        return name
+
+    return limiter.process_request(callback, (), {}, 'sendMessage', {'chat_id': chat_id}, {'priority': priority})
+
+
+def test_interactive_requests_overtake_bulk():
+    limiter = PriorityRateLimiter(overall_rate=1000, chat_rate=100, chat_burst=1)
+    sent = []
+
+    async def scenario():
+        requests = [asyncio.create_task(send(limiter, sent, f"bulk-{index}", priority=Priority.BULK))
+                    for index in range(3)]
+        requests.append(asyncio.create_task(send(limiter, sent, "reply")))
+        return await asyncio.gather(*requests)
+
+    results = asyncio.run(run_with_limiter(limiter, scenario))
+    assert results == ["bulk-0", "bulk-1", "bulk-2", "reply"]
+    assert sent[0] == "reply"
+    assert sent[1:] == ["bulk-0", "bulk-1", "bulk-2"]
+    assert limiter.sent == 4
+
+
+def test_chat_limit_spaces_requests():
+    limiter = PriorityRateLimiter(overall_rate=1000, chat_rate=20, chat_burst=1)
+    sent = []
+
+    async def scenario():
+        started = time.perf_counter()
+        await asyncio.gather(*(send(limiter, sent, index) for index in range(3)))
+        return time.perf_counter() - started
+
+    # Первый запрос сразу, еще два - по одному за 1/20 секунды
+    assert asyncio.run(run_with_limiter(limiter, scenario)) >= 0.09
+    assert sent == [0, 1, 2]
+
+
+def test_other_chats_are_not_blocked_by_a_busy_chat():
+    limiter = PriorityRateLimiter(overall_rate=1000, chat_rate=1, chat_burst=1)
+    sent = []
+
+    async def scenario():
+        busy = [asyncio.create_task(send(limiter, sent, f"busy-{index}", chat_id=1)) for index in range(2)]
+        await asyncio.wait_for(send(limiter, sent, "other", chat_id=2), timeout=0.5)
+        for task in busy:
+            task.cancel()
+        await asyncio.gather(*busy, return_exceptions=True)
+
+    asyncio.run(run_with_limiter(limiter, scenario))
+    assert sent == ["busy-0", "other"]
+
+
+def test_retry_after_pauses_and_retries():
+    limiter = PriorityRateLimiter(overall_rate=1000, chat_rate=1000, chat_burst=10, max_retries=2)
+    attempts = []
+
+    async def callback():
+        attempts.append(time.perf_counter())
+        if len(attempts) == 1:
+            raise RetryAfter(0.1)
+        return "ok"
+
+    async def scenario():
+        return await limiter.process_request(callback, (), {}, 'sendMessage', {'chat_id': 1}, None)
+
+    assert asyncio.run(run_with_limiter(limiter, scenario)) == "ok"
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.09
+    assert limiter.retry_after_count == 1
+
+
+def test_retry_after_is_raised_after_max_retries():
+    limiter = PriorityRateLimiter(overall_rate=1000, chat_rate=1000, chat_burst=10, max_retries=1)
+    attempts = []
+
+    async def callback():
+        attempts.append(1)
+        raise RetryAfter(0.01)
+
+    async def scenario():
+        return await limiter.process_request(callback, (), {}, 'sendMessage', {'chat_id': None}, None)
+
+    with pytest.raises(RetryAfter):
+        asyncio.run(run_with_limiter(limiter, scenario))
+    assert len(attempts) == 2
+    assert limiter.sent == 0
@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+from resilience import CircuitBreaker, CircuitOpenError, ResilientCaller
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_caller(breaker, max_retries=0, **kwargs):
+    settings = dict(max_retries=max_retries, base_delay=0.0, max_delay=0.0,
+                    attempt_timeout=1.0, deadline=5.0, breaker=breaker, retry_on=(ConnectionError,))
+    settings.update(kwargs)
+    return ResilientCaller(**settings)
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=Clock())
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == breaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_lets_one_probe_through_after_reset_timeout():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 10
+    assert breaker.allow()
+    assert breaker.state == breaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_opens_circuit_again():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=10, clock=clock)
+    breaker.failures = 4
+    breaker.record_failure()
+    clock.now = 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    assert breaker.opened_at == 10
+    assert not breaker.allow()
+
+
+def test_released_probe_can_be_retried():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 10
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == breaker.HALF_OPEN
+    assert breaker.allow()
+
+
+def test_caller_retries_and_counts_one_failure():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    caller = make_caller(breaker, max_retries=2)
+    attempts = []
+
+    async def failing():
+        attempts.append(1)
+        raise ConnectionError("down")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(caller.call(failing))
+    assert len(attempts) == 3
+    assert caller.retries == 2
+    assert breaker.failures == 1
+    assert breaker.state == breaker.CLOSED
+
+
+def test_caller_does_not_retry_other_errors():
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=10)
+    caller = make_caller(breaker, max_retries=3)
+    attempts = []
+
+    async def invalid():
+        attempts.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        asyncio.run(caller.call(invalid))
+    assert len(attempts) == 1
+
+
+def test_caller_rejects_while_open():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    caller = make_caller(breaker)
+
+    async def never_called():
+        raise AssertionError("the call must not reach upstream")
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(caller.call(never_called))
+    assert caller.rejected == 1
+
+
+def test_attempt_timeout_is_retried():
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=10)
+    caller = make_caller(breaker, max_retries=1, attempt_timeout=0.01)
+    attempts = []
+
+    async def slow_then_fast():
+        attempts.append(1)
+        if len(attempts) == 1:
+            await asyncio.sleep(1)
+        return "ok"
+
+    assert asyncio.run(caller.call(slow_then_fast)) == "ok"
+    assert caller.retries == 1
+    assert breaker.failures == 0
+
+
+def test_cancelled_call_releases_probe():
+    clock = Clock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 10
+    caller = make_caller(breaker)
+
+    async def scenario():
+        task = asyncio.create_task(caller.call(lambda: asyncio.sleep(1)))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert breaker.state == breaker.HALF_OPEN
+    assert breaker.failures == 1
+    assert breaker.allow()
@@ -0,0 +1,118 @@
+import pytest
+
+from catalog import BallCatalog
+from models import HandballBall
+from search import SearchIndex, parse_query, stem
+
+
+def make_ball(name, level="Новичок", price=30.0, size="1", surface="В зале",
+              material="Синтетика", description="Мяч", features=()):
+    return HandballBall(name, level, price, material, size, description, surface, f"images/{name}.jpg", features)
+
+
+BALLS = (
+    make_ball("Kids Soft", price=19.99, size="0 (48-50 см)", surface="Универсальный",
+              description="Мягкий детский мяч"),
+    make_ball("Trainer", price=35.0, size="1-2-3", material="Кожа", description="Тренировочный мяч"),
+    make_ball("Street", level="Средний", price=42.5, size="2-3", surface="На улице",
+              description="Прочный мяч для улицы"),
+    make_ball("Match Pro", level="Профессионал", price=89.0, size="3", material="Натуральная кожа",
+              description="Профессиональный матчевый мяч"),
+)
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    return BallCatalog({'novice': list(BALLS[:2]), 'intermediate': [BALLS[2]], 'professional': [BALLS[3]]})
+
+
+@pytest.mark.parametrize('text, min_price, max_price', [
+    ("до 30 €", 0.0, 30.0),
+    ("от 20 до 40 евро", 20.0, 40.0),
+    ("дешевле 25,5", 0.0, 25.5),
+    ("от 50", 50.0, float('inf')),
+    ("20-40 €", 20.0, 40.0),
+])
+def test_parse_price(text, min_price, max_price):
+    query = parse_query(text)
+    assert (query.min_price, query.max_price) == (min_price, max_price)
+    assert query.terms == ()
+
+
+@pytest.mark.parametrize('text, sizes', [
+    ("размер 2", {2}),
+    ("3-го размера", {3}),
+    ("мяч от 2 до 3 размера", {2, 3}),
+    ("с 1 по 2 размер", {1, 2}),
+    ("размер 1-3", {1, 2, 3}),
+])
+def test_parse_sizes_before_price(text, sizes):
+    query = parse_query(text)
+    assert query.sizes == frozenset(sizes)
+    assert (query.min_price, query.max_price) == (0.0, float('inf'))
+
+
+def test_parse_size_and_price_together():
+    query = parse_query("размер 2 до 50 €")
+    assert query.sizes == frozenset({2})
+    assert query.max_price == 50.0
+
+
+def test_price_keyword_inside_word_is_not_price():
+    query = parse_query("подо 30")
+    assert query.max_price == float('inf')
+
+
+@pytest.mark.parametrize('text, circumference', [
+    ("54 см", (54.0, 54.0)),
+    ("56-54 см", (54.0, 56.0)),
+    ("окружность от 48 до 50 см", (48.0, 50.0)),
+])
+def test_parse_circumference(text, circumference):
+    query = parse_query(text)
+    assert query.circumference == circumference
+    assert query.max_price == float('inf')
+    assert query.terms == ()
+
+
+def test_stem_keeps_minimum_length():
+    assert stem("детский") == "детск"
+    assert stem("мяч") == "мяч"
+
+
+def test_index_ranks_name_match_first():
+    index = SearchIndex(BALLS)
+    assert index.search("street")[0].name == "Street"
+
+
+def test_index_matches_prefix_of_stem():
+    # "детей" -> "дет" совпадает с "детск" из описания только как префикс
+    assert [ball.name for ball in SearchIndex(BALLS).search("для детей")] == ["Kids Soft"]
+
+
+def test_index_filters_by_price_and_size():
+    index = SearchIndex(BALLS)
+    assert [ball.name for ball in index.search("мяч до 40 €")] == ["Kids Soft", "Trainer"]
+    assert [ball.name for ball in index.search("мяч размер 3 до 50 €")] == ["Trainer", "Street"]
+
+
+def test_index_unknown_word_finds_nothing():
+    assert SearchIndex(BALLS).search("баскетбол") == ()
+
+
+def test_catalog_query_by_size_and_price_range(catalog):
+    assert [ball.name for ball in catalog.query({2, 3}, 30.0, 50.0)] == ["Trainer", "Street"]
+    assert [ball.name for ball in catalog.query(None, 0.0, 20.0)] == ["Kids Soft"]
+    assert catalog.query({5}) == ()
+
+
+def test_catalog_narrow_matches_precomputed_answers(catalog):
+    narrowed = catalog.narrow("Новичок", "В зале", sizes=(1,), max_price=50.0)
+    assert [ball.name for ball in narrowed] == ["Trainer"]
+    # Тот же результат без таблицы: минимальная цена отключает готовые ответы
+    assert catalog.narrow("Новичок", "В зале", sizes=(1,), min_price=0.01, max_price=50.0) == narrowed
+
+
+def test_catalog_search_by_circumference(catalog):
+    assert [ball.name for ball in catalog.search("48-50 см")] == ["Kids Soft", "Trainer"]
+    assert [ball.name for ball in catalog.search("58 см до 50 €")] == ["Trainer", "Street"]
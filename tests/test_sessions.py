@@ -0,0 +1,176 @@
+import asyncio
+import time
+
+import pytest
+
+from sessions import SessionStore
+from storage import SessionRecordStore
+
+
+class Clock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock(time.time())
+
+
+@pytest.fixture
+def backend(tmp_path):
+    store = SessionRecordStore(tmp_path / "sessions.sqlite3")
+    yield store
+    store.close()
+
+
+class CountingBackend:
+    """Обертка над хранилищем, считающая записанные сессии"""
+
+    def __init__(self, store: SessionRecordStore):
+        self.store = store
+        self.written = []
+
+    def load(self, user_id):
+        return self.store.load(user_id)
+
+    def write_batch(self, records, deletions):
+        self.written.extend(record[0] for record in records)
+        self.store.write_batch(records, deletions)
+
+    def delete_older_than(self, max_age):
+        return self.store.delete_older_than(max_age)
+
+
+def test_idle_session_is_evicted(clock):
+    sessions = SessionStore(10, idle_ttl=60, clock=clock)
+    sessions.create(1).level = "Новичок"
+    clock.now += 59
+    assert asyncio.run(sessions.get(1)) is not None
+    clock.now += 60
+    assert asyncio.run(sessions.get(1)) is None
+    assert sessions.idle_evictions == 1
+    assert len(sessions) == 0
+
+
+def test_lru_evicts_least_recently_used(clock):
+    sessions = SessionStore(2, idle_ttl=60, clock=clock)
+    sessions.create(1)
+    sessions.create(2)
+    asyncio.run(sessions.get(1))
+    sessions.create(3)
+    assert asyncio.run(sessions.get(2)) is None
+    assert asyncio.run(sessions.get(1)) is not None
+    assert sessions.lru_evictions == 1
+
+
+def test_lru_evicted_session_is_loaded_back(clock, backend):
+    async def scenario():
+        sessions = SessionStore(1, idle_ttl=60, backend=backend, clock=clock)
+        session = sessions.create(1)
+        session.level, session.size, session.ball_ids = "Средний", 2, ("A", "B")
+        # Вытесненная до записи сессия не теряется: она записывается при flush
+        sessions.create(2)
+        await sessions.flush()
+        restored = await sessions.get(1)
+        return sessions, restored
+
+    sessions, restored = asyncio.run(scenario())
+    assert (restored.level, restored.size, restored.ball_ids) == ("Средний", 2, ("A", "B"))
+    assert sessions.loads == 1
+
+
+def test_sessions_are_reloaded_after_restart(clock, backend):
+    async def first_run():
+        sessions = SessionStore(10, idle_ttl=60, backend=backend, clock=clock)
+        session = sessions.create(7)
+        session.level, session.surface, session.max_price = "Новичок", "В зале", 30.0
+        await sessions.flush()
+
+    asyncio.run(first_run())
+    clock.now += 30
+    restored = asyncio.run(SessionStore(10, idle_ttl=60, backend=backend, clock=clock).get(7))
+    assert restored.as_user_data() == {'level': "Новичок", 'surface': "В зале", 'max_price': 30.0}
+
+
+def test_expired_session_on_disk_is_not_loaded(clock, backend):
+    async def first_run():
+        sessions = SessionStore(10, idle_ttl=60, backend=backend, clock=clock)
+        sessions.create(7).level = "Новичок"
+        await sessions.flush()
+
+    asyncio.run(first_run())
+    clock.now += 61
+    sessions = SessionStore(10, idle_ttl=60, backend=backend, clock=clock)
+    assert asyncio.run(sessions.get(7)) is None
+    assert sessions.idle_evictions == 1
+
+
+def test_dropped_session_is_deleted_from_disk(clock, backend):
+    async def scenario():
+        sessions = SessionStore(10, idle_ttl=60, backend=backend, clock=clock)
+        sessions.create(7).level = "Новичок"
+        await sessions.flush()
+        sessions.drop(7)
+        await sessions.flush()
+
+    asyncio.run(scenario())
+    assert backend.load(7) is None
+
+
+def test_unchanged_session_is_rewritten_only_after_touch_interval(clock, backend):
+    counting = CountingBackend(backend)
+
+    async def scenario():
+        sessions = SessionStore(10, idle_ttl=600, backend=counting, clock=clock, touch_interval=60)
+        sessions.create(1).level = "Новичок"
+        await sessions.flush()
+        clock.now += 10
+        await sessions.get(1)
+        await sessions.flush()
+        clock.now += 60
+        await sessions.get(1)
+        await sessions.flush()
+
+    asyncio.run(scenario())
+    assert counting.written == [1, 1]
+
+
+def test_changed_session_is_written_at_once(clock, backend):
+    counting = CountingBackend(backend)
+
+    async def scenario():
+        sessions = SessionStore(10, idle_ttl=600, backend=counting, clock=clock, touch_interval=60)
+        sessions.create(1).level = "Новичок"
+        await sessions.flush()
+        clock.now += 1
+        (await sessions.get(1)).surface = "В зале"
+        await sessions.flush()
+
+    asyncio.run(scenario())
+    assert counting.written == [1, 1]
+    assert backend.load(1)[1] == "В зале"
+
+
+def test_purge_deletes_only_expired_rows(clock, backend):
+    async def scenario():
+        # Пользователь 1 был до перезапуска и больше не вернулся
+        clock.now -= 100
+        before_restart = SessionStore(10, idle_ttl=60, backend=backend, clock=clock)
+        before_restart.create(1)
+        await before_restart.flush()
+
+        clock.now += 100
+        sessions = SessionStore(10, idle_ttl=60, backend=backend, clock=clock, touch_interval=10)
+        sessions.create(2)
+        await sessions.flush()
+        return sessions, await sessions.purge()
+
+    sessions, purged = asyncio.run(scenario())
+    assert purged == 1
+    assert backend.load(1) is None
+    assert backend.load(2) is not None
+    assert sessions.purged == 1
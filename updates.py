@@ -0,0 +1,94 @@
+import asyncio
+from typing import Any, Awaitable, Dict, Hashable, List, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class BackpressureQueue(asyncio.Queue):
+    """Очередь обновлений с ограничением числа одновременно обрабатываемых элементов.
+
+    Application забирает обновление из очереди и сразу запускает его обработку в отдельной
+    задаче, поэтому одного maxsize недостаточно. Здесь get() ждет, пока число взятых, но
+    еще не завершенных (task_done) обновлений не опустится ниже max_in_flight. Пока
+    обработчик не успевает, очередь заполняется и получение новых обновлений от Telegram
+    приостанавливается.
+    """
+
+    def __init__(self, maxsize: int, max_in_flight: int):
+        super().__init__(maxsize)
+        self.max_in_flight = max_in_flight
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+
+    async def get(self) -> Any:
+        await self._slots.acquire()
+        try:
+            item = await super().get()
+        except BaseException:
+            self._slots.release()
+            raise
+        self.in_flight += 1
+        return item
+
+    def task_done(self):
+        super().task_done()
+        self.in_flight = max(0, self.in_flight - 1)
+        self._slots.release()
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка внутри одного чата.
+
+    Обновления разных чатов обрабатываются одновременно (не больше max_concurrent_updates),
+    а обновления одного чата - строго по очереди, чтобы ConversationHandler видел их
+    в том же порядке, в каком их отправил пользователь.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # ключ чата -> [блокировка, число обновлений чата в обработке или ожидании]
+        self._chats: Dict[Hashable, List[Any]] = {}
+
+    @staticmethod
+    def _chat_key(update: object) -> Optional[Hashable]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return ('user', update.effective_user.id)
+        return None
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._chat_key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # Блокировка чата берется до общего семафора: задачи запускаются в порядке
+            # поступления обновлений, а asyncio.Lock пропускает ожидающих по очереди
+            async with entry[0]:
+                await super().process_update(update, coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chats[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @property
+    def active_chats(self) -> int:
+        return len(self._chats)